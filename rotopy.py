@@ -8,188 +8,536 @@ RotoPy: Combine PNG or JPEG files in a folder into a movie file.
 # pip install opencv-python
 
 # External application pre-requisites:
-# exiftool (https://exiftool.org/) and ffmpeg (https://ffmpeg.org/) must be installed
+# ffmpeg (https://ffmpeg.org/) must be installed
+# exiftool (https://exiftool.org/) is only needed with --exiftool
 # The directories for these applications must be added to the PATH environment variable
 
-import subprocess
-import json
 import os
-import shutil
-import errno
 import sys
 import argparse
 import traceback
-import glob
-from datetime import datetime
+import time
+from fractions import Fraction
 import cv2
-
-EXIF_TOOL_CMD = "exiftool.exe"
-FFMPEG_CMD = "ffmpeg.exe"
-DEFAULT_MOVIE_FILENAME = "output.mkv"
-DEFAULT_BACKUP_DIR = "bak"
-DEFAULT_PNG_EXTENSION = "png"
-DEFAULT_JPEG_EXTENSION = "jpg"
-
-# Exit Errors
-ERR_MISSING_DIR = 1001
-ERR_INVALID_MOVIE_EXT = 1002
-ERR_USUPPORTED_MOVIE_EXT = 1003
-ERR_FRAMERATE_OUT_OF_RANGE = 1004
-ERR_USER_EXIT = 1004
-ERR_NO_PNG_FOR_JSON = 1005
-ERR_RENAME_DUPLICATE = 1006
-ERR_NO_JSON_FOR_ANNOTATE = 1007
-ERR_NO_PNG_TO_CONVERT = 1008
-
-# Message levels
-MESSAGE_ERROR = 0
-MESSAGE_INFO = 1
-MESSAGE_WARN = 2
-MESSAGE_DEBUG = 3
-
-# Annotation defaults
-TOP_BAR = 30
-TEXT_OFFSET_X = 10
-TEXT_OFFSET_Y = 20
-TEXT_FONTSCALE = 0.2
-TEXT_FONTFACE = cv2.FONT_HERSHEY_SIMPLEX
-
-# Input arguments
-VERBOSE_MODE = False
-INPUT_DIR = ""
-OUTPUT_DIR = ""
-RENAME_MODE = False
-SKIPJSON_MODE = False
-KEEPJSON_MODE = False
-ANNOTATE_MODE = False
-MOVIE_FILE = ""
-FRAMERATE_VAL = 0
-OVERWRITE_MOVIE_MODE = False
-SKIPMOVIE_MODE =False
-
-def log_message(level, message):
+import rotopy_settings as settings
+from rotopy_common import DEFAULT_PNG_EXTENSION, DEFAULT_MANIFEST_FILENAME, DEFAULT_INDEX_FILENAME, \
+DEFAULT_RENAME_JOURNAL_FILENAME, DEFAULT_FRAMERATE, PREVIEW_IMREAD_FLAGS, ERR_MISSING_DIR, \
+ERR_FRAMERATE_OUT_OF_RANGE, ERR_USER_EXIT, ERR_NO_PNG_FOR_JSON, ERR_NO_PNG_TO_CONVERT, ERR_JOBS_OUT_OF_RANGE, \
+ERR_FFMPEG_FAILED, ERR_INFLIGHT_OUT_OF_RANGE, ERR_PREVIEW_OUT_OF_RANGE, ERR_SEGMENTS_OUT_OF_RANGE, \
+ERR_WATCH_OUT_OF_RANGE, ERR_INVALID_OUTPUT, ERR_DEDUP_OUT_OF_RANGE, MESSAGE_ERROR, MESSAGE_INFO, MESSAGE_WARN, \
+MESSAGE_DEBUG, log_message, RotopyError, pb_show, RunStats, RUN_STATS, natural_sort_key
+from rotopy_metadata import get_png_tags, create_exif_backend, sd_extract_parameters, save_metadata_record, MetadataIndex, \
+png_modify_date, create_json_file, remove_json_files
+from rotopy_index import FRAME_EXTENSIONS, FrameIndex, BuildManifest, RenameJournal, RenamePlan, undo_renames
+from rotopy_writers import JPEG_EXTENSIONS, FfmpegFrameWriter, FfmpegJpegWriter, segment_file_path, \
+concat_movie_files, get_movie_file_path, preview_encoder_args, prepare_movie_file, parse_output_target, \
+create_frame_writer, check_movie_file_extension, check_frame
+from rotopy_frames import DEDUP_HASH_ROWS, DEFAULT_DEDUP_THRESHOLD, frame_hash, FrameDeduplicator, annotate_image, \
+write_jpeg_file, convert_png_files, stream_jpeg_files
+
+# the API of rotopy, re-exported from the modules it is split into
+__all__ = ['RotopyConfig', 'RotopyError', 'MovieWriter', 'main', 'get_png_tags', 'sd_extract_parameters', 'log_message', \
+'MESSAGE_ERROR', 'MESSAGE_WARN', 'MESSAGE_INFO', 'MESSAGE_DEBUG']
+
+# EXIF tags to be extracted and the number of files read per exiftool command
+EXIF_TAGS = ["-SourceFile", "-Datemodify", "-FileModifyDate", "-Parameters", "-ImageWidth", "-ImageHeight"]
+EXIF_BATCH_SIZE = 256
+
+# the last chunk of every complete PNG file
+PNG_IEND_CHUNK = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+# --watch polls the input directory every DEFAULT_WATCH_INTERVAL seconds and rebuilds the movie file
+# as <moviefile>_watch before replacing it
+DEFAULT_WATCH_INTERVAL = 5
+WATCH_MOVIE_SUFFIX = "_watch"
+# once there are WATCH_MERGE_SEGMENTS segments they are joined into one, so each poll joins a bounded number of files
+WATCH_MERGE_SEGMENTS = 16
+
+def png_file_complete(png_file_path):
     """
-    log_message(level, message)
-    Display messages as follows:
-    level = MESSAGE_ERROR: Error - always displayed
-    level = MESSAGE_INFO: Information - always displayed
-    level = MESSAGE_WARN: Warning - always displayed
-    level = MESSAGE_DEBUG: Debug - displayed only if verbose_mode is True
+    png_file_complete(png_file_path)
+    return True if PNG file png_file_path ends with its IEND chunk, i.e. it has been completely written
     """
-
-    if level is MESSAGE_DEBUG:
-        if VERBOSE_MODE is True:
-            print("DEBUG: " + message)
-    elif level is MESSAGE_WARN:
-        print("Warning: " +  message)
-    elif level is MESSAGE_INFO:
-        print(message)
-    elif level is MESSAGE_ERROR:
-        print("Error: " + message, file=sys.stderr)
-
-def get_png_exif_tags(exif_file_path, exif_tags):
+    try:
+        with open(png_file_path, 'rb') as png_file:
+            png_file.seek(-len(PNG_IEND_CHUNK), os.SEEK_END)
+            return png_file.read() == PNG_IEND_CHUNK
+    except OSError:
+        # removed, or too short to hold an IEND chunk yet
+        return False
+
+# the watched directory, the movie file, its segments and the frames already added
+# pylint: disable-next=too-many-instance-attributes
+class MovieWatcher:
     """
-    get_png_exif_tags(exif_path_file, exif_tags)
-    return the EXIF tags defined in str list exif_tags
+    MovieWatcher(input_directory_path, output_directory_path, metadata_index)
+    --watch: poll the input directory for new PNG files and append them to the movie file as they arrive
+    Each batch of new frames is encoded into its own segment movie file, then the movie file is rebuilt from all
+    the segments with the concat demuxer (without re-encoding) and replaced, so no frame is encoded twice
+    Every WATCH_MERGE_SEGMENTS batches the segments are joined into one base segment, so the list stays short
+    A PNG file is only read once it ends with its IEND chunk and its size and modify time are unchanged
+    since the previous poll, so that files still being written by the generator are left alone
     """
-    exiftool_cmd = [EXIF_TOOL_CMD, "-json"] + exif_tags + [exif_file_path]
-    try:
-        exif_data = subprocess.check_output(exiftool_cmd)
-    except subprocess.CalledProcessError as exif_e:
-        log_message(MESSAGE_ERROR, f"exiftool returned a non-zero exit status: {exif_e.returncode}")
-        sys.exit(exif_e.returncode)  # Use a non-zero exit code to indicate an error
 
-    exif_data_json = exif_data.decode('utf-8')
-    return json.loads(exif_data_json)[0]
-
-def sd_extract_parameters(sd_parameters_text):
+    def __init__(self, input_directory_path, output_directory_path, metadata_index=None):
+        self.input_directory_path = input_directory_path
+        self.output_directory_path = output_directory_path
+        self.metadata_index = metadata_index
+        self.movie_file_path = get_movie_file_path(output_directory_path, settings.MOVIE_FILE, settings.PREVIEW_VAL)
+        self.framerate = Fraction(str(settings.FRAMERATE_VAL if settings.FRAMERATE_VAL is not None else DEFAULT_FRAMERATE))
+        self.encoder_args = preview_encoder_args(self.movie_file_path) if settings.PREVIEW_VAL is not None else None
+        self.frame_files = []
+        # the segment movie files of the movie file and their durations
+        self.segment_file_paths = []
+        self.segment_durations = []
+        self.segment_number = 0
+        self.pending = {}
+
+    def new_frames(self):
+        """
+        new_frames()
+        return the PNG files that have been completely written since the previous call, in order
+        """
+        frame_index = FrameIndex(self.input_directory_path, settings.RECURSIVE_MODE)
+        with RUN_STATS.timer("scan", 0):
+            frame_index.scan()
+        appended = set(self.frame_files)
+        pending = {}
+        ready_files = []
+        for png_file in frame_index.files({"." + DEFAULT_PNG_EXTENSION}):
+            if png_file in appended:
+                continue
+            png_stat = frame_index.stat(png_file)
+            pending[png_file] = (png_stat.st_size, png_stat.st_mtime_ns)
+            if self.pending.get(png_file) == pending[png_file] and png_file_complete(frame_index.path(png_file)):
+                ready_files.append(png_file)
+                del pending[png_file]
+        self.pending = pending
+        return ready_files
+
+    def append(self, png_files, exif_backend):
+        """
+        append(png_files, exif_backend)
+        create the metadata of PNG files png_files with exif_backend if required,
+        encode them into a new segment and rebuild the movie file from all the segments
+        """
+        if self.frame_files and natural_sort_key(png_files[0]) < natural_sort_key(self.frame_files[-1]):
+            log_message(MESSAGE_WARN, f"{png_files[0]} arrived after {self.frame_files[-1]} \
+and is appended to the end of the movie")
+
+        if settings.SKIPJSON_MODE is False:
+            png_file_paths = [os.path.join(self.input_directory_path, png_file) for png_file in png_files]
+            for batch_start in range(0, len(png_files), EXIF_BATCH_SIZE):
+                with RUN_STATS.timer("metadata", len(png_file_paths[batch_start:batch_start + EXIF_BATCH_SIZE])):
+                    batch_tags = exif_backend.read_tags(png_file_paths[batch_start:batch_start + EXIF_BATCH_SIZE], \
+EXIF_TAGS)
+                for png_file, png_file_path in zip(png_files[batch_start:batch_start + EXIF_BATCH_SIZE], \
+png_file_paths[batch_start:batch_start + EXIF_BATCH_SIZE]):
+                    with RUN_STATS.timer("json"):
+                        create_json_file(png_file, batch_tags.get(png_file_path, {}), self.output_directory_path, \
+self.metadata_index)
+
+        with FfmpegFrameWriter(segment_file_path(self.movie_file_path, self.segment_number), self.framerate, \
+self.encoder_args) as frame_writer:
+            convert_png_files(png_files, self.input_directory_path, self.output_directory_path, frame_writer, \
+self.metadata_index)
+        if frame_writer.returncode != 0:
+            raise RotopyError(f"ffmpeg returned a non-zero exit status: {frame_writer.returncode} \
+- consider using --verbose", ERR_FFMPEG_FAILED)
+        self.add_segment(Fraction(len(png_files)) / self.framerate)
+        self.frame_files = self.frame_files + png_files
+
+        if len(self.segment_file_paths) >= WATCH_MERGE_SEGMENTS:
+            # the segments are joined into a base segment once, instead of on every later poll
+            self.join_segments(segment_file_path(self.movie_file_path, self.segment_number))
+            segment_durations = self.segment_durations
+            self.remove_segments()
+            self.add_segment(sum(segment_durations))
+
+        # the movie file is only replaced once the new one is complete, so it can be watched meanwhile
+        self.join_segments(self.watch_movie_file_path())
+        os.replace(self.watch_movie_file_path(), self.movie_file_path)
+        log_message(MESSAGE_INFO, f"\nAppended {len(png_files)} frames to {self.movie_file_path} \
+({len(self.frame_files)} frames)")
+
+    def add_segment(self, segment_duration):
+        """
+        add_segment(segment_duration)
+        add the segment movie file just written, of segment_duration seconds, to the end of the movie file
+        """
+        self.segment_file_paths.append(segment_file_path(self.movie_file_path, self.segment_number))
+        self.segment_durations.append(segment_duration)
+        self.segment_number = self.segment_number + 1
+
+    def join_segments(self, joined_file_path):
+        """
+        join_segments(joined_file_path)
+        join the segment movie files into joined_file_path without re-encoding them
+        """
+        with RUN_STATS.timer("finish", 0):
+            returncode = concat_movie_files(joined_file_path, self.segment_file_paths, self.segment_durations)
+        if returncode != 0:
+            raise RotopyError(f"ffmpeg returned a non-zero exit status: {returncode} \
+- consider using --verbose", ERR_FFMPEG_FAILED)
+
+    def watch_movie_file_path(self):
+        """
+        watch_movie_file_path()
+        return the path of the movie file being rebuilt
+        """
+        movie_file_name, movie_file_extension = os.path.splitext(self.movie_file_path)
+        return movie_file_name + WATCH_MOVIE_SUFFIX + movie_file_extension
+
+    def remove_segments(self):
+        """
+        remove_segments()
+        delete the segment movie files
+        """
+        for segment_file in self.segment_file_paths:
+            if os.path.isfile(segment_file):
+                os.remove(segment_file)
+        self.segment_file_paths = []
+        self.segment_durations = []
+
+    def run(self):
+        """
+        run()
+        append the new PNG files to the movie file every WATCH_VAL seconds until interrupted (Ctrl-C)
+        then delete the segment movie files, also if appending fails
+        """
+        prepare_movie_file(self.movie_file_path, settings.OVERWRITE_MOVIE_MODE)
+        log_message(MESSAGE_INFO, f"Watching {self.input_directory_path} for new PNG files every {settings.WATCH_VAL} seconds \
+- press Ctrl-C to stop")
+        try:
+            with create_exif_backend() as exif_backend:
+                while True:
+                    png_files = self.new_frames()
+                    if png_files:
+                        self.append(png_files, exif_backend)
+                    time.sleep(settings.WATCH_VAL)
+        except KeyboardInterrupt:
+            # a segment being encoded when interrupted is not part of the movie file
+            log_message(MESSAGE_INFO, f"\nStopped watching - {self.movie_file_path} has {len(self.frame_files)} frames")
+        finally:
+            # including the segment and the movie file being written when stopped
+            self.segment_file_paths.append(segment_file_path(self.movie_file_path, self.segment_number))
+            self.segment_file_paths.append(self.watch_movie_file_path())
+            self.remove_segments()
+
+# one attribute per command line option
+# pylint: disable-next=too-many-instance-attributes
+class RotopyConfig:
     """
-    sd_extract_parameters(sd_parameters_text)
-    return the dict associated with the comma separated sd_parameters_text
+    RotopyConfig(**settings)
+    The settings of a rotopy run, named as the command line options (see CONFIG_SETTINGS)
+    e.g. RotopyConfig(input_dir="frames", annotate=True, framerate=12)
+    apply() makes them the settings used by main() and the rest of the command line
     """
-    sd_extracted_parameters = {}
-    sd_key_mapping = {
-        "Sampler" : "Sampler",
-        "Model" : "Model",
-        "Steps": "Steps",
-        "Seed": "Seed",
-        "CFG scale": "CFG scale",
-        "Denoising strength": "Denoising strength"
-    }
-    for sd_line in sd_parameters_text.split(','):
-        for sd_key in sd_key_mapping:
-            if sd_key in sd_line:
-                sd_value = sd_line.split(':')[1].strip()
-                sd_extracted_parameters[sd_key_mapping[sd_key]] = sd_value
-    return sd_extracted_parameters
-
-def pb_show(pb_count, pb_total, pb_suffix):
+
+    # one keyword argument per command line option
+    # pylint: disable-next=too-many-arguments,too-many-locals
+    def __init__(self, *, verbose=False, input_dir=None, output_dir=None, rename=False, skipjson=False, \
+keepjson=False, annotate=False, moviefile=None, framerate=None, overwritemovie=False, skipmovie=False, \
+exiftool=False, jobs=1, keepjpeg=False, incremental=False, metadataindex=False, exportjson=False, inflight=None, \
+profile=False, statsjson=None, preview=None, previewstep=1, segments=1, recursive=False, filesfrom=None, \
+undorename=False, watch=None, outputs=None, dedup=None):
+        self.verbose = verbose
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.rename = rename
+        self.skipjson = skipjson
+        self.keepjson = keepjson
+        self.annotate = annotate
+        self.moviefile = moviefile
+        self.framerate = framerate
+        self.overwritemovie = overwritemovie
+        self.skipmovie = skipmovie
+        self.exiftool = exiftool
+        self.jobs = jobs
+        self.keepjpeg = keepjpeg
+        self.incremental = incremental
+        self.metadataindex = metadataindex
+        self.exportjson = exportjson
+        self.inflight = inflight
+        self.profile = profile
+        self.statsjson = statsjson
+        self.preview = preview
+        self.previewstep = previewstep
+        self.segments = segments
+        self.recursive = recursive
+        self.filesfrom = filesfrom
+        self.undorename = undorename
+        self.watch = watch
+        self.outputs = outputs
+        self.dedup = dedup
+
+    @classmethod
+    def from_args(cls, parsed_args):
+        """
+        from_args(parsed_args)
+        return the RotopyConfig of the command line arguments parsed_args parsed by argparse
+        """
+        return cls(**{setting_name: getattr(parsed_args, setting_name) for setting_name in settings.CONFIG_SETTINGS})
+
+    @classmethod
+    def from_globals(cls):
+        """
+        from_globals()
+        return the RotopyConfig of the input arguments currently set
+        """
+        return cls(**{setting_name: getattr(settings, global_name) \
+for setting_name, global_name in settings.CONFIG_SETTINGS.items()})
+
+    def apply(self):
+        """
+        apply()
+        set the input arguments to the settings
+        """
+        for setting_name, global_name in settings.CONFIG_SETTINGS.items():
+            setattr(settings, global_name, getattr(self, setting_name))
+
+    def validate(self):
+        """
+        validate()
+        check the settings, raising a RotopyError if any is out of range
+        """
+        # movie_file containers:
+        # Recommended mp4|mkv => H.264 - MPEG-4 AVC (part 10)(avc1)
+        # Not recommended - flv => (FLV1)
+        # Not recommended - avi => MPEG-4 Video (FMP4) (non-H.264)
+        # Not supported - mpg => ERROR: MPEG-1/2 does not support 5/1 fps
+
+        if self.moviefile is not None:
+            check_movie_file_extension(self.moviefile)
+
+        if self.framerate is not None:
+            if self.framerate < 1 or self.framerate > 30:
+                raise RotopyError(f"frame rate value {self.framerate} is out of range 1..30", ERR_FRAMERATE_OUT_OF_RANGE)
+
+        if self.jobs < 1:
+            raise RotopyError(f"number of jobs {self.jobs} must be at least 1", ERR_JOBS_OUT_OF_RANGE)
+
+        if self.preview is not None and self.preview not in PREVIEW_IMREAD_FLAGS:
+            raise RotopyError(f"preview reduction {self.preview} must be one of 2, 4 or 8", ERR_PREVIEW_OUT_OF_RANGE)
+
+        if self.previewstep < 1:
+            raise RotopyError(f"preview step {self.previewstep} must be at least 1", ERR_PREVIEW_OUT_OF_RANGE)
+
+        if self.segments < 1:
+            raise RotopyError(f"number of segments {self.segments} must be at least 1", ERR_SEGMENTS_OUT_OF_RANGE)
+
+        if self.inflight is not None and self.inflight < 1:
+            raise RotopyError(f"number of frames in flight {self.inflight} must be at least 1", ERR_INFLIGHT_OUT_OF_RANGE)
+
+        if self.watch is not None and self.watch <= 0:
+            raise RotopyError(f"watch interval {self.watch} must be more than 0 seconds", ERR_WATCH_OUT_OF_RANGE)
+
+        for output_target in self.outputs if self.outputs is not None else []:
+            parse_output_target(output_target)
+
+        if self.dedup is not None and (self.dedup < 0 or self.dedup > DEDUP_HASH_ROWS * DEDUP_HASH_ROWS):
+            raise RotopyError(f"dedup threshold {self.dedup} is out of range \
+0..{DEDUP_HASH_ROWS * DEDUP_HASH_ROWS} bits", ERR_DEDUP_OUT_OF_RANGE)
+
+# the settings, statistics and writers of one movie file
+# pylint: disable-next=too-many-instance-attributes
+class MovieWriter:
     """
-    pb_show(pb_count, pb_total, pb_suffix):
-    Display progress bar using code from: https://www.geeksforgeeks.org/progress-bars-in-python/
-    pb_count is the counter value
-    pb_total is the total value
-    pb_suffix is the suffix text e.g. count
+    MovieWriter(movie_file_path, config)
+    Encode frames handed over in memory (e.g. straight from a generation pipeline) into a movie file
+    without writing or reading any PNG file
+    Each frame is a BGR NumPy array with optional parameters: a dict as extracted by sd_extract_parameters
+    or the A1111 parameters text, used to annotate the frame with config.annotate
+    The frames are streamed into ffmpeg as they arrive, so they must all have the same size
+    movie_file_path defaults to config.moviefile (or output.mkv) and a relative path is in config.output_dir
+    (or the current directory)
+    config (a RotopyConfig) is kept by the writer, so writers with different settings can be used at the same time -
+    annotate, framerate, overwritemovie, keepjpeg, preview, previewstep, outputs, dedup, profile and statsjson are used
+    Invalid settings, a missing output_dir, frames that are not BGR images (uint8 arrays of 3 channels),
+    frames of different sizes and ffmpeg failures raise a RotopyError (a ValueError)
+    Use as a context manager so that ffmpeg finishes the movie file afterwards
     """
-    pb_bar_length = 100
-    pb_filled_up_length = int(round(pb_bar_length * pb_count / pb_total))
-    pb_percentage = round(100.0 * pb_count / pb_total, 1)
-    pb_bar = '=' * pb_filled_up_length + '-' * (pb_bar_length - pb_filled_up_length)
-    #sys.stdout.write('[%s] %s%s ...%s\r' %(pb_bar, pb_percentage, '%', pb_suffix))
-    sys.stdout.write(f'[{pb_bar}] {pb_percentage}% ...{pb_suffix}\r')
-    sys.stdout.flush()
-
-def main():
+
+    def __init__(self, movie_file_path=None, config=None):
+        self.config = config if config is not None else RotopyConfig()
+        self.config.validate()
+        if self.config.segments > 1:
+            log_message(MESSAGE_WARN, "segments are not used when writing frames from memory")
+        self.run_stats = RunStats()
+        if self.config.profile is True or self.config.statsjson is not None:
+            self.run_stats.start(self.config.profile, self.config.statsjson)
+
+        self.output_directory_path = self.config.output_dir if self.config.output_dir is not None else os.getcwd()
+        if os.path.isdir(self.output_directory_path) is False:
+            raise RotopyError(f"output directory {self.output_directory_path} does not exist", ERR_MISSING_DIR)
+        if movie_file_path is None:
+            movie_file_path = get_movie_file_path(self.output_directory_path, self.config.moviefile, \
+self.config.preview)
+        else:
+            check_movie_file_extension(movie_file_path)
+            movie_file_path = os.path.join(self.output_directory_path, movie_file_path)
+        self.frame_writer = create_frame_writer(movie_file_path, self.output_directory_path, self.config)
+        self.movie_file_path = movie_file_path
+        self.frame_count = 0
+        self.deduplicator = FrameDeduplicator(self.config.dedup) if self.config.dedup is not None else None
+        self.returncode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # an exception while the frames are written must not leave a truncated movie file behind
+        self.close(abort=exc_type is not None)
+
+    def write(self, image, parameters=None, frame_name=None):
+        """
+        write(image, parameters, frame_name)
+        annotate the BGR image with parameters (a dict or the A1111 parameters text) if required and
+        send it to ffmpeg - the caller's image is not changed
+        frame_name is shown in the annotation and names the JPEG file saved with keepjpeg [frameNNNNNN]
+        """
+        frame_number = self.frame_count
+        check_frame(image, frame_number + 1)
+        self.frame_count = self.frame_count + 1
+        if frame_number % self.config.previewstep != 0:
+            return
+        if frame_name is None:
+            frame_name = f"frame{frame_number:06d}"
+
+        if self.config.preview is not None:
+            with self.run_stats.timer("decode"):
+                height, width = image.shape[:2]
+                image = cv2.resize(image, (max(1, width // self.config.preview), \
+max(1, height // self.config.preview)), interpolation=cv2.INTER_AREA)
+        # hashed before it is annotated, as on the command line
+        duplicate_frame = self.deduplicator is not None and self.deduplicator.is_duplicate(frame_hash(image), image)
+        # a duplicate is only annotated to be saved as a JPEG file
+        if self.config.annotate is True and (duplicate_frame is False or self.config.keepjpeg is True):
+            if isinstance(parameters, str):
+                parameters = sd_extract_parameters(parameters)
+            with self.run_stats.timer("annotate"):
+                # the bar is drawn on a copy of the caller's image
+                image = annotate_image(frame_name, image if self.config.preview is not None else image.copy(), \
+parameters, self.config.preview)
+        if self.config.keepjpeg is True:
+            with self.run_stats.timer("jpeg"):
+                write_jpeg_file(frame_name, image, self.output_directory_path, self.run_stats, self.config.preview)
+
+        if duplicate_frame is True:
+            with self.run_stats.timer("encode"):
+                self.frame_writer.repeat()
+        else:
+            with self.run_stats.timer("encode"):
+                self.frame_writer.write(image)
+            self.run_stats.add_bytes("encode", bytes_written=image.nbytes)
+        self.run_stats.add_frames()
+
+    def write_frames(self, frames):
+        """
+        write_frames(frames)
+        write each frame of the iterable frames: a BGR image or an (image, parameters) or
+        (image, parameters, frame_name) tuple
+        return the number of frames written so far
+        """
+        for frame in frames:
+            if isinstance(frame, tuple):
+                self.write(*frame)
+            else:
+                self.write(frame)
+        return self.frame_count
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        signal the end of the frames and wait for ffmpeg to finish the movie file
+        abort True stops ffmpeg and deletes the unfinished movie file (and --outputs targets) instead
+        return the ffmpeg exit status (None if no frame was written or abort is True)
+        raise a RotopyError if ffmpeg returned a non-zero exit status
+        """
+        if self.frame_writer is None:
+            return self.returncode
+        if abort is True:
+            self.frame_writer.close(abort=True)
+            self.frame_writer = None
+            return None
+        frame_writer_close_start = time.perf_counter()
+        self.returncode = self.frame_writer.close()
+        self.frame_writer = None
+        self.run_stats.record("finish", time.perf_counter() - frame_writer_close_start, 0)
+        if os.path.isfile(self.movie_file_path):
+            self.run_stats.add_bytes("finish", bytes_written=os.path.getsize(self.movie_file_path))
+        self.run_stats.finish()
+        if self.returncode not in (0, None):
+            raise RotopyError(f"ffmpeg returned a non-zero exit status: {self.returncode} \
+- consider using --verbose", ERR_FFMPEG_FAILED)
+        return self.returncode
+
+# the stages of the command line run in order
+# pylint: disable-next=too-many-locals,too-many-branches,too-many-statements
+def main(config=None):
     """
     main function
+    config is the RotopyConfig of the run [the input arguments currently set]
     """
+    if config is None:
+        config = RotopyConfig.from_globals()
+    config.apply()
+
+    if settings.PROFILE_MODE is True or settings.STATSJSON_FILE is not None:
+        RUN_STATS.start(settings.PROFILE_MODE, settings.STATSJSON_FILE)
+
     # Outermost try
+    # the stages are nested in the error handling of the run
+    # pylint: disable-next=too-many-nested-blocks
     try:
         # Validation
-        if INPUT_DIR is not None:
-            if os.path.exists(INPUT_DIR) is False:
-                log_message(MESSAGE_ERROR, f"conversion directory {INPUT_DIR} does not exist")
+        if settings.INPUT_DIR is not None:
+            if os.path.exists(settings.INPUT_DIR) is False:
+                log_message(MESSAGE_ERROR, f"conversion directory {settings.INPUT_DIR} does not exist")
+                sys.exit(ERR_MISSING_DIR)  # Use a non-zero exit code to indicate an error
+        if settings.OUTPUT_DIR is not None:
+            if os.path.isdir(settings.OUTPUT_DIR) is False:
+                log_message(MESSAGE_ERROR, f"output directory {settings.OUTPUT_DIR} does not exist")
                 sys.exit(ERR_MISSING_DIR)  # Use a non-zero exit code to indicate an error
 
-        # movie_file containers:
-        # Recommended mp4|mkv => H.264 - MPEG-4 AVC (part 10)(avc1)
-        # Not recommended - flv => (FLV1)
-        # Not recommended - avi => MPEG-4 Video (FMP4) (non-H.264)
-        # Not supported - mpg => ERROR: MPEG-1/2 does not support 5/1 fps
-
-        if MOVIE_FILE is not None:
-            supported_movie_extensions = {'.mkv', '.mp4', '.flv', '.avi'}
-            _movie_file_name, movie_file_extension = os.path.splitext(MOVIE_FILE)
-            log_message(MESSAGE_DEBUG, f"Movie file extension = {movie_file_extension}")
-            if movie_file_extension == "":
-                log_message(MESSAGE_ERROR, f"invalid file extension for movie file:'{movie_file_extension}' \
-    does not exist")
-                sys.exit(ERR_INVALID_MOVIE_EXT)  # Use a non-zero exit code to indicate an error
-            else:
-                if str.lower(movie_file_extension) in supported_movie_extensions:
-                    log_message(MESSAGE_INFO, f"supported extension for movie file:'{movie_file_extension}'")
-                else:
-                    log_message(MESSAGE_ERROR, f"unsupported extension for movie file:'{movie_file_extension}'")
-                    sys.exit(ERR_USUPPORTED_MOVIE_EXT)  # Use a non-zero exit code to indicate an error
-
-        if FRAMERATE_VAL is not None:
-            if FRAMERATE_VAL < 1 or FRAMERATE_VAL > 30:
-                log_message(MESSAGE_ERROR, f"frame rate value {FRAMERATE_VAL} is out of range 1..30")
-                sys.exit(ERR_FRAMERATE_OUT_OF_RANGE)  # Use a non-zero exit code to indicate an error
-
-        log_message(MESSAGE_DEBUG, f"verbose = {VERBOSE_MODE}")
-        log_message(MESSAGE_DEBUG, f"conversion_directory = {INPUT_DIR}")
-        log_message(MESSAGE_DEBUG, f"rename = {RENAME_MODE}")
-        log_message(MESSAGE_DEBUG, f"skip JSON = {SKIPJSON_MODE}")
-        log_message(MESSAGE_DEBUG, f"keep JSON = {KEEPJSON_MODE}")
-        log_message(MESSAGE_DEBUG, f"annotate = {ANNOTATE_MODE}")
-        log_message(MESSAGE_DEBUG, f"movie_file = {MOVIE_FILE}")
-        log_message(MESSAGE_DEBUG, f"frame rate = {FRAMERATE_VAL}")
-        log_message(MESSAGE_DEBUG, f"overwritemovie_mode = {OVERWRITE_MOVIE_MODE}")
-        log_message(MESSAGE_DEBUG, f"skip Movie = {SKIPMOVIE_MODE}")
+        config.validate()
+
+        if settings.SKIPMOVIE_MODE is True and settings.OUTPUTS_VAL:
+            log_message(MESSAGE_ERROR, "--outputs targets are written with the movie file - remove --skipmovie \
+to create them")
+            sys.exit(ERR_INVALID_OUTPUT)  # Use a non-zero exit code to indicate an error
+
+        log_message(MESSAGE_DEBUG, f"verbose = {settings.VERBOSE_MODE}")
+        log_message(MESSAGE_DEBUG, f"conversion_directory = {settings.INPUT_DIR}")
+        log_message(MESSAGE_DEBUG, f"rename = {settings.RENAME_MODE}")
+        log_message(MESSAGE_DEBUG, f"skip JSON = {settings.SKIPJSON_MODE}")
+        log_message(MESSAGE_DEBUG, f"keep JSON = {settings.KEEPJSON_MODE}")
+        log_message(MESSAGE_DEBUG, f"annotate = {settings.ANNOTATE_MODE}")
+        log_message(MESSAGE_DEBUG, f"movie_file = {settings.MOVIE_FILE}")
+        log_message(MESSAGE_DEBUG, f"frame rate = {settings.FRAMERATE_VAL}")
+        log_message(MESSAGE_DEBUG, f"overwritemovie_mode = {settings.OVERWRITE_MOVIE_MODE}")
+        log_message(MESSAGE_DEBUG, f"skip Movie = {settings.SKIPMOVIE_MODE}")
+        log_message(MESSAGE_DEBUG, f"exiftool = {settings.EXIFTOOL_MODE}")
+        log_message(MESSAGE_DEBUG, f"jobs = {settings.JOBS_VAL}")
+        log_message(MESSAGE_DEBUG, f"keep JPEG = {settings.KEEPJPEG_MODE}")
+        log_message(MESSAGE_DEBUG, f"incremental = {settings.INCREMENTAL_MODE}")
+        log_message(MESSAGE_DEBUG, f"metadata index = {settings.METADATAINDEX_MODE}")
+        log_message(MESSAGE_DEBUG, f"export JSON = {settings.EXPORTJSON_MODE}")
+        log_message(MESSAGE_DEBUG, f"frames in flight = {settings.INFLIGHT_VAL}")
+        log_message(MESSAGE_DEBUG, f"profile = {settings.PROFILE_MODE}")
+        log_message(MESSAGE_DEBUG, f"statistics JSON file = {settings.STATSJSON_FILE}")
+        log_message(MESSAGE_DEBUG, f"preview = {settings.PREVIEW_VAL}")
+        log_message(MESSAGE_DEBUG, f"preview step = {settings.PREVIEWSTEP_VAL}")
+        log_message(MESSAGE_DEBUG, f"segments = {settings.SEGMENTS_VAL}")
+        log_message(MESSAGE_DEBUG, f"recursive = {settings.RECURSIVE_MODE}")
+        log_message(MESSAGE_DEBUG, f"files from = {settings.FILESFROM_FILE}")
+        log_message(MESSAGE_DEBUG, f"undo rename = {settings.UNDORENAME_MODE}")
+        log_message(MESSAGE_DEBUG, f"watch = {settings.WATCH_VAL}")
+        log_message(MESSAGE_DEBUG, f"outputs = {settings.OUTPUTS_VAL}")
+        log_message(MESSAGE_DEBUG, f"dedup = {settings.DEDUP_VAL}")
 
         # Path to the Input Pictures directory
-        if INPUT_DIR is None:
+        if settings.INPUT_DIR is None:
             # Prompt the user and get input
             response = input("Warning: No directory specified using --dir. \
 Are you sure you want to continue with current directory [Y/n]?")
@@ -200,276 +548,265 @@ Are you sure you want to continue with current directory [Y/n]?")
                 log_message(MESSAGE_ERROR, "Exiting program")
                 sys.exit(ERR_USER_EXIT)  # Use a non-zero exit code to indicate an error
         else:
-            input_directory_path = INPUT_DIR
+            input_directory_path = settings.INPUT_DIR
 
         # Path to the Output Pictures directory
         # Use the input directory unless output_dir is used
-        if OUTPUT_DIR is None:
+        if settings.OUTPUT_DIR is None:
             output_directory_path = input_directory_path
         else:
-            output_directory_path = OUTPUT_DIR
-
-        if SKIPJSON_MODE is False:
+            output_directory_path = settings.OUTPUT_DIR
+
+        # --undorename only renames the files of the last --rename back
+        if settings.UNDORENAME_MODE is True:
+            undo_renames(input_directory_path)
+            return
+
+        # Record of the previous run used to only rebuild new or changed files
+        manifest = None
+        if settings.INCREMENTAL_MODE is True:
+            manifest = BuildManifest(os.path.join(output_directory_path, DEFAULT_MANIFEST_FILENAME))
+            manifest.load()
+
+        # Metadata records held in memory (and saved in a single file) instead of JSON files
+        metadata_index = None
+        if settings.METADATAINDEX_MODE is True:
+            metadata_index = MetadataIndex(os.path.join(output_directory_path, DEFAULT_INDEX_FILENAME))
+            if settings.SKIPJSON_MODE is True:
+                metadata_index.load()
+
+        # --watch appends the new PNG files to the movie file until interrupted
+        if settings.WATCH_VAL is not None:
+            ignored_options = [option for option, used in (("--rename", settings.RENAME_MODE is True), \
+("--incremental", settings.INCREMENTAL_MODE is True), ("--skipmovie", settings.SKIPMOVIE_MODE is True), \
+("--filesfrom", settings.FILESFROM_FILE is not None), ("--segments", settings.SEGMENTS_VAL > 1), \
+("--previewstep", settings.PREVIEWSTEP_VAL > 1), ("--outputs", bool(settings.OUTPUTS_VAL)), \
+("--dedup", settings.DEDUP_VAL is not None)) if used is True]
+            if ignored_options:
+                log_message(MESSAGE_WARN, f"{', '.join(ignored_options)} not used with --watch")
+            # the watcher converts the frames with convert_png_files, which must not apply them either
+            settings.RENAME_MODE = False
+            settings.INCREMENTAL_MODE = False
+            settings.SKIPMOVIE_MODE = False
+            settings.FILESFROM_FILE = None
+            settings.SEGMENTS_VAL = 1
+            settings.PREVIEWSTEP_VAL = 1
+            settings.OUTPUTS_VAL = None
+            settings.DEDUP_VAL = None
+            movie_watcher = MovieWatcher(input_directory_path, output_directory_path, metadata_index)
+            movie_watcher.run()
+            if metadata_index is not None:
+                if settings.KEEPJSON_MODE is True:
+                    metadata_index.save()
+                if settings.EXPORTJSON_MODE is True:
+                    metadata_index.export_json_files(output_directory_path)
+            if settings.KEEPJSON_MODE is False and settings.EXPORTJSON_MODE is False:
+                remove_json_files(output_directory_path, movie_watcher.frame_files)
+            return
+
+        # Every stage uses the frame files found by a single scan of the input directory
+        frame_index = FrameIndex(input_directory_path, settings.RECURSIVE_MODE, settings.FILESFROM_FILE)
+        with RUN_STATS.timer("scan", 0):
+            frame_index.scan()
+
+        if settings.SKIPJSON_MODE is False:
             # Iterate through the PNG files in the directory
-            png_file_count = len(glob.glob1(input_directory_path,"*." + DEFAULT_PNG_EXTENSION))
+            png_files = frame_index.files({"." + DEFAULT_PNG_EXTENSION})
+            png_file_count = len(png_files)
             if png_file_count == 0:
                 log_message(MESSAGE_ERROR, "Error no PNG files found (conversion may be required) \
     - exiting program")
                 sys.exit(ERR_NO_PNG_FOR_JSON)  # Use a non-zero exit code to indicate an error
 
             log_message(MESSAGE_INFO, f"Creating JSON files from {png_file_count} PNG files")
-            if RENAME_MODE is True:
+            if settings.RENAME_MODE is True:
                 log_message(MESSAGE_INFO, "Also renaming PNG files using modified date")
 
             json_create_count = 0
-            # Iterate through all files in the directory
-            for filename in os.listdir(input_directory_path):
-                if filename.endswith(DEFAULT_PNG_EXTENSION):
-                    file_path = os.path.join(input_directory_path, filename)
-
-                    # tags to be extracted
-                    tags = ["-SourceFile", "-Datemodify", "-FileModifyDate", "-Parameters"]
-                    png_tags = get_png_exif_tags(file_path, tags)
-                    log_message(MESSAGE_DEBUG, f"EXIF tags read from file: {png_tags}")
-                    source_file = png_tags.get('SourceFile')
-
-                    # if the file has been modified by another application
-                    modifydate_str = png_tags.get('Datemodify')
-                    modify_date = None
-                    if modifydate_str is not None:
-                        log_message(MESSAGE_DEBUG, "datemodify found - using modify date")
-                        modify_date = datetime.strptime(modifydate_str, "%Y-%m-%dT%H:%M:%S%z")
-                    else:
-                        log_message(MESSAGE_DEBUG, "datemodify is empty - falling back on File Modify Date")
-                        modifydate_str = png_tags.get('FileModifyDate')
-                        if modifydate_str is not None:
-                            modify_date = datetime.strptime(modifydate_str, "%Y:%m:%d %H:%M:%S%z")
-                    parameters = png_tags.get('Parameters')
-
-                    log_message(MESSAGE_DEBUG, "EXIF extract")
-                    log_message(MESSAGE_DEBUG, f"SourceFile = {source_file}")
-                    log_message(MESSAGE_DEBUG, f"Modify Date = {modify_date}")
-                    log_message(MESSAGE_DEBUG, f"parameters = {parameters}")
-
-                    if source_file is None:
-                        log_message(MESSAGE_DEBUG, f"Missing EXIF tag SourceFile using filename {filename}")
-                        source_file = filename
-
-                    log_message(MESSAGE_DEBUG, "Attempting file rename based upon modify date")
-
-                    # default if rename is unsuccesful
-                    new_filename = filename
-
-                    if RENAME_MODE is True:
-                        # Rename the file using the formatted timestamp if datemodify exists
-                        if modify_date is not None:
-                            new_filename = modify_date.strftime("%y%m%d%H%M%S") + "." + DEFAULT_PNG_EXTENSION
-
-                            if os.path.isfile(os.path.join(input_directory_path, new_filename)) is True:
-                                log_message(MESSAGE_ERROR, f"Two files have the same modify dates:{modify_date} \
-- perhaps --rename has already been used resulting in new modify dates - exiting")
-                                sys.exit(ERR_RENAME_DUPLICATE)  # Use a non-zero exit code to indicate an error
-                            else:
-
-                                # delete existing backup
-                                # create the backup directory if necessary
-                                backup_directory_path = os.path.join(input_directory_path, DEFAULT_BACKUP_DIR)
-                                try:
-                                    os.mkdir(backup_directory_path)
-                                except OSError:
-                                    if OSError.errno == errno.EEXIST:
-                                        raise
-                                    else:
-                                        log_message(MESSAGE_DEBUG, \
-f"backup file {backup_directory_path} exists (not an error)")
-
-                                try:
-                                    os.remove(os.path.join(backup_directory_path, filename))
-                                    log_message(MESSAGE_DEBUG, \
-f"existing backup file {os.path.join(backup_directory_path, filename)} successfully deleted")
-                                except OSError:
-                                    log_message(MESSAGE_DEBUG, \
-f"backup file {os.path.join(backup_directory_path, filename)} \
-not found (not an error)")
-                                # save the backup
-                                shutil.copy(os.path.join(input_directory_path, filename), \
-os.path.join(backup_directory_path, filename))
-                                log_message(MESSAGE_DEBUG, \
-f"backup file {os.path.join(input_directory_path, filename)} created")
-
-                                # rename PNG file
-                                os.rename(os.path.join(input_directory_path, filename), \
-os.path.join(input_directory_path, new_filename))
-                            log_message(MESSAGE_DEBUG, \
-f"file {os.path.join(input_directory_path, filename)} \
-renamed to {os.path.join(input_directory_path, new_filename)}")
-                        else:
-                            log_message(MESSAGE_DEBUG, \
-f"File {os.path.join(input_directory_path, new_filename)} \
-does not have a date-based EXIF Tag to use - Not renaming")
-
-                    # Extract the parameters from the text
-                    if parameters is not None:
-                        extracted_parameters = sd_extract_parameters(parameters)
-                        log_message(MESSAGE_DEBUG, "The extracted parameters are:")
-                        log_message(MESSAGE_DEBUG, f"{extracted_parameters}")
-                    else:
-                        log_message(MESSAGE_DEBUG, \
-f"file {filename} does not have a Parameters EXIF Tag \
-- Using default values")
-                        extracted_parameters = 'None'
-
-                    # TODO - check if output_directory_path exists
-
-                    # Write Parameters to a text file with the same filename but with .txt extension
-                    output_json_filename = os.path.splitext(new_filename)[0] + ".json"
-                    with open(os.path.join(output_directory_path, output_json_filename), \
-"w", -1, 'utf-8') as json_file:
-                        json.dump(extracted_parameters, json_file, indent=4)
-                        if VERBOSE_MODE is True:
-                            log_message(MESSAGE_DEBUG, f"The Parameters have been written to: \
-{os.path.join(output_directory_path, output_json_filename)}")
-                        else:
+
+            # Reuse the parameters of unchanged files
+            # --rename needs the modify date of every file, so all of them are read again
+            if manifest is not None and settings.RENAME_MODE is False:
+                png_files_to_read = []
+                for filename in png_files:
+                    entry = manifest.refresh(filename, frame_index.path(filename), frame_index.stat(filename))
+                    if 'metadata' in entry:
+                        save_metadata_record(entry['metadata'], output_directory_path, metadata_index)
+                        manifest.count('metadata', True)
+                        if settings.VERBOSE_MODE is False:
                             json_create_count = json_create_count + 1
                             pb_show(json_create_count,png_file_count, str(json_create_count))
-                else:
-                    log_message(MESSAGE_DEBUG, f"Skipping non-PNG file/directory {filename}")
-
-        # Iterate through the PNG files in the directory
-        png_file_count = len(glob.glob1(input_directory_path,"*.png"))
+                    else:
+                        png_files_to_read.append(filename)
+                png_files = png_files_to_read
+
+            # Read the EXIF tags in batches
+            png_tags_read = {}
+            exif_backend = create_exif_backend()
+            with exif_backend:
+                for batch_start in range(0, len(png_files), EXIF_BATCH_SIZE):
+                    png_batch = png_files[batch_start:batch_start + EXIF_BATCH_SIZE]
+                    png_batch_paths = [frame_index.path(filename) for filename in png_batch]
+                    with RUN_STATS.timer("metadata", len(png_batch)):
+                        batch_tags = exif_backend.read_tags(png_batch_paths, EXIF_TAGS)
+                    for filename, file_path in zip(png_batch, png_batch_paths):
+                        png_tags_read[filename] = batch_tags.get(file_path, {})
+
+            # All the new names are checked before any file is renamed
+            rename_plan = None
+            if settings.RENAME_MODE is True and png_tags_read:
+                rename_plan = RenamePlan(input_directory_path, frame_index)
+                for filename, png_tags in png_tags_read.items():
+                    rename_plan.add(filename, png_modify_date(png_tags))
+                rename_journal = RenameJournal(os.path.join(input_directory_path, DEFAULT_RENAME_JOURNAL_FILENAME))
+                rename_journal.load()
+                with RUN_STATS.timer("rename", len(png_tags_read)):
+                    rename_plan.check()
+                    rename_plan.apply(rename_journal)
+
+            for filename, png_tags in png_tags_read.items():
+                with RUN_STATS.timer("json"):
+                    metadata_record = create_json_file(filename, png_tags, output_directory_path, \
+metadata_index, rename_plan.new_name(filename) if rename_plan is not None else None)
+                if manifest is not None:
+                    manifest.refresh(metadata_record['file'], frame_index.path(metadata_record['file']), \
+frame_index.stat(metadata_record['file']))['metadata'] = metadata_record
+                    manifest.count('metadata', False)
+                if settings.VERBOSE_MODE is False:
+                    json_create_count = json_create_count + 1
+                    pb_show(json_create_count,png_file_count, str(json_create_count))
+
+            if metadata_index is not None:
+                if settings.KEEPJSON_MODE is True:
+                    metadata_index.save()
+                if settings.EXPORTJSON_MODE is True:
+                    metadata_index.export_json_files(output_directory_path)
+
+        # Iterate through the PNG files in the directory (with their names after any --rename)
+        png_files = frame_index.files({"." + DEFAULT_PNG_EXTENSION})
+        png_file_count = len(png_files)
+        jpeg_input_mode = False
         if png_file_count == 0:
-            log_message(MESSAGE_ERROR, "No PNG files found (conversion may be required)\
+            # A directory of JPEG files is made into a movie file from the JPEG files
+            png_files = frame_index.files(JPEG_EXTENSIONS)
+            png_file_count = len(png_files)
+            jpeg_input_mode = True
+            if png_file_count == 0 or settings.SKIPMOVIE_MODE is True:
+                log_message(MESSAGE_ERROR, "No PNG files found (conversion may be required)\
 - exiting program")
-            sys.exit(ERR_NO_PNG_TO_CONVERT)  # Use a non-zero exit code to indicate an error
-
-        log_message(MESSAGE_INFO, f"\nStarting PNG conversion to JPEG of {png_file_count} files")
-        if ANNOTATE_MODE is True:
-            log_message(MESSAGE_INFO, "Also annotating JPEG files with data from JSON files.")
-
-        jpeg_create_count = 0
-        for png_file in sorted(os.listdir(input_directory_path)):
-            if png_file.endswith(".png"):
-                png_filename = os.path.splitext(png_file)[0]
-
-                # Use OpenCV to convert file
-                log_message(MESSAGE_DEBUG, f"Reading {input_directory_path + png_file}\
-for conversion")
-                image = cv2.imread(os.path.join(input_directory_path, f"{png_file}"))
-
-                if ANNOTATE_MODE is True:
-                    log_message(MESSAGE_DEBUG, "preparing annotation")
-
-                    json_file = os.path.join(output_directory_path, f"{png_filename}.json")
-                    if os.path.exists(json_file):
-                        with open(json_file, 'r', -1, 'utf-8') as f:
-                            text_to_draw =''
-                            json_data = json.load(f)
-                            if json_data != 'None':
-                                text_to_draw = f"{png_filename} | Steps {json_data['Steps']} | \
-CFG {json_data['CFG scale']} | Seed {json_data['Model']} | \
-Sampler {json_data['Sampler']} | Seed {json_data['Seed']}"
-
-# TODO - cope with missing JSON data
-# Denoise {json_data['Denoising strength']} |"
-
-                            else:
-                                text_to_draw = ""
-
-                        log_message(MESSAGE_DEBUG, f"annotating file with {text_to_draw}")
-                        _height, width, _channels = image.shape
-                        image = cv2.rectangle(image, (0,0), (width, TOP_BAR), (0,0,0), -1)
-                        image = cv2.putText(image, text_to_draw, (TEXT_OFFSET_X,TEXT_OFFSET_Y), \
-fontScale = TEXT_FONTSCALE, fontFace = TEXT_FONTFACE, \
-color = (255,255,255), thickness = 1, bottomLeftOrigin=False)
-                    else:
-                        log_message(MESSAGE_ERROR, f"Error: JSON file {json_file} not found. \
-Perhaps --skipjson has been used without JSON file creation - exiting program")
-                        sys.exit(ERR_NO_JSON_FOR_ANNOTATE)  \
-                            # Use a non-zero exit code to indicate an error
-
-                jpeg_file =os.path.splitext(png_file)[0] + "." + DEFAULT_JPEG_EXTENSION
-                cv2.imwrite(os.path.join(output_directory_path, f"{jpeg_file}"), image)
-                if VERBOSE_MODE is True:
-                    log_message(MESSAGE_DEBUG, f"\nJPEG file {output_directory_path + jpeg_file} \
-saved")
-                else:
-                    jpeg_create_count = jpeg_create_count + 1
-                    pb_show(jpeg_create_count,png_file_count,str(jpeg_create_count))
-
-        log_message(MESSAGE_INFO, "\nCreating Movie file")
-        if FRAMERATE_VAL is True:
-            log_message(MESSAGE_INFO, f"Also using frame rate of {FRAMERATE_VAL}")
-
-        if MOVIE_FILE is not None:
-            output_movie_file = MOVIE_FILE
-            log_message(MESSAGE_INFO, f"Also using movie_file {output_movie_file}")
+                sys.exit(ERR_NO_PNG_TO_CONVERT)  # Use a non-zero exit code to indicate an error
+        if manifest is not None and (settings.PREVIEW_VAL is not None or settings.PREVIEWSTEP_VAL > 1):
+            # a preview only reuses the parameters: the frames it skips or reduces must not change the manifest
+            # or the outputs it records
+            log_message(MESSAGE_INFO, "The manifest is not updated by a preview")
+            manifest.report()
+            manifest = None
+        if manifest is not None:
+            manifest.prune(png_files, output_directory_path)
+            for png_file in png_files:
+                manifest.refresh(png_file, frame_index.path(png_file), frame_index.stat(png_file))
+        if settings.PREVIEWSTEP_VAL > 1:
+            # each sampled frame is shown for the time of PREVIEWSTEP_VAL frames (see sampled_framerate())
+            png_files = png_files[::settings.PREVIEWSTEP_VAL]
+            png_file_count = len(png_files)
+
+        if settings.SKIPMOVIE_MODE is True:
+            log_message(MESSAGE_INFO, f"\nStarting PNG conversion to JPEG of {png_file_count} files")
+            if settings.ANNOTATE_MODE is True:
+                log_message(MESSAGE_INFO, "Also annotating JPEG files with data from JSON files.")
+            png_files_to_convert = png_files
+            if manifest is not None:
+                png_files_to_convert = [png_file for png_file in png_files if not \
+manifest.jpeg_current(png_file, frame_index.path(png_file), output_directory_path, frame_index.stat(png_file))]
+                for _png_file in range(len(png_files) - len(png_files_to_convert)):
+                    manifest.count('jpeg', True)
+            convert_png_files(png_files_to_convert, input_directory_path, output_directory_path, \
+metadata_index=metadata_index)
+            if manifest is not None:
+                for png_file in png_files_to_convert:
+                    manifest.record_jpeg(png_file, frame_index.path(png_file), frame_index.stat(png_file))
+                    manifest.count('jpeg', False)
         else:
-            output_movie_file = DEFAULT_MOVIE_FILENAME
-
-        # Delete output file
-        if os.path.isfile(os.path.join(output_directory_path, output_movie_file)):
-            if OVERWRITE_MOVIE_MODE is True:
-                log_message(MESSAGE_DEBUG, \
-f"Deleting {os.path.join(output_directory_path, output_movie_file)}")
-                os.remove(os.path.join(output_directory_path, output_movie_file))
-            else:
-                # Prompt the user and get input
-                response = input \
-(f"\nMovie file {os.path.join(output_directory_path, output_movie_file)} \
-exists - use --overwritemovie to avoid in future. Delete [y/N]?")
-                disagree_list = {'no', 'n', ''}
-                if response.lower() in disagree_list:
-                    log_message(MESSAGE_ERROR, "Exiting program")
-                    sys.exit(ERR_USER_EXIT)  # Use a non-zero exit code to indicate an error
-                else:
-                    log_message(MESSAGE_DEBUG,\
-f"deleting {os.path.join(output_directory_path, output_movie_file)}")
-                    os.remove(os.path.join(output_directory_path, output_movie_file))
-
-        # Call ffmpeg to create the movie
-        # Appropriate level of logging based upon verbose_mode
-        # no audio stream
-        # frame rate is 1 Hz
-
-        if VERBOSE_MODE is True:
-            log_level = 'debug'
-        else:
-            log_level = 'panic'
-
-        # This suffers from https://trac.ffmpeg.org/ticket/3164 - last frame is not vieweable
-        # However the last frame is saved to the file as evidenced by, for example,
-        # ffmpeg -r <framerate> -i file.mkv -r 1 mkv%03d.png
-
-        if FRAMERATE_VAL is not None:
-            log_message(MESSAGE_WARN, "Last frame of movie file may not be vieweable \
+            # JPEG files that need no changes are passed through to ffmpeg without being decoded
+            # unless they are also written to --outputs targets
+            jpeg_passthrough_mode = jpeg_input_mode is True and settings.ANNOTATE_MODE is False and \
+settings.PREVIEW_VAL is None and not settings.OUTPUTS_VAL and settings.DEDUP_VAL is None
+            # the --outputs targets and --dedup need the frames in order, which --segments changes
+            segment_count = settings.SEGMENTS_VAL
+            if (settings.OUTPUTS_VAL or settings.DEDUP_VAL is not None) and settings.SEGMENTS_VAL > 1:
+                log_message(MESSAGE_WARN, "--segments is not used with --outputs or --dedup")
+                segment_count = 1
+            log_message(MESSAGE_INFO, f"\nCreating Movie file from {png_file_count} \
+{'JPEG' if jpeg_input_mode is True else 'PNG'} files")
+            if settings.ANNOTATE_MODE is True:
+                log_message(MESSAGE_INFO, "Also annotating frames with data from JSON files.")
+            if jpeg_passthrough_mode is True:
+                log_message(MESSAGE_INFO, "Also passing JPEG files through to ffmpeg unchanged.")
+            if settings.KEEPJPEG_MODE is True and jpeg_input_mode is False:
+                log_message(MESSAGE_INFO, "Also saving JPEG files.")
+            if settings.OUTPUTS_VAL:
+                log_message(MESSAGE_INFO, f"Also writing the frames to {' '.join(settings.OUTPUTS_VAL)}")
+            if settings.DEDUP_VAL is not None:
+                log_message(MESSAGE_INFO, f"Also showing runs of frames within {settings.DEDUP_VAL} bits of each other \
+as one longer frame")
+            if settings.FRAMERATE_VAL is not None:
+                log_message(MESSAGE_INFO, f"Also using frame rate of {settings.FRAMERATE_VAL}")
+            if settings.FRAMERATE_VAL is not None and segment_count == 1 and settings.DEDUP_VAL is None:
+                # This suffers from https://trac.ffmpeg.org/ticket/3164 - last frame is not vieweable
+                # However the last frame is saved to the file as evidenced by, for example,
+                # ffmpeg -r <framerate> -i file.mkv -r 1 mkv%03d.png
+                log_message(MESSAGE_WARN, "Last frame of movie file may not be vieweable \
 for non-default frame rates")
-            ffmpeg_cmd_line = f'type {os.path.join(output_directory_path, "*." + DEFAULT_JPEG_EXTENSION)} | \
-{FFMPEG_CMD} -loglevel {log_level} -framerate {FRAMERATE_VAL}  \
--an -f image2pipe -i - {os.path.join(output_directory_path, output_movie_file)}'
-        else:
-            ffmpeg_cmd_line = f'type {os.path.join(output_directory_path, "*." + DEFAULT_JPEG_EXTENSION)} | \
-{FFMPEG_CMD} -loglevel {log_level} -an -f image2pipe -i - \
-{os.path.join(output_directory_path, output_movie_file)}'
-        log_message(MESSAGE_INFO, f"About to run '{ffmpeg_cmd_line}'")
-        try:
-            _completed_process = subprocess.run \
-(ffmpeg_cmd_line, shell=True, capture_output=False, check=True)
-            log_message(MESSAGE_INFO, f"Output file {output_movie_file} successfully created")
-        except subprocess.CalledProcessError as e:
-            log_message(MESSAGE_WARN, f"ffmpeg returned a non-zero exit status: {e.returncode} \
-    - consider using --verbose")
+
+            movie_file_path = get_movie_file_path(output_directory_path, settings.MOVIE_FILE, settings.PREVIEW_VAL)
+            if manifest is not None and not settings.OUTPUTS_VAL and manifest.movie_current(movie_file_path, png_files):
+                log_message(MESSAGE_INFO, f"Movie file {movie_file_path} is up to date")
+                manifest.count('movie', True)
+            else:
+                # The frames are streamed straight into ffmpeg, which encodes while the next frames are decoded
+                frame_writer = create_frame_writer(movie_file_path, output_directory_path, config, \
+FfmpegJpegWriter if jpeg_passthrough_mode is True else FfmpegFrameWriter, segment_count)
+                frame_files = frame_writer.schedule(png_files) if segment_count > 1 else png_files
+                with frame_writer:
+                    if jpeg_passthrough_mode is True:
+                        stream_jpeg_files(frame_files, input_directory_path, frame_writer)
+                    else:
+                        convert_png_files(frame_files, input_directory_path, output_directory_path, frame_writer, \
+metadata_index, keep_jpeg=not jpeg_input_mode)
+                    # the remaining time is ffmpeg flushing its encoder when the frames end
+                    frame_writer_close_start = time.perf_counter()
+                RUN_STATS.record("finish", time.perf_counter() - frame_writer_close_start, 0)
+                if os.path.isfile(movie_file_path):
+                    RUN_STATS.add_bytes("finish", bytes_written=os.path.getsize(movie_file_path))
+                if frame_writer.returncode not in (0, None):
+                    raise RotopyError(f"ffmpeg returned a non-zero exit status: {frame_writer.returncode} \
+- consider using --verbose", ERR_FFMPEG_FAILED)
+                if manifest is not None:
+                    if frame_writer.returncode == 0:
+                        manifest.record_movie(movie_file_path, png_files)
+                    manifest.count('movie', False)
+                    if settings.KEEPJPEG_MODE is True and jpeg_input_mode is False:
+                        for png_file in png_files:
+                            manifest.record_jpeg(png_file, frame_index.path(png_file), frame_index.stat(png_file))
 
         #tidy up
-        if KEEPJSON_MODE is False:
-            for json_file in sorted(os.listdir(output_directory_path)):
-                if json_file.endswith(".json"):
-                    log_message(MESSAGE_DEBUG, f"Deleting file {output_directory_path + json_file}")
-                    os.remove(os.path.join(output_directory_path, json_file))
+        if settings.KEEPJSON_MODE is False and settings.EXPORTJSON_MODE is False:
+            # the JSON files are in the output directory and its subdirectories of frames
+            remove_json_files(output_directory_path, frame_index.files(FRAME_EXTENSIONS))
+
+        if manifest is not None:
+            manifest.save()
+            manifest.report()
 
+    except RotopyError as rotopy_e:
+        log_message(MESSAGE_ERROR, str(rotopy_e))
+        sys.exit(rotopy_e.exit_code)  # Use a non-zero exit code to indicate an error
     except Exception:
         log_message(MESSAGE_ERROR, \
 f"Unhandled exception: {traceback.format_exception(*sys.exc_info())}")
         raise
+    finally:
+        RUN_STATS.finish()
 
 if __name__ == '__main__':
     # Create a new ArgumentParser object
@@ -488,20 +825,34 @@ if __name__ == '__main__':
     parser.add_argument('--framerate', type=int, help='Output movie frame rate')
     parser.add_argument('--overwritemovie', action='store_true', help='Overwrite movie file without prompting')
     parser.add_argument('--skipmovie', action='store_true', help='Skip Movie file creation')
+    parser.add_argument('--exiftool', action='store_true', help='Read PNG metadata with exiftool instead of the built-in reader')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of PNG files converted in parallel [1]')
+    parser.add_argument('--keepjpeg', action='store_true', help='Also save the JPEG files when creating the movie file')
+    parser.add_argument('--incremental', action='store_true', help='Only rebuild outputs of new or changed PNG files')
+    parser.add_argument('--metadataindex', action='store_true', \
+help='Keep metadata in a single index file (rotopy_index.jsonl) instead of one JSON file per PNG file')
+    parser.add_argument('--exportjson', action='store_true', help='Also write one JSON file per PNG file with --metadataindex')
+    parser.add_argument('--inflight', type=int, help='Maximum number of frames held in memory [2 x JOBS + stages]')
+    parser.add_argument('--profile', action='store_true', help='Display per-stage timings and throughput at exit')
+    parser.add_argument('--statsjson', type=str, help='Write per-stage timings and throughput to a JSON file at exit')
+    parser.add_argument('--preview', type=int, nargs='?', const=4, choices=[2, 4, 8], \
+help='Quickly create a low quality <moviefile>_preview movie at 1/2, 1/4 or 1/8 size [4]')
+    parser.add_argument('--previewstep', type=int, default=1, help='Only use every Nth frame (keeping the timing) [1]')
+    parser.add_argument('--segments', type=int, default=1, \
+help='Number of movie segments encoded in parallel and then joined [1]')
+    parser.add_argument('--recursive', action='store_true', help='Also use the frame files in subdirectories')
+    parser.add_argument('--filesfrom', type=str, help='Use the frame files listed one per line in a text file')
+    parser.add_argument('--undorename', action='store_true', help='Rename the files of the last --rename back and exit')
+    parser.add_argument('--watch', type=float, nargs='?', const=DEFAULT_WATCH_INTERVAL, \
+help='Keep appending new PNG files to the movie file, checking every WATCH seconds, until interrupted [5]')
+    parser.add_argument('--outputs', type=str, nargs='+', metavar='TARGET', \
+help='Also write the frames to each TARGET FILE[,framerate=N][,scale=F][,columns=N]: \
+a movie (mkv|mp4|avi|flv), an animation (gif|webp) or a contact sheet image (png|jpg)')
+    parser.add_argument('--dedup', type=int, nargs='?', const=DEFAULT_DEDUP_THRESHOLD, metavar='BITS', \
+help='Show each run of identical frames as one longer frame - with BITS, also frames whose 64 bit perceptual hashes \
+differ by at most BITS bits and whose 16x16 thumbnails differ by at most 2 levels [0]')
 
     # Parse the arguments
     args = parser.parse_args()
 
-    VERBOSE_MODE = args.verbose
-    INPUT_DIR = args.input_dir
-    OUTPUT_DIR = args.output_dir
-    RENAME_MODE = args.rename
-    SKIPJSON_MODE = args.skipjson
-    KEEPJSON_MODE = args.keepjson
-    ANNOTATE_MODE = args.annotate
-    MOVIE_FILE = args.moviefile
-    FRAMERATE_VAL = args.framerate
-    OVERWRITE_MOVIE_MODE = args.overwritemovie
-    SKIPMOVIE_MODE = args.skipmovie
-
-    main()
+    main(RotopyConfig.from_args(args))
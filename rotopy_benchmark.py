@@ -0,0 +1,521 @@
+"""
+RotoPy benchmark: time each stage of rotopy on synthetic Stable Diffusion frames.
+"""
+
+# # Python pre-requisites
+# As for rotopy.py
+# ffmpeg and exiftool are used if they are in the PATH - otherwise stubs are used so that
+# the benchmark runs offline (the stub encode times are then not comparable with real ones)
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import cv2
+import rotopy
+import rotopy_settings
+import rotopy_metadata
+import rotopy_writers
+
+DEFAULT_FRAME_COUNT = 100
+DEFAULT_WIDTH = 512
+DEFAULT_HEIGHT = 512
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_RESULTS_FILENAME = "benchmark_results.json"
+DEFAULT_PARSER_TEXT_COUNT = 100000
+
+# Exit Errors
+ERR_REGRESSION = 1
+ERR_PARSER = 2
+
+# Words of the synthetic prompts - with the colons and weights of real prompts
+PROMPT_TAGS = ["masterpiece", "(best quality:1.2)", "highly detailed", "a photograph of a galloping race horse", \
+"dusty track", "golden hour", "cinematic lighting", "35mm", "sharp focus", "8k", "(film grain:0.8)", \
+"style: oil painting", "by greg rutkowski", "[muted colors|vivid colors]", "depth of field", "bokeh", \
+"trending on artstation", "(((detailed eyes)))", "award winning", "Model of a horse"]
+NEGATIVE_PROMPT_TAGS = ["blurry", "lowres", "(worst quality:1.4)", "bad anatomy", "watermark", "text", \
+"jpeg artifacts", "(deformed, distorted:1.3)", "extra limbs", "signature"]
+SAMPLERS = ["Euler a", "DPM++ 2M Karras", "DPM++ SDE Karras", "DDIM", "UniPC"]
+MODELS = [("6ce0161689", "v1-5-pruned-emaonly"), ("31e35c80fc", "sd_xl_base_1.0"), ("e6bb9ea85b", "dreamshaper_8")]
+LORAS = [("add_detail", "7c6bad76eb54"), ("epiNoiseoffset_v2", "d1131f7207d6"), ("horse_style-v1.5", "0a1b2c3d4e5f")]
+
+# A1111 starts the counter in the file name again every day
+FRAMES_PER_DAY = 40
+
+# Stages reported by rotopy --statsjson grouped into the benchmark stages
+BENCHMARK_STAGES = {
+    "metadata": ["scan", "metadata", "json"],
+    "rename": ["rename"],
+    "convert": ["read", "decode", "jpeg"],
+    "annotate": ["annotate"],
+    "encode": ["encode", "finish"]
+}
+
+# rotopy settings for each configuration - the first is the one used by every other
+BENCHMARK_CONFIGS = {
+    "baseline": {},
+    "annotate": {"ANNOTATE_MODE": True},
+    "jobs": {"ANNOTATE_MODE": True, "JOBS_VAL": os.cpu_count() or 1},
+    "rename": {"RENAME_MODE": True, "ANNOTATE_MODE": True},
+    "metadataindex": {"METADATAINDEX_MODE": True, "ANNOTATE_MODE": True},
+    "keepjpeg": {"KEEPJPEG_MODE": True, "JOBS_VAL": os.cpu_count() or 1},
+    "exiftool": {"EXIFTOOL_MODE": True},
+    "preview": {"ANNOTATE_MODE": True, "PREVIEW_VAL": 4},
+    "segments": {"ANNOTATE_MODE": True, "JOBS_VAL": os.cpu_count() or 1, "SEGMENTS_VAL": os.cpu_count() or 1}
+}
+
+# rotopy stub for exiftool -stay_open using the built-in PNG reader
+EXIFTOOL_STUB = """
+import json, sys
+sys.path.insert(0, {rotopy_dir!r})
+import rotopy
+arguments = []
+for line in sys.stdin:
+    argument = line.rstrip("\\n")
+    if argument == "-execute":
+        tags = [a for a in arguments if a.startswith("-") and a not in ("-json", "-charset")]
+        files = [a for a in arguments if not a.startswith("-") and a != "filename=utf8"]
+        print(json.dumps([rotopy.get_png_tags(f, tags) for f in files]))
+        print("{{ready}}", flush=True)
+        arguments = []
+    elif arguments[-1:] == ["-stay_open"] and argument == "False":
+        break
+    else:
+        arguments.append(argument)
+"""
+
+# ffmpeg stub that reads all the frames and writes an empty movie file
+FFMPEG_STUB = """
+import sys
+# the --segments concat step has no stdin input
+while "concat" not in sys.argv and sys.stdin.buffer.read(1024 * 1024):
+    pass
+open(sys.argv[-1], "wb").close()
+"""
+
+def png_chunk(chunk_type, chunk_data):
+    """
+    png_chunk(chunk_type, chunk_data)
+    return a PNG chunk with its length and CRC
+    """
+    return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + \
+struct.pack('>I', zlib.crc32(chunk_type + chunk_data))
+
+def sd_parameters_text(frame_index, seed, width, height):
+    """
+    sd_parameters_text(frame_index, seed, width, height)
+    return A1111-style parameters text for an img2img frame
+    """
+    return f"a photograph of a galloping race horse, (masterpiece:1.2), detailed, frame {frame_index}\n\
+Negative prompt: blurry, lowres, (worst quality:1.4)\n\
+Steps: {20 + frame_index % 10}, Sampler: DPM++ 2M Karras, CFG scale: {5 + frame_index % 5}.5, Seed: {seed}, \
+Size: {width}x{height}, Model hash: 6ce0161689, Model: v1-5-pruned-emaonly, \
+Denoising strength: {0.3 + (frame_index % 5) / 10:.2f}, Version: v1.6.0"
+
+def synthetic_image(frame_index, width, height, rng):
+    """
+    synthetic_image(frame_index, width, height, rng)
+    return a BGR image that changes smoothly from frame to frame with some noise,
+    so that it compresses roughly like a generated image
+    """
+    x_ramp = np.linspace(0, 255, width, dtype=np.float32)
+    y_ramp = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.float32)
+    image[:, :, 0] = (x_ramp + 4 * frame_index) % 256
+    image[:, :, 1] = (y_ramp + 2 * frame_index) % 256
+    image[:, :, 2] = (x_ramp + y_ramp) / 2
+    image = image + rng.normal(0, 8, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+# the image, text chunks, file name and modify date of every synthetic frame
+# pylint: disable-next=too-many-locals
+def generate_frames(frames_directory_path, frame_count, width, height, seed=0):
+    """
+    generate_frames(frames_directory_path, frame_count, width, height, seed)
+    Write frame_count synthetic Stable Diffusion PNG files with parameters and date:modify text chunks
+    The file names follow A1111 (<counter>-<seed>.png with the counter starting again every day)
+    so that the file name order is not the date order, and the file modify dates vary
+    """
+    rng = np.random.default_rng(seed)
+    first_date = datetime(2023, 10, 1, 12, 0, 0, tzinfo=timezone.utc)
+    os.makedirs(frames_directory_path, exist_ok=True)
+    for frame_index in range(frame_count):
+        frame_seed = int(rng.integers(0, 2**32))
+        modify_date = first_date + timedelta(days=frame_index // FRAMES_PER_DAY, seconds=37 * frame_index)
+        _ok, png_buffer = cv2.imencode(".png", synthetic_image(frame_index, width, height, rng))
+        png_data = png_buffer.tobytes()
+        # text chunks go after IHDR (signature 8 bytes + IHDR 25 bytes)
+        text_chunks = png_chunk(b'tEXt', b'parameters\0' + \
+sd_parameters_text(frame_index, frame_seed, width, height).encode('latin-1')) + \
+png_chunk(b'tEXt', b'date:modify\0' + modify_date.isoformat().encode('latin-1'))
+        png_file_path = os.path.join(frames_directory_path, \
+f"{frame_index % FRAMES_PER_DAY:05d}-{frame_seed}.png")
+        with open(png_file_path, 'wb') as png_file:
+            png_file.write(png_data[:33] + text_chunks + png_data[33:])
+        file_modify_time = modify_date.timestamp() + 5
+        os.utime(png_file_path, (file_modify_time, file_modify_time))
+
+def write_stub(bin_directory_path, stub_name, stub_source):
+    """
+    write_stub(bin_directory_path, stub_name, stub_source)
+    write an executable Python script and return its path
+    """
+    stub_path = os.path.join(bin_directory_path, stub_name)
+    with open(stub_path, 'w', -1, 'utf-8') as stub_file:
+        stub_file.write(f"#!{sys.executable}\n{stub_source}")
+    os.chmod(stub_path, os.stat(stub_path).st_mode | stat.S_IXUSR)
+    return stub_path
+
+def sd_extract_parameters_split(sd_parameters):
+    """
+    sd_extract_parameters_split(sd_parameters)
+    the comma splitting parameters parser of earlier versions of rotopy, kept to compare with
+    """
+    sd_extracted_parameters = {}
+    sd_key_mapping = {
+        "Sampler" : "Sampler",
+        "Model" : "Model",
+        "Steps": "Steps",
+        "Seed": "Seed",
+        "CFG scale": "CFG scale",
+        "Denoising strength": "Denoising strength"
+    }
+    for sd_line in sd_parameters.split(','):
+        for sd_key in sd_key_mapping:
+            if sd_key in sd_line:
+                sd_value = sd_line.split(':')[1].strip()
+                sd_extracted_parameters[sd_key_mapping[sd_key]] = sd_value
+    return sd_extracted_parameters
+
+def parameter_text(rng):
+    """
+    parameter_text(rng)
+    return a random A1111 parameters text like those of real images and the parameters it holds
+    Prompts have 5 to 60 tags with weights and colons, and may have LoRAs, several lines and no negative prompt,
+    and the settings may have Hires fields, Seed resize from and quoted values with commas and escaped quotes
+    Some texts have no settings line, so that the last line of the prompt or negative prompt is all there is
+    """
+    prompt_tags = [rng.choice(PROMPT_TAGS) for _tag in range(rng.randint(5, 60))]
+    loras = rng.sample(LORAS, rng.randint(0, 2))
+    prompt_tags += [f"<lora:{lora_name}:{lora_weight}>" for (lora_name, _lora_hash), lora_weight \
+in zip(loras, [0.7, -0.5])]
+    prompt = ", ".join(prompt_tags)
+    if rng.random() < 0.2:
+        prompt = prompt + "\nBREAK\n" + ", ".join(rng.sample(PROMPT_TAGS, 3))
+    expected = {"Prompt": prompt}
+    text = prompt + "\n"
+    if rng.random() < 0.8:
+        expected["Negative prompt"] = ", ".join(rng.choice(NEGATIVE_PROMPT_TAGS) for _tag in range(rng.randint(1, 30)))
+        text = text + f"Negative prompt: {expected['Negative prompt']}\n"
+    if rng.random() < 0.1:
+        # e.g. an image saved by a tool that only keeps the prompts
+        if loras:
+            expected["Lora"] = [{"name": lora_name, "weight": lora_weight, "hash": None} \
+for (lora_name, _lora_hash), lora_weight in zip(loras, [0.7, -0.5])]
+        return text.rstrip("\n"), expected
+
+    model_hash, model = rng.choice(MODELS)
+    expected.update({"Steps": rng.randint(10, 80), "Sampler": rng.choice(SAMPLERS), \
+"CFG scale": rng.choice([5.0, 7.0, 7.5, 11.0]), "Seed": rng.randint(0, 2 ** 32 - 1), \
+"Size": [rng.choice([512, 768, 1024]), rng.choice([512, 768, 1024])], "Model hash": model_hash, "Model": model})
+    settings = [f"Steps: {expected['Steps']}", f"Sampler: {expected['Sampler']}", f"CFG scale: {expected['CFG scale']}", \
+f"Seed: {expected['Seed']}", f"Size: {expected['Size'][0]}x{expected['Size'][1]}", f"Model hash: {model_hash}", \
+f"Model: {model}"]
+    if rng.random() < 0.5:
+        expected["Denoising strength"] = rng.choice([0.3, 0.45, 0.7])
+        settings.append(f"Denoising strength: {expected['Denoising strength']}")
+    if rng.random() < 0.3:
+        expected.update({"Hires upscale": 2.0, "Hires steps": 15, "Hires upscaler": "R-ESRGAN 4x+"})
+        settings += ["Hires upscale: 2", "Hires steps: 15", "Hires upscaler: R-ESRGAN 4x+"]
+    if rng.random() < 0.1:
+        expected["Seed resize from"] = "-1x-1"
+        settings.append("Seed resize from: -1x-1")
+    if loras:
+        expected["Lora hashes"] = dict(loras)
+        settings.append('Lora hashes: "' + ", ".join(f"{lora_name}: {lora_hash}" for lora_name, lora_hash in loras) + '"')
+        expected["Lora"] = [{"name": lora_name, "weight": lora_weight, "hash": lora_hash} \
+for (lora_name, lora_hash), lora_weight in zip(loras, [0.7, -0.5])]
+    if rng.random() < 0.05:
+        expected["Wildcard prompt"] = 'a "quoted", prompt: with commas'
+        settings.append('Wildcard prompt: "a \\"quoted\\", prompt: with commas"')
+    expected["Version"] = "v1.6.0"
+    settings.append("Version: v1.6.0")
+    return text + ", ".join(settings), expected
+
+def parse_parameters(parser_function, parameters_text):
+    """
+    parse_parameters(parser_function, parameters_text)
+    return the parameters found in parameters_text by parser_function, or None if it fails
+    """
+    try:
+        return parser_function(parameters_text)
+    except (IndexError, ValueError):
+        # e.g. the earlier parser fails on a prompt with "Model" but no colon
+        return None
+
+def time_parser(parser_function, parameter_texts):
+    """
+    time_parser(parser_function, parameter_texts)
+    return the seconds taken by parser_function to parse all of parameter_texts
+    """
+    # as timeit, without the garbage collector scanning the growing list of results
+    gc.disable()
+    try:
+        parser_start = time.perf_counter()
+        for case_text in parameter_texts:
+            parse_parameters(parser_function, case_text)
+        return time.perf_counter() - parser_start
+    finally:
+        gc.enable()
+
+def benchmark_parser(text_count, seed=0):
+    """
+    benchmark_parser(text_count, seed)
+    check the parameters found by rotopy.sd_extract_parameters and the earlier comma splitting parser
+    on text_count parameters texts, then time both on the texts the earlier parser gets right
+    (it gives up early on the others, which would flatter its time)
+    return the results
+    """
+    rng = random.Random(seed)
+    parameter_cases = [parameter_text(rng) for _text in range(text_count)]
+
+    results = {'commit': git_commit(), 'created': datetime.now(timezone.utc).isoformat(), \
+'platform': platform.platform(), 'python': platform.python_version(), 'texts': text_count}
+    split_texts = []
+    for parser_name, parser_function in (("split", sd_extract_parameters_split), \
+("tokenizer", rotopy.sd_extract_parameters)):
+        parser_errors = 0
+        for case_text, expected in parameter_cases:
+            if parser_name == "split":
+                # the earlier parser only found 6 fields, as text
+                expected = {key: str(value) for key, value in expected.items() \
+if key in ("Steps", "Sampler", "CFG scale", "Seed", "Model", "Denoising strength")}
+            if parse_parameters(parser_function, case_text) != expected:
+                parser_errors = parser_errors + 1
+            elif parser_name == "split":
+                split_texts.append(case_text)
+        results[f'{parser_name}_errors'] = parser_errors
+
+    results['timed_texts'] = len(split_texts)
+    for parser_name, parser_function in (("split", sd_extract_parameters_split), \
+("tokenizer", rotopy.sd_extract_parameters)):
+        results[f'{parser_name}_seconds'] = time_parser(parser_function, split_texts)
+    return results
+
+def log_parser_results(results):
+    """
+    log_parser_results(results)
+    display the times and errors of the parameters parsers
+    """
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"\n{results['texts']} parameters texts, \
+{results['timed_texts']} parsed correctly by both parsers and timed")
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"{'parser':<14} {'seconds':>9} {'us/text':>9} {'errors':>9}")
+    for parser_name in ("split", "tokenizer"):
+        rotopy.log_message(rotopy.MESSAGE_INFO, f"{parser_name:<14} {results[f'{parser_name}_seconds']:>9.3f} \
+{results[f'{parser_name}_seconds'] / max(results['timed_texts'], 1) * 1e6:>9.2f} {results[f'{parser_name}_errors']:>9}")
+    speed_up = results['split_seconds'] / max(results['tokenizer_seconds'], 1e-9)
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"tokenizer speed-up {speed_up:.2f}x")
+
+def find_tools(bin_directory_path):
+    """
+    find_tools(bin_directory_path)
+    point rotopy at ffmpeg and exiftool, using stubs for the ones not in the PATH
+    return a dict of each tool's origin ("real" or "stub")
+    """
+    tools = {}
+    if shutil.which(rotopy_writers.FFMPEG_CMD) is None:
+        rotopy_writers.FFMPEG_CMD = write_stub(bin_directory_path, "ffmpeg", FFMPEG_STUB)
+        tools["ffmpeg"] = "stub"
+    else:
+        tools["ffmpeg"] = "real"
+    if shutil.which(rotopy_metadata.EXIF_TOOL_CMD) is None:
+        exiftool_stub_source = EXIFTOOL_STUB.format(rotopy_dir=os.path.dirname(os.path.abspath(rotopy.__file__)))
+        rotopy_metadata.EXIF_TOOL_CMD = write_stub(bin_directory_path, "exiftool", exiftool_stub_source)
+        tools["exiftool"] = "stub"
+    else:
+        tools["exiftool"] = "real"
+    return tools
+
+def run_rotopy(frames_directory_path, work_directory_path, settings, default_settings):
+    """
+    run_rotopy(frames_directory_path, work_directory_path, settings, default_settings)
+    run rotopy.main() with settings on a fresh copy of the frames
+    return the statistics written by --statsjson
+    """
+    input_directory_path = os.path.join(work_directory_path, "input")
+    output_directory_path = os.path.join(work_directory_path, "output")
+    shutil.rmtree(work_directory_path, ignore_errors=True)
+    shutil.copytree(frames_directory_path, input_directory_path)
+    os.makedirs(output_directory_path)
+
+    stats_file_path = os.path.join(work_directory_path, "stats.json")
+    run_settings = dict(default_settings)
+    run_settings.update({"INPUT_DIR": input_directory_path, "OUTPUT_DIR": output_directory_path, \
+"MOVIE_FILE": None, "FRAMERATE_VAL": None, "OVERWRITE_MOVIE_MODE": True, "STATSJSON_FILE": stats_file_path})
+    run_settings.update(settings)
+    for setting_name, setting_value in run_settings.items():
+        setattr(rotopy_settings, setting_name, setting_value)
+
+    with open(os.devnull, 'w', -1, 'utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        rotopy.main()
+    with open(stats_file_path, 'r', -1, 'utf-8') as stats_file:
+        return json.load(stats_file)
+
+def summarise_runs(run_reports):
+    """
+    summarise_runs(run_reports)
+    return the median wall time, frames per second and benchmark stage times of repeated runs
+    """
+    stage_seconds = {}
+    for benchmark_stage, rotopy_stages in BENCHMARK_STAGES.items():
+        run_seconds = [sum(run_report['stages'][rotopy_stage]['total_seconds'] \
+for rotopy_stage in rotopy_stages if rotopy_stage in run_report['stages']) for run_report in run_reports]
+        if any(seconds > 0 for seconds in run_seconds):
+            stage_seconds[benchmark_stage] = round(statistics.median(run_seconds), 6)
+    return {'wall_seconds': round(statistics.median(r['wall_seconds'] for r in run_reports), 6), \
+'fps': round(statistics.median(r['fps'] or 0 for r in run_reports), 2), \
+'peak_rss_bytes': max(r['peak_rss_bytes'] or 0 for r in run_reports), 'stages': stage_seconds}
+
+def git_commit():
+    """
+    git_commit()
+    return the git commit of rotopy.py or None
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], \
+cwd=os.path.dirname(os.path.abspath(rotopy.__file__)), stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(frame_count, width, height, repeat, config_names):
+    """
+    run_benchmark(frame_count, width, height, repeat, config_names)
+    return the results of running each configuration in str list config_names repeat times
+    """
+    default_settings = {setting_name: getattr(rotopy_settings, setting_name) for config in BENCHMARK_CONFIGS.values() \
+for setting_name in config}
+    results = {'commit': git_commit(), 'created': datetime.now(timezone.utc).isoformat(), \
+'platform': platform.platform(), 'python': platform.python_version(), 'opencv': cv2.__version__, \
+'frames': frame_count, 'width': width, 'height': height, 'repeat': repeat, 'configs': {}}
+
+    with tempfile.TemporaryDirectory(prefix="rotopy_benchmark_") as benchmark_directory_path:
+        results['tools'] = find_tools(benchmark_directory_path)
+        frames_directory_path = os.path.join(benchmark_directory_path, "frames")
+        rotopy.log_message(rotopy.MESSAGE_INFO, f"Generating {frame_count} frames of {width}x{height}")
+        generate_frames(frames_directory_path, frame_count, width, height)
+
+        for config_name in config_names:
+            rotopy.log_message(rotopy.MESSAGE_INFO, f"Running {config_name} {repeat} times")
+            run_reports = [run_rotopy(frames_directory_path, os.path.join(benchmark_directory_path, "work"), \
+BENCHMARK_CONFIGS[config_name], default_settings) for _run in range(repeat)]
+            results['configs'][config_name] = summarise_runs(run_reports)
+    return results
+
+def log_results(results):
+    """
+    log_results(results)
+    display the stage times of each configuration
+    """
+    stage_names = list(BENCHMARK_STAGES)
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"\n{results['frames']} frames of {results['width']}x{results['height']} \
+(ffmpeg {results['tools']['ffmpeg']}, exiftool {results['tools']['exiftool']})")
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"{'config':<14} {'wall s':>9} {'fps':>9} " + \
+" ".join(f"{stage_name:>9}" for stage_name in stage_names))
+    for config_name, config_results in results['configs'].items():
+        rotopy.log_message(rotopy.MESSAGE_INFO, f"{config_name:<14} {config_results['wall_seconds']:>9.3f} \
+{config_results['fps']:>9} " + " ".join(f"{config_results['stages'].get(stage_name, 0):>9.3f}" \
+for stage_name in stage_names))
+
+def compare_results(previous_results, results, threshold):
+    """
+    compare_results(previous_results, results, threshold)
+    display the change of each stage time since previous_results
+    return the number of stage times that are slower by more than the fraction threshold
+    """
+    regressions = 0
+    if (previous_results['frames'], previous_results['width'], previous_results['height']) != \
+(results['frames'], results['width'], results['height']) or previous_results.get('tools') != results.get('tools'):
+        rotopy.log_message(rotopy.MESSAGE_WARN, "the previous results used different frames or tools")
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"\nCompared with commit {previous_results.get('commit')}")
+    for config_name, config_results in results['configs'].items():
+        previous_config = previous_results['configs'].get(config_name)
+        if previous_config is None:
+            continue
+        timings = [("wall", previous_config['wall_seconds'], config_results['wall_seconds'])] + \
+[(stage_name, previous_config['stages'][stage_name], seconds) \
+for stage_name, seconds in config_results['stages'].items() if stage_name in previous_config['stages']]
+        for timing_name, previous_seconds, seconds in timings:
+            if previous_seconds <= 0:
+                continue
+            change = seconds / previous_seconds - 1
+            regression = change > threshold
+            regressions = regressions + (1 if regression else 0)
+            rotopy.log_message(rotopy.MESSAGE_INFO, f"{config_name:<14} {timing_name:<9} \
+{previous_seconds:>9.3f} -> {seconds:>9.3f} {change:>+8.1%}{' REGRESSION' if regression else ''}")
+    return regressions
+
+if __name__ == '__main__':
+    # Create a new ArgumentParser object
+    parser = argparse.ArgumentParser \
+(description='Time each stage of rotopy on synthetic Stable Diffusion frames. \n')
+
+    # Add arguments
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAME_COUNT, help='Number of frames to generate [100]')
+    parser.add_argument('--width', type=int, default=DEFAULT_WIDTH, help='Frame width [512]')
+    parser.add_argument('--height', type=int, default=DEFAULT_HEIGHT, help='Frame height [512]')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Runs of each configuration [3]')
+    parser.add_argument('--configs', type=str, default=",".join(BENCHMARK_CONFIGS), \
+help=f'Comma separated configurations [{",".join(BENCHMARK_CONFIGS)}]')
+    parser.add_argument('--output', type=str, default=DEFAULT_RESULTS_FILENAME, \
+help=f'Results JSON file [{DEFAULT_RESULTS_FILENAME}]')
+    parser.add_argument('--compare', type=str, help='Results JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, \
+help='Fractional slow-down reported as a regression [0.10]')
+    parser.add_argument('--parser', action='store_true', \
+help='Only time and check the Stable Diffusion parameters parser')
+    parser.add_argument('--parsertexts', type=int, default=DEFAULT_PARSER_TEXT_COUNT, \
+help=f'Number of parameters texts for --parser [{DEFAULT_PARSER_TEXT_COUNT}]')
+
+    # Parse the arguments
+    args = parser.parse_args()
+
+    if args.parser is True:
+        parser_results = benchmark_parser(args.parsertexts)
+        log_parser_results(parser_results)
+        with open(args.output, 'w', -1, 'utf-8') as results_file:
+            json.dump(parser_results, results_file, indent=4)
+        rotopy.log_message(rotopy.MESSAGE_INFO, f"Results written to {args.output}")
+        if parser_results['tokenizer_errors'] > 0 or parser_results['tokenizer_seconds'] > parser_results['split_seconds']:
+            sys.exit(ERR_PARSER)
+        sys.exit(0)
+
+    benchmark_configs = [config_name.strip() for config_name in args.configs.split(",") if config_name.strip()]
+    unknown_configs = [config_name for config_name in benchmark_configs if config_name not in BENCHMARK_CONFIGS]
+    if unknown_configs:
+        parser.error(f"unknown configurations {unknown_configs}")
+
+    benchmark_results = run_benchmark(args.frames, args.width, args.height, args.repeat, benchmark_configs)
+    log_results(benchmark_results)
+    with open(args.output, 'w', -1, 'utf-8') as results_file:
+        json.dump(benchmark_results, results_file, indent=4)
+    rotopy.log_message(rotopy.MESSAGE_INFO, f"Results written to {args.output}")
+
+    if args.compare is not None:
+        with open(args.compare, 'r', -1, 'utf-8') as previous_results_file:
+            if compare_results(json.load(previous_results_file), benchmark_results, args.threshold) > 0:
+                sys.exit(ERR_REGRESSION)
@@ -0,0 +1,314 @@
+"""
+RotoPy: the exit codes, messages, progress bar and run statistics shared by the rotopy modules.
+"""
+
+import threading
+import json
+import os
+import sys
+import contextlib
+import math
+import time
+import re
+import cv2
+import rotopy_settings as settings
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+DEFAULT_MOVIE_FILENAME = "output.mkv"
+DEFAULT_BACKUP_DIR = "bak"
+DEFAULT_PNG_EXTENSION = "png"
+DEFAULT_JPEG_EXTENSION = "jpg"
+DEFAULT_MANIFEST_FILENAME = "rotopy.manifest"
+DEFAULT_INDEX_FILENAME = "rotopy_index.jsonl"
+DEFAULT_RENAME_JOURNAL_FILENAME = "rotopy_rename.journal"
+DEFAULT_FRAMERATE = 25
+
+# --preview decoding flags for each reduction and the suffixes added to the movie file name and the JPEG file names,
+# so that the reduced frames never replace those of a full render
+PREVIEW_IMREAD_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+PREVIEW_MOVIE_SUFFIX = "_preview"
+PREVIEW_JPEG_SUFFIX = "_preview"
+
+# Progress bar redraw interval in seconds and its state
+PB_REDRAW_INTERVAL = 0.2
+PB_STATE = {'start': 0.0, 'drawn': 0.0}
+
+# Exit Errors
+ERR_MISSING_DIR = 1001
+ERR_INVALID_MOVIE_EXT = 1002
+ERR_USUPPORTED_MOVIE_EXT = 1003
+ERR_FRAMERATE_OUT_OF_RANGE = 1004
+ERR_USER_EXIT = 1004
+ERR_NO_PNG_FOR_JSON = 1005
+ERR_RENAME_DUPLICATE = 1006
+ERR_NO_JSON_FOR_ANNOTATE = 1007
+ERR_NO_PNG_TO_CONVERT = 1008
+ERR_EXIFTOOL_FAILED = 1009
+ERR_JOBS_OUT_OF_RANGE = 1010
+ERR_FRAME_SIZE_MISMATCH = 1011
+ERR_FFMPEG_FAILED = 1012
+ERR_INFLIGHT_OUT_OF_RANGE = 1013
+ERR_UNREADABLE_IMAGE = 1014
+ERR_PREVIEW_OUT_OF_RANGE = 1015
+ERR_SEGMENTS_OUT_OF_RANGE = 1016
+ERR_INVALID_FILES_FROM = 1017
+ERR_RENAME_JOURNAL = 1018
+ERR_WATCH_OUT_OF_RANGE = 1019
+ERR_INVALID_OUTPUT = 1020
+ERR_DEDUP_OUT_OF_RANGE = 1021
+ERR_INVALID_FRAME = 1022
+
+# Message levels
+MESSAGE_ERROR = 0
+MESSAGE_INFO = 1
+MESSAGE_WARN = 2
+MESSAGE_DEBUG = 3
+
+def log_message(level, message):
+    """
+    log_message(level, message)
+    Display messages as follows:
+    level = MESSAGE_ERROR: Error - always displayed
+    level = MESSAGE_INFO: Information - always displayed
+    level = MESSAGE_WARN: Warning - always displayed
+    level = MESSAGE_DEBUG: Debug - displayed only if verbose_mode is True
+    """
+
+    if level is MESSAGE_DEBUG:
+        if settings.VERBOSE_MODE is True:
+            print("DEBUG: " + message)
+    elif level is MESSAGE_WARN:
+        print("Warning: " +  message)
+    elif level is MESSAGE_INFO:
+        print(message)
+    elif level is MESSAGE_ERROR:
+        print("Error: " + message, file=sys.stderr)
+
+class RotopyError(ValueError):
+    """
+    RotopyError(message, exit_code)
+    An invalid setting or frame - main() displays message and exits the program with exit_code (an ERR_ code)
+    """
+
+    def __init__(self, message, exit_code):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+def pb_show(pb_count, pb_total, pb_suffix):
+    """
+    pb_show(pb_count, pb_total, pb_suffix):
+    Display progress bar using code from: https://www.geeksforgeeks.org/progress-bars-in-python/
+    pb_count is the counter value
+    pb_total is the total value
+    pb_suffix is the suffix text e.g. count
+    The throughput and ETA are added and redraws are limited to one every PB_REDRAW_INTERVAL seconds
+    """
+    pb_now = time.perf_counter()
+    if pb_count <= 1:
+        PB_STATE['start'] = pb_now
+        PB_STATE['drawn'] = 0.0
+    elif pb_count < pb_total and pb_now - PB_STATE['drawn'] < PB_REDRAW_INTERVAL:
+        return
+    PB_STATE['drawn'] = pb_now
+    pb_elapsed = pb_now - PB_STATE['start']
+    if pb_count > 1 and pb_elapsed > 0:
+        pb_rate = (pb_count - 1) / pb_elapsed
+        pb_eta = int((pb_total - pb_count) / pb_rate)
+        pb_suffix = f"{pb_suffix} {pb_rate:.1f}/s ETA {pb_eta // 60}:{pb_eta % 60:02d}"
+
+    pb_bar_length = 100
+    pb_filled_up_length = int(round(pb_bar_length * pb_count / pb_total))
+    pb_percentage = round(100.0 * pb_count / pb_total, 1)
+    pb_bar = '=' * pb_filled_up_length + '-' * (pb_bar_length - pb_filled_up_length)
+    #sys.stdout.write('[%s] %s%s ...%s\r' %(pb_bar, pb_percentage, '%', pb_suffix))
+    sys.stdout.write(f'[{pb_bar}] {pb_percentage}% ...{pb_suffix}   \r')
+    sys.stdout.flush()
+
+def peak_rss_bytes(rusage_who):
+    """
+    peak_rss_bytes(rusage_who)
+    return the peak resident set size in bytes of this process (resource.RUSAGE_SELF) or of its
+    finished child processes (resource.RUSAGE_CHILDREN) - None where the resource module is unavailable
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(rusage_who).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+def percentile(sorted_values, fraction):
+    """
+    percentile(sorted_values, fraction)
+    return the nearest-rank percentile (fraction 0..1) of the non-empty sorted list sorted_values
+    """
+    rank = max(1, int(math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+class RunStats:
+    """
+    RunStats()
+    Per-stage timings (cumulative and per frame), bytes read and written and peak memory of a run,
+    collected with --profile or --statsjson. Nothing is recorded until start() is called
+    Stages running on several threads record their own time, so a stage total can exceed the wall time
+    Stages timed for a batch of frames at once (e.g. metadata) have no per-frame percentiles
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.statsjson_file = None
+        self.lock = threading.Lock()
+        self.start_time = 0.0
+        self.frames = 0
+        self.stages = {}
+
+    def start(self, profile=False, statsjson_file=None):
+        """
+        start(profile, statsjson_file)
+        start recording from now - finish() displays the statistics if profile is True
+        and saves them to statsjson_file if it is set
+        """
+        self.enabled = True
+        self.profile = profile
+        self.statsjson_file = statsjson_file
+        self.start_time = time.perf_counter()
+        self.frames = 0
+        self.stages = {}
+
+    def stage(self, stage_name):
+        """
+        stage(stage_name)
+        return the dict of stage stage_name - the caller must hold the lock
+        """
+        if stage_name not in self.stages:
+            self.stages[stage_name] = {'seconds': [], 'total_seconds': 0.0, 'batched': False, 'frames': 0, \
+'bytes_read': 0, 'bytes_written': 0}
+        return self.stages[stage_name]
+
+    @contextlib.contextmanager
+    def timer(self, stage_name, frames=1):
+        """
+        timer(stage_name, frames)
+        context manager recording the time taken by stage stage_name for frames frames
+        """
+        if self.enabled is False:
+            yield
+            return
+        timer_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage_name, time.perf_counter() - timer_start, frames)
+
+    def record(self, stage_name, seconds, frames=1):
+        """
+        record(stage_name, seconds, frames)
+        record that stage stage_name took seconds for frames frames
+        """
+        if self.enabled is False:
+            return
+        with self.lock:
+            stage_stats = self.stage(stage_name)
+            # only the time of a single frame is a per-frame sample - the time of a batch is not split
+            # between its frames, which would report the batch average as the percentiles
+            if frames == 1:
+                stage_stats['seconds'].append(seconds)
+            else:
+                stage_stats['batched'] = True
+            stage_stats['total_seconds'] = stage_stats['total_seconds'] + seconds
+            stage_stats['frames'] = stage_stats['frames'] + frames
+
+    def add_bytes(self, stage_name, bytes_read=0, bytes_written=0):
+        """
+        add_bytes(stage_name, bytes_read, bytes_written)
+        add to the bytes read and written by stage stage_name
+        """
+        if self.enabled is False:
+            return
+        with self.lock:
+            stage_stats = self.stage(stage_name)
+            stage_stats['bytes_read'] = stage_stats['bytes_read'] + bytes_read
+            stage_stats['bytes_written'] = stage_stats['bytes_written'] + bytes_written
+
+    def add_frames(self, frames=1):
+        """
+        add_frames(frames)
+        count frames that have been completed
+        """
+        if self.enabled is True:
+            with self.lock:
+                self.frames = self.frames + frames
+
+    def report(self):
+        """
+        report()
+        return the statistics as a dict ready for JSON
+        """
+        wall_seconds = time.perf_counter() - self.start_time
+        stages_report = {}
+        with self.lock:
+            for stage_name, stage_stats in self.stages.items():
+                sorted_seconds = sorted(stage_stats['seconds']) if stage_stats['batched'] is False else []
+                total_seconds = stage_stats['total_seconds']
+                stages_report[stage_name] = {
+                    'frames': stage_stats['frames'],
+                    'total_seconds': round(total_seconds, 6),
+                    'p50_ms': round(1000 * percentile(sorted_seconds, 0.5), 3) if sorted_seconds else None,
+                    'p95_ms': round(1000 * percentile(sorted_seconds, 0.95), 3) if sorted_seconds else None,
+                    'max_ms': round(1000 * sorted_seconds[-1], 3) if sorted_seconds else None,
+                    'fps': round(stage_stats['frames'] / total_seconds, 2) if total_seconds > 0 else None,
+                    'bytes_read': stage_stats['bytes_read'],
+                    'bytes_written': stage_stats['bytes_written']}
+            frames = self.frames
+        return {'wall_seconds': round(wall_seconds, 6), 'frames': frames, \
+'fps': round(frames / wall_seconds, 2) if wall_seconds > 0 else None, \
+'peak_rss_bytes': peak_rss_bytes(resource.RUSAGE_SELF) if resource is not None else None, \
+'peak_rss_children_bytes': peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource is not None else None, \
+'stages': stages_report}
+
+    def log_report(self, run_report):
+        """
+        log_report(run_report)
+        display the statistics returned by report()
+        """
+        log_message(MESSAGE_INFO, f"\nProfile: {run_report['frames']} frames in {run_report['wall_seconds']:.2f}s \
+({run_report['fps']} fps), peak RSS {run_report['peak_rss_bytes']} bytes")
+        log_message(MESSAGE_INFO, f"{'stage':<10} {'frames':>7} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} \
+{'max ms':>9} {'fps':>9} {'read':>12} {'written':>12}")
+        for stage_name, stage_report in run_report['stages'].items():
+            log_message(MESSAGE_INFO, f"{stage_name:<10} {stage_report['frames']:>7} \
+{stage_report['total_seconds']:>9.3f} {stage_report['p50_ms']!s:>9} {stage_report['p95_ms']!s:>9} \
+{stage_report['max_ms']!s:>9} {stage_report['fps']!s:>9} {stage_report['bytes_read']:>12} \
+{stage_report['bytes_written']:>12}")
+
+    def finish(self):
+        """
+        finish()
+        display the statistics and save them to the statistics JSON file as set by start()
+        """
+        if self.enabled is False:
+            return
+        run_report = self.report()
+        if self.profile is True:
+            self.log_report(run_report)
+        if self.statsjson_file is not None:
+            with open(self.statsjson_file, 'w', -1, 'utf-8') as stats_file:
+                json.dump(run_report, stats_file, indent=4)
+            log_message(MESSAGE_INFO, f"Statistics written to {self.statsjson_file}")
+
+# Statistics of the current run - see RunStats.start()
+RUN_STATS = RunStats()
+
+def natural_sort_key(name):
+    """
+    natural_sort_key(name)
+    return the key that sorts name with its numbers in numeric order, e.g. frame2.png before frame10.png
+    """
+    # the name itself orders names that only differ in leading zeros or case
+    return ([int(name_part) if name_part.isdigit() else name_part.lower() \
+for name_part in re.split(r'(\d+)', name.replace(os.sep, "/"))], name)
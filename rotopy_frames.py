@@ -0,0 +1,509 @@
+"""
+RotoPy: reading, decoding, deduplicating, annotating and saving the frames through the frame pipeline.
+"""
+
+import queue
+import threading
+import os
+import sys
+import functools
+import math
+import numpy as np
+import cv2
+import rotopy_settings as settings
+from rotopy_common import DEFAULT_JPEG_EXTENSION, PREVIEW_IMREAD_FLAGS, PREVIEW_JPEG_SUFFIX, ERR_FRAME_SIZE_MISMATCH, \
+ERR_UNREADABLE_IMAGE, MESSAGE_ERROR, MESSAGE_INFO, MESSAGE_DEBUG, log_message, pb_show, RUN_STATS
+from rotopy_metadata import load_frame_parameters
+from rotopy_writers import read_jpeg_size
+
+# Frame pipeline: seconds between checks for a stopped pipeline and the end of frames marker
+PIPELINE_POLL_INTERVAL = 0.1
+PIPELINE_END = object()
+
+# --dedup merges frames whose difference hashes (of a DEDUP_HASH_ROWS x DEDUP_HASH_ROWS + 1 grid) differ
+# by no more than DEFAULT_DEDUP_THRESHOLD bits, and then only if their pixels are the same - or with a threshold,
+# if no pixel of their DEDUP_THUMBNAIL_SIZE x DEDUP_THUMBNAIL_SIZE thumbnails differs by more than
+# DEDUP_THUMBNAIL_TOLERANCE levels (the hash alone ignores brightness changes, e.g. a fade)
+DEDUP_HASH_ROWS = 8
+DEDUP_HASH_SAMPLES = 64
+DEFAULT_DEDUP_THRESHOLD = 0
+DEDUP_THUMBNAIL_SIZE = 16
+DEDUP_THUMBNAIL_TOLERANCE = 2
+
+# Annotation defaults
+TOP_BAR = 30
+TEXT_OFFSET_X = 10
+TEXT_OFFSET_Y = 20
+TEXT_FONTSCALE = 0.2
+TEXT_FONTFACE = cv2.FONT_HERSHEY_SIMPLEX
+# (label, parameter) of each field of the bar - fields missing from the parameters are left out
+ANNOTATION_FIELDS = [("Steps", "Steps"), ("CFG", "CFG scale"), ("Model", "Model"), ("Sampler", "Sampler"), \
+("Seed", "Seed"), ("Denoise", "Denoising strength")]
+ANNOTATION_SEPARATOR = " | "
+# the bar of a frame too narrow for its text is scaled down in steps of 1/ANNOTATION_SCALE_STEPS
+ANNOTATION_SCALE_STEPS = 16
+# rendered text tiles kept for reuse
+ANNOTATION_CACHE_SIZE = 1024
+
+def frame_hash(image):
+    """
+    frame_hash(image)
+    return the 64 bit difference hash of the BGR image: a bit for each pair of neighbouring blocks of
+    an 8 x 9 grid, set if the left block is brighter
+    The blocks are averaged over a sample of about DEDUP_HASH_SAMPLES rows and columns of pixels
+    """
+    height, width = image.shape[:2]
+    sample_step = max(1, min(height, width) // DEDUP_HASH_SAMPLES)
+    sample = image[::sample_step, ::sample_step]
+    block_height = sample.shape[0] // DEDUP_HASH_ROWS
+    block_width = sample.shape[1] // (DEDUP_HASH_ROWS + 1)
+    if block_height == 0 or block_width == 0:
+        # smaller than the grid
+        blocks = cv2.resize(image, (DEDUP_HASH_ROWS + 1, DEDUP_HASH_ROWS), interpolation=cv2.INTER_AREA) \
+.reshape(DEDUP_HASH_ROWS, DEDUP_HASH_ROWS + 1, -1).sum(axis=2, dtype=np.uint32)
+    else:
+        # the blocks have the same size, so their sums compare as their means would
+        blocks = sample[:block_height * DEDUP_HASH_ROWS, :block_width * (DEDUP_HASH_ROWS + 1)] \
+.reshape(DEDUP_HASH_ROWS, block_height, DEDUP_HASH_ROWS + 1, block_width, -1).sum(axis=(1, 3, 4), dtype=np.uint32)
+    return int.from_bytes(np.packbits(blocks[:, :-1] > blocks[:, 1:]).tobytes(), 'big')
+
+def frame_thumbnail(image):
+    """
+    frame_thumbnail(image)
+    return the DEDUP_THUMBNAIL_SIZE x DEDUP_THUMBNAIL_SIZE thumbnail of the BGR image (averaged over its pixels)
+    """
+    return cv2.resize(image, (DEDUP_THUMBNAIL_SIZE, DEDUP_THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA) \
+.astype(np.int16)
+
+class FrameDeduplicator:
+    """
+    FrameDeduplicator(threshold)
+    --dedup: decide in frame order which frames are duplicates of the frame before them
+    A frame is a duplicate if its frame_hash() is within threshold bits of the hash of the first frame of the run,
+    so that a slow change is not merged, and the hash is confirmed against that frame: with threshold 0 the pixels
+    must be the same, otherwise their frame_thumbnail() pixels must be within DEDUP_THUMBNAIL_TOLERANCE levels
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.run_hash = None
+        # the first frame of the run (a copy, as frames are annotated in place) or its thumbnail
+        self.run_image = None
+        self.duplicate_count = 0
+
+    def is_duplicate(self, image_hash, image):
+        """
+        is_duplicate(image_hash, image)
+        return True if the next frame, the BGR image of hash image_hash, is a duplicate of the frame before it
+        """
+        if self.run_hash is not None and bin(image_hash ^ self.run_hash).count("1") <= self.threshold:
+            if self.threshold == 0:
+                duplicate_frame = np.array_equal(image, self.run_image)
+            else:
+                duplicate_frame = self.run_image.shape == frame_thumbnail(image).shape and \
+int(np.abs(frame_thumbnail(image) - self.run_image).max()) <= DEDUP_THUMBNAIL_TOLERANCE
+            if duplicate_frame is True:
+                self.duplicate_count = self.duplicate_count + 1
+                return True
+        self.run_hash = image_hash
+        self.run_image = image.copy() if self.threshold == 0 else frame_thumbnail(image)
+        return False
+
+    def report(self, frame_count):
+        """
+        report(frame_count)
+        display how many of the frame_count frames were duplicates
+        """
+        log_message(MESSAGE_INFO, f"\n{self.duplicate_count} of {frame_count} frames are duplicates \
+of the frame before them")
+
+def read_png_bytes(png_file, input_directory_path):
+    """
+    read_png_bytes(png_file, input_directory_path)
+    return the contents of PNG file png_file
+    """
+    log_message(MESSAGE_DEBUG, f"Reading {input_directory_path + png_file}\
+for conversion")
+    with open(os.path.join(input_directory_path, png_file), 'rb') as png_data_file:
+        png_data = png_data_file.read()
+    RUN_STATS.add_bytes("read", bytes_read=len(png_data))
+    return png_data
+
+def decode_png_frame(png_file, png_data):
+    """
+    decode_png_frame(png_file, png_data)
+    return the BGR image decoded from the contents png_data of PNG file png_file
+    """
+    # Use OpenCV to convert file
+    # --preview decodes at reduced size
+    imread_flags = PREVIEW_IMREAD_FLAGS[settings.PREVIEW_VAL] if settings.PREVIEW_VAL is not None else cv2.IMREAD_COLOR
+    image = cv2.imdecode(np.frombuffer(png_data, np.uint8), imread_flags)
+    if image is None:
+        log_message(MESSAGE_ERROR, f"unable to decode image file {png_file} - exiting program")
+        sys.exit(ERR_UNREADABLE_IMAGE)  # Use a non-zero exit code to indicate an error
+    return image
+
+def annotation_fields(frame_name, parameters):
+    """
+    annotation_fields(frame_name, parameters)
+    return the texts of the bar of frame frame_name: the frame name and a tuple of each of the
+    ANNOTATION_FIELDS in the extracted parameters dict parameters ("" and () without parameters)
+    """
+    if not isinstance(parameters, dict):
+        return "", ()
+    return os.path.splitext(frame_name)[0], tuple(f"{label} {parameters[parameter]}" \
+for label, parameter in ANNOTATION_FIELDS if parameters.get(parameter) is not None and parameters[parameter] != "")
+
+@functools.lru_cache(maxsize=ANNOTATION_CACHE_SIZE)
+def annotation_tile(text, scale):
+    """
+    annotation_tile(text, scale)
+    return the BGR image of the white text on the black bar scaled by scale, as wide as the text
+    The tiles are cached (least recently used first out) and must not be changed
+    """
+    bar_height = max(1, int(TOP_BAR * scale))
+    font_scale = TEXT_FONTSCALE * scale
+    (text_width, _text_height), _baseline = cv2.getTextSize(text, TEXT_FONTFACE, font_scale, 1)
+    tile = np.zeros((bar_height, max(1, text_width), 3), dtype=np.uint8)
+    cv2.putText(tile, text, (0, int(TEXT_OFFSET_Y * scale)), fontScale = font_scale, fontFace = TEXT_FONTFACE, \
+color = (255,255,255), thickness = 1, bottomLeftOrigin=False)
+    tile.flags.writeable = False
+    return tile
+
+@functools.lru_cache(maxsize=ANNOTATION_CACHE_SIZE)
+def annotation_fields_tile(fields, scale):
+    """
+    annotation_fields_tile(fields, scale)
+    return the annotation_tile() of the tuple of texts fields separated by ANNOTATION_SEPARATOR and
+    following the frame name
+    The tile of each text is rendered once, so a change of Seed only renders the Seed again
+    """
+    tile = np.concatenate([annotation_tile(ANNOTATION_SEPARATOR + field, scale) for field in fields], axis=1)
+    tile.flags.writeable = False
+    return tile
+
+def annotation_tiles(frame_text, fields, scale):
+    """
+    annotation_tiles(frame_text, fields, scale)
+    return the list of tiles of the bar with the frame name frame_text and the tuple of texts fields at scale scale
+    """
+    if frame_text == "":
+        return []
+    if not fields:
+        return [annotation_tile(frame_text, scale)]
+    return [annotation_tile(frame_text, scale), annotation_fields_tile(fields, scale)]
+
+def annotate_image(frame_name, image, parameters, preview=None):
+    """
+    annotate_image(frame_name, image, parameters, preview)
+    return the image of frame frame_name annotated with the extracted parameters dict parameters
+    (None or 'None' for a frame without parameters) - fields missing from parameters are left out
+    preview is the reduction the image was decoded with (None for a full size image)
+    The bar is drawn on the image from cached text tiles, so the time taken does not depend on the image size
+    """
+    frame_text, fields = annotation_fields(frame_name, parameters)
+    log_message(MESSAGE_DEBUG, f"annotating file with {ANNOTATION_SEPARATOR.join((frame_text,) + fields)}")
+    height, width = image.shape[:2]
+    # the bar is scaled down with the --preview image
+    scale = 1 / preview if preview is not None else 1
+    tiles = annotation_tiles(frame_text, fields, scale)
+    text_width = sum(tile.shape[1] for tile in tiles)
+    bar_width = int(TEXT_OFFSET_X * scale) + text_width
+    if bar_width > width:
+        # and with a frame too narrow for the text
+        scale = max(1, math.floor(ANNOTATION_SCALE_STEPS * scale * width / bar_width)) / ANNOTATION_SCALE_STEPS
+        tiles = annotation_tiles(frame_text, fields, scale)
+        text_width = sum(tile.shape[1] for tile in tiles)
+
+    bar_height = min(height, max(1, int(TOP_BAR * scale)))
+    text_x = min(width, int(TEXT_OFFSET_X * scale))
+    text_width = min(width - text_x, text_width)
+    image[:bar_height, :text_x] = 0
+    image[:bar_height, text_x + text_width:] = 0
+    if text_width > 0:
+        image[:bar_height, text_x:text_x + text_width] = np.concatenate(tiles, axis=1)[:bar_height, :text_width]
+    return image
+
+def annotate_frame(png_file, image, output_directory_path, metadata_index=None):
+    """
+    annotate_frame(png_file, image, output_directory_path, metadata_index)
+    return the image of PNG file png_file annotated with the data from
+    metadata_index or its JSON file in output_directory_path
+    """
+    json_data = load_frame_parameters(png_file, output_directory_path, metadata_index)
+    return annotate_image(png_file, image, json_data, settings.PREVIEW_VAL)
+
+# a pipeline stage function given the state shared by convert_png_files
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def dedup_frame(png_file, image, frame_hashes, deduplicator, duplicate_files, keep_duplicate):
+    """
+    dedup_frame(png_file, image, frame_hashes, deduplicator, duplicate_files, keep_duplicate)
+    decide with the FrameDeduplicator deduplicator (in frame order) whether PNG file png_file of hash
+    frame_hashes[png_file] is a duplicate, and if so add it to the set duplicate_files
+    return the image, or None for a duplicate unless keep_duplicate is True (e.g. it is saved as a JPEG file)
+    """
+    if deduplicator.is_duplicate(frame_hashes.pop(png_file), image):
+        duplicate_files.add(png_file)
+        return image if keep_duplicate is True else None
+    return image
+
+def hash_frame(png_file, image, frame_hashes):
+    """
+    hash_frame(png_file, image, frame_hashes)
+    add the frame_hash() of the image of PNG file png_file to the dict frame_hashes
+    return the image
+    """
+    frame_hashes[png_file] = frame_hash(image)
+    return image
+
+def write_jpeg_file(png_file, image, output_directory_path, run_stats=None, preview=None):
+    """
+    write_jpeg_file(png_file, image, output_directory_path, run_stats, preview)
+    save the image of PNG file png_file as a JPEG file in output_directory_path
+    and add its size to the RunStats run_stats [RUN_STATS]
+    a --preview frame (preview is not None) is saved as <name>_preview.jpg
+    return the image
+    """
+    if run_stats is None:
+        run_stats = RUN_STATS
+    jpeg_file =os.path.splitext(png_file)[0] + (PREVIEW_JPEG_SUFFIX if preview is not None else "") + "." + \
+DEFAULT_JPEG_EXTENSION
+    if os.path.dirname(jpeg_file) != "":
+        os.makedirs(os.path.join(output_directory_path, os.path.dirname(jpeg_file)), exist_ok=True)
+    cv2.imwrite(os.path.join(output_directory_path, f"{jpeg_file}"), image)
+    if run_stats.enabled is True:
+        run_stats.add_bytes("jpeg", bytes_written=os.path.getsize(os.path.join(output_directory_path, jpeg_file)))
+    log_message(MESSAGE_DEBUG, f"\nJPEG file {output_directory_path + jpeg_file} \
+saved")
+    return image
+
+# the stages, their queues and the worker and failure state
+# pylint: disable-next=too-many-instance-attributes
+class FramePipeline:
+    """
+    FramePipeline(stages, max_inflight)
+    Pass frames through stages running on their own threads connected by queues, so that
+    reading, decoding, annotating and writing different frames overlap (OpenCV releases the GIL)
+    stages is a list of (name, function, worker_count) - function(item, payload) returns the payload
+    for the next stage, starting from payload None
+    A stage of one worker gets the frames in order, so it can depend on the frames before them (e.g. --dedup)
+    At most max_inflight frames are between the first stage and the caller, which keeps memory flat
+    The first failure in any stage stops the pipeline and is re-raised by run()
+    """
+
+    def __init__(self, stages, max_inflight):
+        self.stages = stages
+        self.max_inflight = max_inflight
+        # room for every frame in flight and the end of frames markers so that put() never blocks
+        self.queues = [queue.Queue(maxsize=max_inflight + worker_count) for _name, _function, worker_count in stages]
+        self.queues.append(queue.Queue(maxsize=max_inflight + 1))
+        self.inflight = threading.Semaphore(max_inflight)
+        self.stop_event = threading.Event()
+        self.failure = None
+        self.failure_lock = threading.Lock()
+        self.workers_left = [worker_count for _name, _function, worker_count in stages]
+
+    def fail(self, failure):
+        """
+        fail(failure)
+        record the first failure and stop all the stages
+        """
+        with self.failure_lock:
+            if self.failure is None:
+                self.failure = failure
+        self.stop_event.set()
+
+    def get(self, stage_queue):
+        """
+        get(stage_queue)
+        return the next entry of stage_queue or None once the pipeline has been stopped
+        """
+        while not self.stop_event.is_set():
+            try:
+                return stage_queue.get(timeout=PIPELINE_POLL_INTERVAL)
+            except queue.Empty:
+                pass
+        return None
+
+    def feed(self, items):
+        """
+        feed(items)
+        put each item into the first queue once there is room for another frame in flight
+        """
+        try:
+            for sequence, item in enumerate(items):
+                while not self.inflight.acquire(timeout=PIPELINE_POLL_INTERVAL):  # pylint: disable=consider-using-with
+                    if self.stop_event.is_set():
+                        return
+                self.queues[0].put((sequence, item, None))
+            for _worker in range(self.stages[0][2]):
+                self.queues[0].put(PIPELINE_END)
+        except BaseException as pipeline_e:  # pylint: disable=broad-exception-caught
+            self.fail(pipeline_e)
+
+    # the worker loop keeps the frame order of a single worker stage
+    # pylint: disable-next=too-many-locals
+    def work(self, stage_index):
+        """
+        work(stage_index)
+        apply the function of stage stage_index to each frame of its queue
+        """
+        stage_name, stage_function, worker_count = self.stages[stage_index]
+        # a stage of one worker takes the frames in order, held here until the frames before them arrive
+        waiting = {}
+        next_sequence = 0
+        try:
+            while True:
+                entry = self.get(self.queues[stage_index])
+                if entry is None:
+                    return
+                if entry is PIPELINE_END:
+                    break
+                if worker_count > 1:
+                    ready = [entry]
+                else:
+                    waiting[entry[0]] = entry
+                    ready = []
+                    while next_sequence in waiting:
+                        ready.append(waiting.pop(next_sequence))
+                        next_sequence = next_sequence + 1
+                for sequence, item, payload in ready:
+                    with RUN_STATS.timer(stage_name):
+                        payload = stage_function(item, payload)
+                    self.queues[stage_index + 1].put((sequence, item, payload))
+        except BaseException as pipeline_e:  # pylint: disable=broad-exception-caught
+            self.fail(pipeline_e)
+            return
+
+        # the last worker of a stage to finish tells the next stage
+        with self.failure_lock:
+            self.workers_left[stage_index] = self.workers_left[stage_index] - 1
+            last_worker = self.workers_left[stage_index] == 0
+        if last_worker:
+            next_worker_count = self.stages[stage_index + 1][2] if stage_index + 1 < len(self.stages) else 1
+            for _worker in range(next_worker_count):
+                self.queues[stage_index + 1].put(PIPELINE_END)
+
+    def run(self, items):
+        """
+        run(items)
+        yield (item, payload) for each item in items in order once it has passed through every stage
+        """
+        threads = [threading.Thread(target=self.feed, args=(items,), name="feed", daemon=True)]
+        for stage_index, (stage_name, _function, worker_count) in enumerate(self.stages):
+            threads += [threading.Thread(target=self.work, args=(stage_index,), name=f"{stage_name}-{worker}", \
+daemon=True) for worker in range(worker_count)]
+        for thread in threads:
+            thread.start()
+
+        # the stages may finish frames out of order
+        finished = {}
+        next_sequence = 0
+        try:
+            while True:
+                entry = self.get(self.queues[-1])
+                if entry is None or entry is PIPELINE_END:
+                    break
+                sequence, item, payload = entry
+                finished[sequence] = (item, payload)
+                while next_sequence in finished:
+                    yield finished.pop(next_sequence)
+                    next_sequence = next_sequence + 1
+                    self.inflight.release()
+        finally:
+            self.stop_event.set()
+            for thread in threads:
+                thread.join()
+        if self.failure is not None:
+            raise self.failure
+
+# the signature used by main and MovieWatcher
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+def convert_png_files(png_files, input_directory_path, output_directory_path, frame_writer=None, \
+metadata_index=None, keep_jpeg=True):
+    """
+    convert_png_files(png_files, input_directory_path, output_directory_path, frame_writer, metadata_index,
+    keep_jpeg)
+    Convert the PNG files in str list png_files through a FramePipeline that reads them on one thread,
+    decodes them on JOBS_VAL threads and annotates them on JOBS_VAL threads with the data from metadata_index
+    (or the JSON files) if required - the cached annotation tiles are shared read-only by the threads
+    If frame_writer is set the frames are written to it in order and JPEG files are only
+    created with --keepjpeg
+    With --dedup the frames are hashed as they are decoded and a frame that is a duplicate of the last frame
+    written is only repeated by frame_writer - it is decided in order before the annotate stage, so a duplicate
+    is not annotated unless it is saved as a JPEG file
+    keep_jpeg False never creates JPEG files (e.g. the input files are JPEG files)
+    """
+    png_file_count = len(png_files)
+    jpeg_create_count = 0
+    # the hashes are taken before the frames are annotated
+    frame_hashes = {}
+    duplicate_files = set()
+    dedup_mode = settings.DEDUP_VAL is not None and frame_writer is not None
+    deduplicator = FrameDeduplicator(settings.DEDUP_VAL) if dedup_mode is True else None
+    jpeg_mode = keep_jpeg is True and (frame_writer is None or settings.KEEPJPEG_MODE is True)
+    stages = [("read", lambda png_file, _payload: read_png_bytes(png_file, input_directory_path), 1), \
+("decode", lambda png_file, png_data: hash_frame(png_file, decode_png_frame(png_file, png_data), frame_hashes) \
+if dedup_mode is True else decode_png_frame(png_file, png_data), settings.JOBS_VAL)]
+    if dedup_mode is True:
+        # one worker, so that the frames are compared in order
+        stages.append(("dedup", lambda png_file, image: \
+dedup_frame(png_file, image, frame_hashes, deduplicator, duplicate_files, jpeg_mode), 1))
+    if settings.ANNOTATE_MODE is True:
+        stages.append(("annotate", lambda png_file, image: \
+annotate_frame(png_file, image, output_directory_path, metadata_index) if image is not None else None, \
+settings.JOBS_VAL))
+    if jpeg_mode is True:
+        stages.append(("jpeg", lambda png_file, image: write_jpeg_file(png_file, image, output_directory_path, \
+preview=settings.PREVIEW_VAL), settings.JOBS_VAL))
+
+    max_inflight = settings.INFLIGHT_VAL if settings.INFLIGHT_VAL is not None else 2 * settings.JOBS_VAL + len(stages)
+    for png_file, image in FramePipeline(stages, max_inflight).run(png_files):
+        if dedup_mode is True and png_file in duplicate_files:
+            duplicate_files.remove(png_file)
+            log_message(MESSAGE_DEBUG, f"{png_file} is a duplicate of the previous frame")
+            with RUN_STATS.timer("encode"):
+                frame_writer.repeat()
+            image = None
+        if frame_writer is not None and image is not None:
+            with RUN_STATS.timer("encode"):
+                frame_writer.write(image)
+            RUN_STATS.add_bytes("encode", bytes_written=image.nbytes)
+        RUN_STATS.add_frames()
+        if settings.VERBOSE_MODE is False:
+            jpeg_create_count = jpeg_create_count + 1
+            pb_show(jpeg_create_count,png_file_count,str(jpeg_create_count))
+    if dedup_mode is True:
+        deduplicator.report(png_file_count)
+
+def stream_jpeg_files(jpeg_files, input_directory_path, frame_writer):
+    """
+    stream_jpeg_files(jpeg_files, input_directory_path, frame_writer)
+    Pass the JPEG files in str list jpeg_files through to FfmpegJpegWriter frame_writer unchanged
+    All frame headers are checked for the same size before ffmpeg is started
+    """
+    jpeg_file_count = len(jpeg_files)
+    jpeg_sizes = []
+    with RUN_STATS.timer("read", jpeg_file_count):
+        for jpeg_file in jpeg_files:
+            jpeg_size = read_jpeg_size(os.path.join(input_directory_path, jpeg_file))
+            if jpeg_size is None:
+                log_message(MESSAGE_ERROR, f"unable to read the frame header of image file {jpeg_file} \
+- exiting program")
+                sys.exit(ERR_UNREADABLE_IMAGE)  # Use a non-zero exit code to indicate an error
+            if jpeg_sizes and jpeg_size != jpeg_sizes[0]:
+                log_message(MESSAGE_ERROR, f"{jpeg_file} is {jpeg_size[0]}x{jpeg_size[1]} but {jpeg_files[0]} is \
+{jpeg_sizes[0][0]}x{jpeg_sizes[0][1]} - all images must have the same size")
+                sys.exit(ERR_FRAME_SIZE_MISMATCH)  # Use a non-zero exit code to indicate an error
+            jpeg_sizes.append(jpeg_size)
+
+    jpeg_stream_count = 0
+    for jpeg_file, jpeg_size in zip(jpeg_files, jpeg_sizes):
+        log_message(MESSAGE_DEBUG, f"Passing {jpeg_file} through to ffmpeg")
+        with RUN_STATS.timer("encode"):
+            bytes_sent = frame_writer.write_file(os.path.join(input_directory_path, jpeg_file), jpeg_size)
+        RUN_STATS.add_bytes("encode", bytes_read=bytes_sent, bytes_written=bytes_sent)
+        RUN_STATS.add_frames()
+        if settings.VERBOSE_MODE is False:
+            jpeg_stream_count = jpeg_stream_count + 1
+            pb_show(jpeg_stream_count,jpeg_file_count,str(jpeg_stream_count))
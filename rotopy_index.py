@@ -0,0 +1,528 @@
+"""
+RotoPy: the frame files - the index of the input directory, the --incremental manifest and --rename.
+"""
+
+import collections
+import json
+import os
+import shutil
+import hashlib
+import errno
+import sys
+from datetime import datetime
+import rotopy_settings as settings
+from rotopy_common import DEFAULT_BACKUP_DIR, DEFAULT_PNG_EXTENSION, DEFAULT_JPEG_EXTENSION, \
+DEFAULT_RENAME_JOURNAL_FILENAME, ERR_RENAME_DUPLICATE, ERR_INVALID_FILES_FROM, ERR_RENAME_JOURNAL, MESSAGE_ERROR, \
+MESSAGE_INFO, MESSAGE_WARN, MESSAGE_DEBUG, log_message, natural_sort_key
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+# --rename journal format and the Linux ioctl that clones a file for a reflink backup
+RENAME_JOURNAL_VERSION = 1
+FICLONE = 0x40049409
+
+# Incremental build manifest format and the block size used to hash source files
+MANIFEST_VERSION = 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# PNG and JPEG extensions of the frame files found by FrameIndex
+FRAME_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+
+class FrameIndex:
+    """
+    FrameIndex(input_directory_path, recursive, files_from_path)
+    The frame files found by a single os.scandir pass of input_directory_path (and of its subdirectories
+    if recursive is True), or listed in the text file files_from_path, with their stat results
+    Frames are named by their path relative to input_directory_path and kept in natural sort order
+    (or in the order of files_from_path), so that no stage needs to list or stat the directory again
+    """
+
+    def __init__(self, input_directory_path, recursive=False, files_from_path=None):
+        self.input_directory_path = input_directory_path
+        self.recursive = recursive
+        self.files_from_path = files_from_path
+        self.entries = {}
+        self.sort_keys = {}
+
+    def scan(self):
+        """
+        scan()
+        build the index of the PNG and JPEG files
+        """
+        self.entries = {}
+        self.sort_keys = {}
+        if self.files_from_path is not None:
+            self.read_files_from()
+            return
+        directories = [""]
+        while directories:
+            directory = directories.pop()
+            with os.scandir(os.path.join(self.input_directory_path, directory)) as directory_entries:
+                for directory_entry in directory_entries:
+                    name = os.path.join(directory, directory_entry.name)
+                    if directory_entry.is_dir(follow_symlinks=False):
+                        # the backup directory of --rename holds copies of the frames
+                        if self.recursive is True and directory_entry.name != DEFAULT_BACKUP_DIR:
+                            directories.append(name)
+                    elif os.path.splitext(name)[1].lower() in FRAME_EXTENSIONS and directory_entry.is_file():
+                        self.add(name, directory_entry.stat())
+                    else:
+                        log_message(MESSAGE_DEBUG, f"Skipping non-frame file/directory {name}")
+
+    def read_files_from(self):
+        """
+        read_files_from()
+        build the index from the paths listed one per line in files_from_path, keeping their order
+        """
+        try:
+            with open(self.files_from_path, 'r', -1, 'utf-8') as files_from_file:
+                listed_paths = [line.strip() for line in files_from_file if line.strip() != ""]
+        except OSError as files_from_e:
+            log_message(MESSAGE_ERROR, f"unable to read file list {self.files_from_path}: {files_from_e}")
+            sys.exit(ERR_INVALID_FILES_FROM)  # Use a non-zero exit code to indicate an error
+        for list_position, listed_path in enumerate(listed_paths):
+            name = os.path.normpath(os.path.relpath(os.path.join(self.input_directory_path, listed_path), \
+self.input_directory_path))
+            if name.split(os.sep)[0] == os.pardir:
+                log_message(MESSAGE_ERROR, f"{listed_path} in {self.files_from_path} is not in the input directory \
+{self.input_directory_path}")
+                sys.exit(ERR_INVALID_FILES_FROM)  # Use a non-zero exit code to indicate an error
+            try:
+                self.add(name, os.stat(self.path(name)))
+            except OSError as stat_e:
+                log_message(MESSAGE_ERROR, f"{listed_path} in {self.files_from_path} not found: {stat_e}")
+                sys.exit(ERR_INVALID_FILES_FROM)  # Use a non-zero exit code to indicate an error
+            self.sort_keys[name] = (list_position, name)
+
+    def add(self, name, file_stat):
+        """
+        add(name, file_stat)
+        add frame file name with its stat result file_stat
+        """
+        self.entries[name] = file_stat
+        self.sort_keys[name] = natural_sort_key(name)
+
+    def path(self, name):
+        """
+        path(name)
+        return the path of frame file name
+        """
+        return os.path.join(self.input_directory_path, name)
+
+    def stat(self, name):
+        """
+        stat(name)
+        return the stat result of frame file name
+        """
+        return self.entries[name]
+
+    def exists(self, name):
+        """
+        exists(name)
+        return True if frame file name is in the index
+        (or in the input directory if the index only holds the files listed in files_from_path)
+        """
+        if self.files_from_path is not None and name not in self.entries:
+            return os.path.lexists(self.path(name))
+        return name in self.entries
+
+    def rename(self, name, new_name):
+        """
+        rename(name, new_name)
+        record that frame file name has been renamed to new_name - it keeps its place in a file list order
+        """
+        self.entries[new_name] = self.entries.pop(name)
+        sort_key = self.sort_keys.pop(name)
+        self.sort_keys[new_name] = sort_key if self.files_from_path is not None else natural_sort_key(new_name)
+
+    def files(self, extensions):
+        """
+        files(extensions)
+        return the frame files with one of the (lower case) extensions in order
+        """
+        return sorted([name for name in self.entries if os.path.splitext(name)[1].lower() in extensions], \
+key=self.sort_keys.get)
+
+def file_sha1(file_path):
+    """
+    file_sha1(file_path)
+    return the SHA-1 hex digest of the contents of file_path
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as hash_file:
+        for file_block in iter(lambda: hash_file.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(file_block)
+    return sha1.hexdigest()
+
+class BuildManifest:
+    """
+    BuildManifest(manifest_path)
+    Record of each source PNG file (size, mtime and SHA-1) and of the outputs derived from it
+    (metadata record, JPEG file and movie file) so that --incremental only rebuilds what has changed
+    The file contents are only hashed when the size or mtime no longer matches
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        self.entries = {}
+        self.movie = None
+        self.reused = collections.Counter()
+        self.rebuilt = collections.Counter()
+
+    def load(self):
+        """
+        load()
+        read the manifest file - a missing or unreadable manifest file starts an empty manifest
+        """
+        try:
+            with open(self.manifest_path, 'r', -1, 'utf-8') as manifest_file:
+                manifest_data = json.load(manifest_file)
+        except FileNotFoundError:
+            log_message(MESSAGE_DEBUG, f"no manifest file {self.manifest_path} (not an error)")
+            return
+        except (OSError, ValueError) as manifest_e:
+            log_message(MESSAGE_WARN, f"ignoring unreadable manifest file {self.manifest_path}: {manifest_e}")
+            return
+        if manifest_data.get('version') != MANIFEST_VERSION:
+            log_message(MESSAGE_WARN, f"ignoring manifest file {self.manifest_path} from another version")
+            return
+        self.entries = manifest_data.get('sources', {})
+        self.movie = manifest_data.get('movie')
+
+    def save(self):
+        """
+        save()
+        write the manifest file, replacing the previous one only once it has been written
+        """
+        manifest_data = {'version': MANIFEST_VERSION, 'sources': self.entries, 'movie': self.movie}
+        with open(self.manifest_path + ".tmp", 'w', -1, 'utf-8') as manifest_file:
+            json.dump(manifest_data, manifest_file, indent=1)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def refresh(self, filename, source_path, source_stat=None):
+        """
+        refresh(filename, source_path, source_stat)
+        return the entry for source file filename after dropping any outputs that are out of date
+        source_stat is the stat result of source_path if already known (e.g. from a FrameIndex)
+        """
+        if source_stat is None:
+            source_stat = os.stat(source_path)
+        entry = self.entries.get(filename)
+        if entry is not None and entry['size'] == source_stat.st_size \
+and entry['mtime_ns'] == source_stat.st_mtime_ns:
+            return entry
+
+        sha1 = file_sha1(source_path)
+        if entry is None or entry['sha1'] != sha1:
+            entry = {'sha1': sha1}
+            self.entries[filename] = entry
+        else:
+            # same contents but the FileModifyDate used by --rename may have changed
+            entry.pop('metadata', None)
+        entry['size'] = source_stat.st_size
+        entry['mtime_ns'] = source_stat.st_mtime_ns
+        return entry
+
+    def prune(self, filenames, output_directory_path):
+        """
+        prune(filenames, output_directory_path)
+        forget the source files that are not in str list filenames and delete their JSON and JPEG files
+        """
+        for filename in set(self.entries) - set(filenames):
+            entry = self.entries.pop(filename)
+            stale_files = [os.path.splitext(filename)[0] + ".json"]
+            if 'jpeg' in entry:
+                stale_files.append(entry['jpeg']['file'])
+            for stale_file in stale_files:
+                try:
+                    os.remove(os.path.join(output_directory_path, stale_file))
+                    log_message(MESSAGE_DEBUG, f"Deleted stale file {stale_file}")
+                except OSError:
+                    log_message(MESSAGE_DEBUG, f"stale file {stale_file} not found (not an error)")
+            self.rebuilt['pruned'] = self.rebuilt['pruned'] + 1
+
+    def jpeg_current(self, filename, source_path, output_directory_path, source_stat=None):
+        """
+        jpeg_current(filename, source_path, output_directory_path, source_stat)
+        return True if the JPEG file for filename exists and was made from the same source with the same settings
+        """
+        jpeg_entry = self.refresh(filename, source_path, source_stat).get('jpeg')
+        return jpeg_entry is not None and jpeg_entry['annotate'] == settings.ANNOTATE_MODE \
+and os.path.isfile(os.path.join(output_directory_path, jpeg_entry['file']))
+
+    def record_jpeg(self, filename, source_path, source_stat=None):
+        """
+        record_jpeg(filename, source_path, source_stat)
+        record the JPEG file created for filename
+        """
+        self.refresh(filename, source_path, source_stat)['jpeg'] = \
+{'file': os.path.splitext(filename)[0] + "." + DEFAULT_JPEG_EXTENSION, 'annotate': settings.ANNOTATE_MODE}
+
+    def movie_settings(self, filenames):
+        """
+        movie_settings(filenames)
+        return what the movie file depends upon: the frames in order and the settings used to draw and encode them
+        """
+        return {'frames': [[filename, self.entries[filename]['sha1']] for filename in filenames], \
+'annotate': settings.ANNOTATE_MODE, 'framerate': settings.FRAMERATE_VAL, 'preview': settings.PREVIEW_VAL, \
+'previewstep': settings.PREVIEWSTEP_VAL, 'segments': settings.SEGMENTS_VAL, 'dedup': settings.DEDUP_VAL}
+
+    def movie_current(self, movie_file_path, filenames):
+        """
+        movie_current(movie_file_path, filenames)
+        return True if movie_file_path was created from the same frames with the same settings
+        """
+        if self.movie is None or self.movie['file'] != movie_file_path or not os.path.isfile(movie_file_path):
+            return False
+        movie_stat = os.stat(movie_file_path)
+        return self.movie['size'] == movie_stat.st_size and self.movie['mtime_ns'] == movie_stat.st_mtime_ns \
+and self.movie['settings'] == self.movie_settings(filenames)
+
+    def record_movie(self, movie_file_path, filenames):
+        """
+        record_movie(movie_file_path, filenames)
+        record the movie file created from filenames
+        """
+        movie_stat = os.stat(movie_file_path)
+        self.movie = {'file': movie_file_path, 'size': movie_stat.st_size, 'mtime_ns': movie_stat.st_mtime_ns, \
+'settings': self.movie_settings(filenames)}
+
+    def count(self, stage, reused):
+        """
+        count(stage, reused)
+        count one output of stage as reused or rebuilt
+        """
+        counter = self.reused if reused is True else self.rebuilt
+        counter[stage] = counter[stage] + 1
+
+    def report(self):
+        """
+        report()
+        display how many outputs each stage reused and rebuilt
+        """
+        for stage in ('metadata', 'jpeg', 'movie'):
+            if self.reused[stage] + self.rebuilt[stage] > 0:
+                log_message(MESSAGE_INFO, f"Incremental {stage}: {self.reused[stage]} reused, \
+{self.rebuilt[stage]} rebuilt")
+        if self.rebuilt['pruned'] > 0:
+            log_message(MESSAGE_INFO, f"Incremental: {self.rebuilt['pruned']} stale source files pruned")
+
+def reflink_file(source_path, destination_path):
+    """
+    reflink_file(source_path, destination_path)
+    create destination_path as a copy-on-write clone of source_path (Linux Btrfs, XFS ...)
+    raise OSError if the file system does not support it
+    """
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported", destination_path)
+    with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            destination_file.close()
+            os.remove(destination_path)
+            raise
+
+def backup_file(source_path, backup_path):
+    """
+    backup_file(source_path, backup_path)
+    keep the contents of source_path as backup_path using a hard link, else a reflink, else a copy
+    return the method used
+    """
+    try:
+        os.link(source_path, backup_path)
+        return "link"
+    except OSError as link_e:
+        log_message(MESSAGE_DEBUG, f"unable to hard link {backup_path}: {link_e}")
+    try:
+        reflink_file(source_path, backup_path)
+        return "reflink"
+    except OSError as reflink_e:
+        log_message(MESSAGE_DEBUG, f"unable to reflink {backup_path}: {reflink_e}")
+    shutil.copy2(source_path, backup_path)
+    return "copy"
+
+class RenameJournal:
+    """
+    RenameJournal(journal_path)
+    Record of the batches of renames made by --rename, written before a batch is applied,
+    so that --undorename can rename the files of the last batch back
+    """
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.batches = []
+
+    def load(self):
+        """
+        load()
+        read the journal file - a missing journal file starts an empty journal
+        """
+        try:
+            with open(self.journal_path, 'r', -1, 'utf-8') as journal_file:
+                journal_data = json.load(journal_file)
+        except FileNotFoundError:
+            log_message(MESSAGE_DEBUG, f"no rename journal {self.journal_path} (not an error)")
+            return
+        except (OSError, ValueError) as journal_e:
+            log_message(MESSAGE_ERROR, f"unreadable rename journal {self.journal_path}: {journal_e}")
+            sys.exit(ERR_RENAME_JOURNAL)  # Use a non-zero exit code to indicate an error
+        if journal_data.get('version') != RENAME_JOURNAL_VERSION:
+            log_message(MESSAGE_ERROR, f"rename journal {self.journal_path} is from another version")
+            sys.exit(ERR_RENAME_JOURNAL)  # Use a non-zero exit code to indicate an error
+        self.batches = journal_data.get('batches', [])
+
+    def save(self):
+        """
+        save()
+        write the journal file, replacing the previous one only once it has been written
+        """
+        journal_data = {'version': RENAME_JOURNAL_VERSION, 'batches': self.batches}
+        with open(self.journal_path + ".tmp", 'w', -1, 'utf-8') as journal_file:
+            json.dump(journal_data, journal_file, indent=1)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+
+class RenamePlan:
+    """
+    RenamePlan(input_directory_path, frame_index)
+    Rename PNG files to their modify dates in three steps: add() every file to compute the new names,
+    check() all the new names for collisions before any file is renamed, then apply() the whole batch
+    Each file is backed up in the bak directory next to it with a hard link (or a reflink or a copy)
+    and the batch is written to the rename journal first so that --undorename can reverse it
+    """
+
+    def __init__(self, input_directory_path, frame_index):
+        self.input_directory_path = input_directory_path
+        self.frame_index = frame_index
+        self.new_names = {}
+        self.modify_dates = {}
+        self.rename_order = []
+
+    def add(self, filename, modify_date):
+        """
+        add(filename, modify_date)
+        plan the rename of PNG file filename to its modify date (not renamed if modify_date is None)
+        """
+        if modify_date is None:
+            log_message(MESSAGE_DEBUG, \
+f"File {self.frame_index.path(filename)} does not have a date-based EXIF Tag to use - Not renaming")
+            return
+        # the file stays in its subdirectory of the input directory
+        self.new_names[filename] = os.path.join(os.path.dirname(filename), \
+modify_date.strftime("%y%m%d%H%M%S") + "." + DEFAULT_PNG_EXTENSION)
+        self.modify_dates[filename] = modify_date
+
+    def new_name(self, filename):
+        """
+        new_name(filename)
+        return the name of PNG file filename once the plan has been applied
+        """
+        return self.new_names.get(filename, filename)
+
+    def check(self):
+        """
+        check()
+        find every collision of the planned names and exit without renaming anything if there are any
+        otherwise work out an order of the renames in which no file is overwritten
+        """
+        # files already named after their modify date (e.g. --rename has been used before) are left as they are
+        pending = {filename: new_filename for filename, new_filename in self.new_names.items() \
+if new_filename != filename}
+        sources_by_name = collections.defaultdict(list)
+        for filename, new_filename in pending.items():
+            sources_by_name[new_filename].append(filename)
+
+        collisions = []
+        for new_filename, filenames in sorted(sources_by_name.items()):
+            if len(filenames) > 1:
+                collisions.append(f"{', '.join(sorted(filenames))} all have the modify date \
+{self.modify_dates[filenames[0]]} ({new_filename})")
+            elif new_filename not in pending and self.frame_index.exists(new_filename):
+                collisions.append(f"{filenames[0]} has the modify date {self.modify_dates[filenames[0]]} \
+but {new_filename} already exists")
+
+        # a file can be renamed once the file with its new name has been renamed
+        self.rename_order = []
+        while pending and not collisions:
+            ready = [filename for filename, new_filename in pending.items() if new_filename not in pending]
+            if not ready:
+                collisions.append(f"{', '.join(sorted(pending))} would be renamed to each other")
+                break
+            for filename in ready:
+                self.rename_order.append((filename, pending.pop(filename)))
+
+        if collisions:
+            for collision in collisions:
+                log_message(MESSAGE_ERROR, collision)
+            log_message(MESSAGE_ERROR, f"{len(collisions)} rename collisions found - no files have been renamed \
+- exiting")
+            sys.exit(ERR_RENAME_DUPLICATE)  # Use a non-zero exit code to indicate an error
+        return self.rename_order
+
+    def apply(self, journal):
+        """
+        apply(journal)
+        back up and rename the files in the order found by check(), recording the batch in RenameJournal journal
+        """
+        if not self.rename_order:
+            log_message(MESSAGE_INFO, "No PNG files need renaming")
+            return
+        journal.batches.append({'created': datetime.now().astimezone().isoformat(), \
+'renames': [[filename, new_filename] for filename, new_filename in self.rename_order]})
+        journal.save()
+
+        backup_methods = collections.Counter()
+        for filename, new_filename in self.rename_order:
+            backup_directory_path = os.path.join(self.input_directory_path, os.path.dirname(filename), \
+DEFAULT_BACKUP_DIR)
+            os.makedirs(backup_directory_path, exist_ok=True)
+            backup_path = os.path.join(backup_directory_path, os.path.basename(filename))
+            try:
+                os.remove(backup_path)
+                log_message(MESSAGE_DEBUG, f"existing backup file {backup_path} successfully deleted")
+            except OSError:
+                log_message(MESSAGE_DEBUG, f"backup file {backup_path} not found (not an error)")
+            backup_methods[backup_file(self.frame_index.path(filename), backup_path)] += 1
+            log_message(MESSAGE_DEBUG, f"backup file {backup_path} created")
+
+            os.rename(self.frame_index.path(filename), self.frame_index.path(new_filename))
+            self.frame_index.rename(filename, new_filename)
+            log_message(MESSAGE_DEBUG, f"file {self.frame_index.path(filename)} \
+renamed to {self.frame_index.path(new_filename)}")
+        log_message(MESSAGE_INFO, f"Renamed {len(self.rename_order)} PNG files (backups: \
+{', '.join(f'{count} {method}' for method, count in sorted(backup_methods.items()))})")
+
+def undo_renames(input_directory_path):
+    """
+    undo_renames(input_directory_path)
+    rename the files of the last --rename batch in the rename journal of input_directory_path back
+    """
+    journal = RenameJournal(os.path.join(input_directory_path, DEFAULT_RENAME_JOURNAL_FILENAME))
+    journal.load()
+    if not journal.batches:
+        log_message(MESSAGE_INFO, "No renames to undo")
+        return
+    batch = journal.batches[-1]
+    undone_count = 0
+    for filename, new_filename in reversed(batch['renames']):
+        file_path = os.path.join(input_directory_path, filename)
+        new_file_path = os.path.join(input_directory_path, new_filename)
+        # a batch that was interrupted has only been partly applied
+        if not os.path.exists(new_file_path):
+            log_message(MESSAGE_DEBUG, f"{new_file_path} not found - {filename} was not renamed (not an error)")
+            continue
+        if os.path.exists(file_path):
+            log_message(MESSAGE_WARN, f"{file_path} already exists - not renaming {new_filename} back")
+            continue
+        os.rename(new_file_path, file_path)
+        log_message(MESSAGE_DEBUG, f"file {new_file_path} renamed back to {file_path}")
+        undone_count = undone_count + 1
+    journal.batches.pop()
+    journal.save()
+    log_message(MESSAGE_INFO, f"Renamed {undone_count} PNG files back from the rename of {batch['created']}")
@@ -0,0 +1,622 @@
+"""
+RotoPy: the Stable Diffusion parameters of the frames - read from the PNG text chunks or with exiftool
+and kept in JSON files or the metadata index.
+"""
+
+import subprocess
+import json
+import os
+import sys
+import re
+import struct
+import zlib
+from datetime import datetime
+import rotopy_settings as settings
+from rotopy_common import ERR_NO_JSON_FOR_ANNOTATE, ERR_EXIFTOOL_FAILED, MESSAGE_ERROR, MESSAGE_WARN, MESSAGE_DEBUG, \
+log_message
+
+# exiftool command (see the pre-requisites in rotopy.py)
+EXIF_TOOL_CMD = "exiftool.exe" if os.name == "nt" else "exiftool"
+
+# Metadata backend - created by create_exif_backend() if None (e.g. set to a StaticExifBackend for testing)
+EXIF_BACKEND = None
+
+# PNG file signature and the chunks that hold text
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_CHUNK_TYPES = {b'tEXt', b'zTXt', b'iTXt'}
+
+def png_keyword_tag_name(png_keyword):
+    """
+    png_keyword_tag_name(png_keyword)
+    return the exiftool tag name for PNG text keyword png_keyword e.g. date:modify => Datemodify
+    """
+    tag_name = re.sub(r'[^A-Za-z0-9_-]', '', png_keyword)
+    return tag_name[:1].upper() + tag_name[1:]
+
+def png_text_chunk(chunk_type, chunk_data):
+    """
+    png_text_chunk(chunk_type, chunk_data)
+    return the (keyword, text) pair held in the data of a tEXt, zTXt or iTXt chunk
+    """
+    keyword, _separator, chunk_text = chunk_data.partition(b'\0')
+    keyword = keyword.decode('latin-1')
+    if chunk_type == b'tEXt':
+        return keyword, chunk_text.decode('latin-1')
+    if chunk_type == b'zTXt':
+        # first byte is the compression method (always zlib)
+        return keyword, zlib.decompress(chunk_text[1:]).decode('latin-1')
+    # iTXt: compression flag, compression method, language tag, translated keyword, UTF-8 text
+    compression_flag = chunk_text[0]
+    _language_tag, _separator, chunk_text = chunk_text[2:].partition(b'\0')
+    _translated_keyword, _separator, chunk_text = chunk_text.partition(b'\0')
+    if compression_flag == 1:
+        chunk_text = zlib.decompress(chunk_text)
+    return keyword, chunk_text.decode('utf-8')
+
+def read_png_text_chunks(png_file_path):
+    """
+    read_png_text_chunks(png_file_path)
+    return the (width, height) from the IHDR chunk of a PNG file and a dict of its tEXt, zTXt
+    and iTXt chunks keyed by keyword
+    Only the chunk headers are read - reading stops at the first IDAT chunk so pixel data is never read
+    """
+    png_size = None
+    png_text = {}
+    with open(png_file_path, 'rb') as png_file:
+        if png_file.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            log_message(MESSAGE_WARN, f"{png_file_path} is not a PNG file")
+            return png_size, png_text
+        while True:
+            chunk_header = png_file.read(8)
+            if len(chunk_header) < 8:
+                log_message(MESSAGE_WARN, f"{png_file_path} is truncated")
+                break
+            chunk_length, chunk_type = struct.unpack('>I4s', chunk_header)
+            if chunk_type in (b'IDAT', b'IEND'):
+                break
+            if chunk_type == b'IHDR' and chunk_length >= 8:
+                png_size = struct.unpack('>II', png_file.read(8))
+                # skip the rest of the data and CRC
+                png_file.seek(chunk_length - 8 + 4, os.SEEK_CUR)
+            elif chunk_type in PNG_TEXT_CHUNK_TYPES:
+                try:
+                    keyword, chunk_text = png_text_chunk(chunk_type, png_file.read(chunk_length))
+                    png_text[keyword] = chunk_text
+                except (IndexError, UnicodeDecodeError, zlib.error) as png_e:
+                    log_message(MESSAGE_WARN, f"ignoring invalid {chunk_type.decode('latin-1')} chunk \
+in {png_file_path}: {png_e}")
+                # skip CRC
+                png_file.seek(4, os.SEEK_CUR)
+            else:
+                # skip data and CRC
+                png_file.seek(chunk_length + 4, os.SEEK_CUR)
+    return png_size, png_text
+
+def get_png_tags(png_file_path, exif_tags):
+    """
+    get_png_tags(png_file_path, exif_tags)
+    return the tags defined in str list exif_tags without using exiftool
+    The dict has the same shape as an entry of the exiftool -json output
+    """
+    tag_names = {exif_tag.lstrip('-') for exif_tag in exif_tags}
+    png_tags = {}
+    if 'SourceFile' in tag_names:
+        png_tags['SourceFile'] = png_file_path
+    png_size, png_text = read_png_text_chunks(png_file_path)
+    for keyword, chunk_text in png_text.items():
+        tag_name = png_keyword_tag_name(keyword)
+        if tag_name in tag_names:
+            png_tags[tag_name] = chunk_text
+    if png_size is not None:
+        if 'ImageWidth' in tag_names:
+            png_tags['ImageWidth'] = png_size[0]
+        if 'ImageHeight' in tag_names:
+            png_tags['ImageHeight'] = png_size[1]
+    if 'FileModifyDate' in tag_names:
+        # exiftool format e.g. 2023:10:01 12:00:00+01:00
+        file_modify_date = datetime.fromtimestamp(os.stat(png_file_path).st_mtime).astimezone()
+        utc_offset = file_modify_date.strftime("%z")
+        png_tags['FileModifyDate'] = file_modify_date.strftime("%Y:%m:%d %H:%M:%S") + \
+utc_offset[:3] + ":" + utc_offset[3:]
+    return png_tags
+
+def exif_tags_by_path(exif_file_paths, exif_data_json):
+    """
+    exif_tags_by_path(exif_file_paths, exif_data_json)
+    return a dict mapping each path in exif_file_paths to its entry in the exiftool -json
+    output exif_data_json - files missing from the output map to an empty dict
+    """
+    exif_entries = json.loads(exif_data_json) if exif_data_json.strip() != "" else []
+    # exiftool may report SourceFile with different separators to the ones it was given
+    entries_by_path = {os.path.normcase(os.path.normpath(exif_entry.get('SourceFile', ''))): exif_entry \
+for exif_entry in exif_entries}
+    return {exif_file_path: entries_by_path.get(os.path.normcase(os.path.normpath(exif_file_path)), {}) \
+for exif_file_path in exif_file_paths}
+
+class ExifToolBackend:
+    """
+    ExifToolBackend(exif_tool_cmd)
+    Read EXIF tags through one exiftool process started in -stay_open mode rather than
+    starting exiftool (and its Perl interpreter) once per file.
+    Use as a context manager so that the exiftool process is shut down afterwards.
+    """
+
+    def __init__(self, exif_tool_cmd=None):
+        self.exif_tool_cmd = exif_tool_cmd if exif_tool_cmd is not None else EXIF_TOOL_CMD
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def start(self):
+        """
+        start()
+        start exiftool reading its arguments from stdin
+        """
+        if self.process is not None:
+            return
+        exiftool_cmd = [self.exif_tool_cmd, "-stay_open", "True", "-@", "-"]
+        log_message(MESSAGE_DEBUG, f"Starting {exiftool_cmd}")
+        try:
+            self.process = subprocess.Popen(exiftool_cmd, stdin=subprocess.PIPE, \
+stdout=subprocess.PIPE, encoding='utf-8')  # pylint: disable=consider-using-with
+        except OSError as exif_e:
+            log_message(MESSAGE_ERROR, f"unable to start {self.exif_tool_cmd}: {exif_e}")
+            sys.exit(ERR_EXIFTOOL_FAILED)  # Use a non-zero exit code to indicate an error
+
+    def close(self):
+        """
+        close()
+        ask exiftool to exit and wait for it
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write("-stay_open\nFalse\n")
+            self.process.communicate()
+        except OSError:
+            log_message(MESSAGE_DEBUG, "exiftool has already exited")
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def read_tags(self, exif_file_paths, exif_tags):
+        """
+        read_tags(exif_file_paths, exif_tags)
+        return a dict mapping each path in exif_file_paths to the EXIF tags defined in str list exif_tags
+        """
+        self.start()
+        exif_args = ["-json", "-charset", "filename=utf8"] + exif_tags + list(exif_file_paths) + ["-execute"]
+        try:
+            self.process.stdin.write("\n".join(exif_args) + "\n")
+            self.process.stdin.flush()
+        except OSError as exif_e:
+            log_message(MESSAGE_ERROR, f"unable to send arguments to exiftool: {exif_e}")
+            sys.exit(ERR_EXIFTOOL_FAILED)  # Use a non-zero exit code to indicate an error
+
+        # exiftool writes {ready} once it has finished with the command
+        exif_lines = []
+        while True:
+            exif_line = self.process.stdout.readline()
+            if exif_line == "":
+                log_message(MESSAGE_ERROR, f"exiftool exited unexpectedly with status {self.process.poll()}")
+                sys.exit(ERR_EXIFTOOL_FAILED)  # Use a non-zero exit code to indicate an error
+            if exif_line.rstrip() == "{ready}":
+                break
+            exif_lines.append(exif_line)
+        return exif_tags_by_path(exif_file_paths, "".join(exif_lines))
+
+class StaticExifBackend:
+    """
+    StaticExifBackend(tags_by_filename)
+    Test double for ExifToolBackend that returns canned EXIF tags from dict tags_by_filename
+    (keyed by file name without directory) instead of running exiftool.
+    Each call to read_tags() is recorded in read_calls.
+    """
+
+    def __init__(self, tags_by_filename=None):
+        self.tags_by_filename = tags_by_filename if tags_by_filename is not None else {}
+        self.read_calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        """
+        close()
+        nothing to shut down
+        """
+
+    def read_tags(self, exif_file_paths, exif_tags):
+        """
+        read_tags(exif_file_paths, exif_tags)
+        return a dict mapping each path in exif_file_paths to its canned EXIF tags
+        """
+        self.read_calls.append((list(exif_file_paths), list(exif_tags)))
+        exif_tags_read = {}
+        for exif_file_path in exif_file_paths:
+            png_tags = dict(self.tags_by_filename.get(os.path.basename(exif_file_path), {}))
+            png_tags.setdefault('SourceFile', exif_file_path)
+            exif_tags_read[exif_file_path] = png_tags
+        return exif_tags_read
+
+class PngChunkBackend:
+    """
+    PngChunkBackend()
+    Read tags directly from the PNG text chunks (see get_png_tags()) so exiftool is not needed
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        """
+        close()
+        nothing to shut down
+        """
+
+    def read_tags(self, exif_file_paths, exif_tags):
+        """
+        read_tags(exif_file_paths, exif_tags)
+        return a dict mapping each path in exif_file_paths to the tags defined in str list exif_tags
+        """
+        return {exif_file_path: get_png_tags(exif_file_path, exif_tags) for exif_file_path in exif_file_paths}
+
+def create_exif_backend():
+    """
+    create_exif_backend()
+    return EXIF_BACKEND if set, otherwise an ExifToolBackend if --exiftool is used or a PngChunkBackend
+    """
+    if EXIF_BACKEND is not None:
+        return EXIF_BACKEND
+    if settings.EXIFTOOL_MODE is True:
+        return ExifToolBackend()
+    return PngChunkBackend()
+
+def sd_size_value(sd_value):
+    """
+    sd_size_value(sd_value)
+    return the [width, height] of a Stable Diffusion size such as 512x768
+    """
+    sd_width, _separator, sd_height = sd_value.partition('x')
+    return [int(sd_width), int(sd_height)]
+
+def sd_lora_hashes_value(sd_value):
+    """
+    sd_lora_hashes_value(sd_value)
+    return the dict of LoRA name to hash of a Lora hashes value such as "name1: hash1, name2: hash2"
+    """
+    sd_lora_hashes = {}
+    for sd_lora_hash in sd_value.split(','):
+        sd_lora_name, _separator, sd_hash = sd_lora_hash.rpartition(':')
+        if sd_lora_name.strip() != "":
+            sd_lora_hashes[sd_lora_name.strip()] = sd_hash.strip()
+    return sd_lora_hashes
+
+# Types of the Stable Diffusion parameters - the others are kept as text
+SD_PARAMETER_TYPES = {
+    "Steps": int,
+    "Seed": int,
+    "Subseed": int,
+    "CFG scale": float,
+    "Denoising strength": float,
+    "Subseed strength": float,
+    "Clip skip": int,
+    "ENSD": int,
+    "Eta": float,
+    "Size": sd_size_value,
+    "Hires upscale": float,
+    "Hires steps": int,
+    "Hires resize": sd_size_value,
+    "Lora hashes": sd_lora_hashes_value
+}
+
+# One "key: value" field of a settings line with quoted values (which may hold commas and colons)
+# and the <lora:name:weight> tags of a prompt
+SD_FIELD_PATTERN = re.compile(r'\s*([^:,"]+):\s*("(?:\\.|[^\\"])*"|[^,]*),?')
+
+SD_LORA_PATTERN = re.compile(r'<lora:([^:>]+)(?::(-?\d+(?:\.\d*)?))?[^>]*>')
+
+SD_NEGATIVE_PROMPT_PREFIX = "Negative prompt:"
+
+# Fields of every A1111 settings line - the last line is only the settings line if it has at least
+# SD_SETTINGS_KEY_COUNT of them, so that a prompt with weights such as "(best quality:1.2)" is not taken for it
+SD_SETTINGS_KEYS = {"Steps", "Sampler", "CFG scale", "Seed"}
+
+SD_SETTINGS_KEY_COUNT = 2
+
+# fast paths for settings lines without quotes or escapes before the general pattern
+# pylint: disable-next=too-many-branches
+def sd_settings_fields(sd_settings_line):
+    """
+    sd_settings_fields(sd_settings_line)
+    return the dict of the fields of an A1111 settings line such as "Steps: 20, Sampler: Euler a, ..."
+    with any quoted values unquoted
+    """
+    if '"' not in sd_settings_line:
+        # without quoted values every ", " separates two fields
+        try:
+            return dict(sd_field.split(": ", 1) for sd_field in sd_settings_line.split(", "))
+        except ValueError:
+            log_message(MESSAGE_DEBUG, "settings line with a field that is not \"key: value\"")
+    elif '\\' not in sd_settings_line:
+        # the pieces between the quotes are fields separated by ", " and the quoted pieces are values
+        sd_fields = {}
+        sd_line_pieces = sd_settings_line.split('"')
+        sd_key = None
+        for sd_piece_number in range(0, len(sd_line_pieces), 2):
+            for sd_field in sd_line_pieces[sd_piece_number].split(", "):
+                if sd_field == "":
+                    continue
+                sd_key, sd_separator, sd_value = sd_field.partition(": ")
+                if sd_separator == "":
+                    sd_key, sd_separator, sd_value = sd_field.partition(":")
+                    if sd_separator == "":
+                        sd_fields = None
+                        break
+                sd_fields[sd_key.strip()] = sd_value
+            if sd_fields is None or sd_piece_number + 1 >= len(sd_line_pieces):
+                break
+            if sd_key is None:
+                sd_fields = None
+                break
+            sd_fields[sd_key.strip()] = sd_line_pieces[sd_piece_number + 1]
+            sd_key = None
+        if sd_fields is not None:
+            return sd_fields
+        log_message(MESSAGE_DEBUG, "settings line with a field that is not \"key: value\"")
+
+    sd_fields = {}
+    for sd_key, sd_value in SD_FIELD_PATTERN.findall(sd_settings_line):
+        if sd_value[:1] == '"':
+            try:
+                sd_value = json.loads(sd_value)
+            except ValueError:
+                sd_value = sd_value[1:-1]
+        else:
+            sd_value = sd_value.strip()
+        sd_fields[sd_key.strip()] = sd_value
+    return sd_fields
+
+def sd_extract_parameters(sd_parameters_text):
+    """
+    sd_extract_parameters(sd_parameters_text)
+    return the dict of the A1111 (or ComfyUI in A1111 format) parameters text sd_parameters_text:
+    the prompt, the negative prompt and every field of the settings line
+    (Steps, Sampler, CFG scale, Seed, Size, Model hash, Model, Denoising strength, Hires ..., Lora hashes ...)
+    converted to the types in SD_PARAMETER_TYPES, and the LoRAs of the prompt with their weights and hashes
+    The settings line is read in a single pass, so prompts may contain commas and colons and
+    quoted values may contain commas, colons and escaped quotes
+    """
+    sd_parameters_text = sd_parameters_text.strip()
+
+    # the settings line is the last line if it has the fields of a settings line (a text may have no settings line)
+    sd_settings_start = sd_parameters_text.rfind('\n') + 1
+    sd_fields = {}
+    if not sd_parameters_text.startswith(SD_NEGATIVE_PROMPT_PREFIX, sd_settings_start):
+        sd_fields = sd_settings_fields(sd_parameters_text[sd_settings_start:])
+    if len(SD_SETTINGS_KEYS & sd_fields.keys()) >= SD_SETTINGS_KEY_COUNT:
+        sd_prompt_text = sd_parameters_text[:sd_settings_start]
+    else:
+        sd_fields = {}
+        sd_prompt_text = sd_parameters_text
+
+    # the prompt lines come before the negative prompt lines
+    if sd_prompt_text.startswith(SD_NEGATIVE_PROMPT_PREFIX):
+        sd_negative_prompt_start = 0
+    else:
+        sd_negative_prompt_start = sd_prompt_text.find('\n' + SD_NEGATIVE_PROMPT_PREFIX) + 1
+    if sd_negative_prompt_start > 0 or sd_prompt_text.startswith(SD_NEGATIVE_PROMPT_PREFIX):
+        sd_extracted_parameters = {"Prompt": sd_prompt_text[:sd_negative_prompt_start].strip(), \
+"Negative prompt": sd_prompt_text[sd_negative_prompt_start + len(SD_NEGATIVE_PROMPT_PREFIX):].strip()}
+    else:
+        sd_extracted_parameters = {"Prompt": sd_prompt_text.strip()}
+
+    # only the typed fields are converted - the others are kept as text
+    sd_extracted_parameters.update(sd_fields)
+    for sd_key in SD_PARAMETER_TYPES.keys() & sd_fields.keys():
+        try:
+            sd_extracted_parameters[sd_key] = SD_PARAMETER_TYPES[sd_key](sd_fields[sd_key])
+        except ValueError:
+            log_message(MESSAGE_DEBUG, f"unexpected {sd_key} value {sd_fields[sd_key]} kept as text")
+
+    if "<lora:" in sd_extracted_parameters["Prompt"]:
+        sd_lora_hashes = sd_extracted_parameters.get("Lora hashes")
+        if not isinstance(sd_lora_hashes, dict):
+            sd_lora_hashes = {}
+        sd_extracted_parameters["Lora"] = [{"name": sd_lora_name, \
+"weight": float(sd_lora_weight) if sd_lora_weight != "" else 1.0, "hash": sd_lora_hashes.get(sd_lora_name)} \
+for sd_lora_name, sd_lora_weight in SD_LORA_PATTERN.findall(sd_extracted_parameters["Prompt"])]
+    return sd_extracted_parameters
+
+def write_json_file(filename, extracted_parameters, output_directory_path):
+    """
+    write_json_file(filename, extracted_parameters, output_directory_path)
+    Write the extracted parameters for PNG file filename to a JSON file in output_directory_path
+    """
+    # Write Parameters to a text file with the same filename but with .json extension
+    output_json_filename = os.path.splitext(filename)[0] + ".json"
+    # frames in subdirectories of the input directory have their files in the same subdirectories
+    if os.path.dirname(output_json_filename) != "":
+        os.makedirs(os.path.join(output_directory_path, os.path.dirname(output_json_filename)), exist_ok=True)
+    with open(os.path.join(output_directory_path, output_json_filename), \
+"w", -1, 'utf-8') as json_file:
+        json.dump(extracted_parameters, json_file, indent=4)
+        log_message(MESSAGE_DEBUG, f"The Parameters have been written to: \
+{os.path.join(output_directory_path, output_json_filename)}")
+
+def save_metadata_record(metadata_record, output_directory_path, metadata_index=None):
+    """
+    save_metadata_record(metadata_record, output_directory_path, metadata_index)
+    Add the metadata record of a PNG file - a dict of file (name), parameters (extracted parameters),
+    modify_date, width and height - to metadata_index if set, otherwise write its JSON file
+    """
+    if metadata_index is not None:
+        metadata_index.add(metadata_record)
+    else:
+        write_json_file(metadata_record['file'], metadata_record['parameters'], output_directory_path)
+
+class MetadataIndex:
+    """
+    MetadataIndex(index_path)
+    In-memory metadata records of all the PNG files, saved as a single JSON Lines file
+    (one record per line) instead of one JSON file per PNG file when --metadataindex is used
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.records = {}
+
+    def add(self, metadata_record):
+        """
+        add(metadata_record)
+        add or replace the metadata record of a PNG file
+        """
+        self.records[metadata_record['file']] = metadata_record
+
+    def get(self, png_file):
+        """
+        get(png_file)
+        return the metadata record of PNG file png_file or None
+        """
+        return self.records.get(png_file)
+
+    def load(self):
+        """
+        load()
+        read the index file - a missing index file leaves the index empty
+        """
+        try:
+            with open(self.index_path, 'r', -1, 'utf-8') as index_file:
+                for index_line in index_file:
+                    if index_line.strip() != "":
+                        self.add(json.loads(index_line))
+        except FileNotFoundError:
+            log_message(MESSAGE_DEBUG, f"no metadata index file {self.index_path}")
+        log_message(MESSAGE_DEBUG, f"{len(self.records)} records read from {self.index_path}")
+
+    def save(self):
+        """
+        save()
+        write the index file in file name order
+        """
+        with open(self.index_path + ".tmp", 'w', -1, 'utf-8') as index_file:
+            for png_file in sorted(self.records):
+                index_file.write(json.dumps(self.records[png_file]) + "\n")
+        os.replace(self.index_path + ".tmp", self.index_path)
+        log_message(MESSAGE_DEBUG, f"{len(self.records)} records written to {self.index_path}")
+
+    def export_json_files(self, output_directory_path):
+        """
+        export_json_files(output_directory_path)
+        write the JSON file of every PNG file for compatibility with earlier versions
+        """
+        for metadata_record in self.records.values():
+            write_json_file(metadata_record['file'], metadata_record['parameters'], output_directory_path)
+
+def png_modify_date(png_tags):
+    """
+    png_modify_date(png_tags)
+    return the modify date (datetime) from the EXIF tags in dict png_tags, or None if there is none
+    """
+    # if the file has been modified by another application
+    modifydate_str = png_tags.get('Datemodify')
+    modify_date = None
+    if modifydate_str is not None:
+        log_message(MESSAGE_DEBUG, "datemodify found - using modify date")
+        modify_date = datetime.strptime(modifydate_str, "%Y-%m-%dT%H:%M:%S%z")
+    else:
+        log_message(MESSAGE_DEBUG, "datemodify is empty - falling back on File Modify Date")
+        modifydate_str = png_tags.get('FileModifyDate')
+        if modifydate_str is not None:
+            modify_date = datetime.strptime(modifydate_str, "%Y:%m:%d %H:%M:%S%z")
+    return modify_date
+
+def create_json_file(filename, png_tags, output_directory_path, metadata_index=None, new_filename=None):
+    """
+    create_json_file(filename, png_tags, output_directory_path, metadata_index, new_filename)
+    Write the Stable Diffusion parameters of PNG file filename taken from the EXIF tags in dict png_tags
+    to a JSON file in output_directory_path (or add them to metadata_index if set)
+    new_filename is the name of the file once it has been renamed by a RenamePlan
+    return the metadata record (see save_metadata_record())
+    """
+    log_message(MESSAGE_DEBUG, f"EXIF tags read from file: {png_tags}")
+    source_file = png_tags.get('SourceFile')
+    modify_date = png_modify_date(png_tags)
+    parameters = png_tags.get('Parameters')
+
+    log_message(MESSAGE_DEBUG, "EXIF extract")
+    log_message(MESSAGE_DEBUG, f"SourceFile = {source_file}")
+    log_message(MESSAGE_DEBUG, f"Modify Date = {modify_date}")
+    log_message(MESSAGE_DEBUG, f"parameters = {parameters}")
+
+    if source_file is None:
+        log_message(MESSAGE_DEBUG, f"Missing EXIF tag SourceFile using filename {filename}")
+        source_file = filename
+
+    if new_filename is None:
+        new_filename = filename
+
+    # Extract the parameters from the text
+    if parameters is not None:
+        extracted_parameters = sd_extract_parameters(parameters)
+        log_message(MESSAGE_DEBUG, "The extracted parameters are:")
+        log_message(MESSAGE_DEBUG, f"{extracted_parameters}")
+    else:
+        log_message(MESSAGE_DEBUG, \
+f"file {filename} does not have a Parameters EXIF Tag \
+- Using default values")
+        extracted_parameters = 'None'
+
+    metadata_record = {'file': new_filename, 'parameters': extracted_parameters, \
+'modify_date': modify_date.isoformat() if modify_date is not None else None, \
+'width': png_tags.get('ImageWidth'), 'height': png_tags.get('ImageHeight')}
+    save_metadata_record(metadata_record, output_directory_path, metadata_index)
+    return metadata_record
+
+def load_frame_parameters(png_file, output_directory_path, metadata_index=None):
+    """
+    load_frame_parameters(png_file, output_directory_path, metadata_index)
+    return the extracted parameters of PNG file png_file from metadata_index if set,
+    otherwise from its JSON file in output_directory_path
+    """
+    if metadata_index is not None:
+        metadata_record = metadata_index.get(png_file)
+        if metadata_record is None:
+            log_message(MESSAGE_ERROR, f"{png_file} not found in metadata index {metadata_index.index_path}. \
+Perhaps --skipjson has been used without --keepjson previously - exiting program")
+            sys.exit(ERR_NO_JSON_FOR_ANNOTATE)  # Use a non-zero exit code to indicate an error
+        return metadata_record['parameters']
+
+    json_file = os.path.join(output_directory_path, f"{os.path.splitext(png_file)[0]}.json")
+    if not os.path.exists(json_file):
+        log_message(MESSAGE_ERROR, f"Error: JSON file {json_file} not found. \
+Perhaps --skipjson has been used without JSON file creation - exiting program")
+        sys.exit(ERR_NO_JSON_FOR_ANNOTATE)  # Use a non-zero exit code to indicate an error
+    with open(json_file, 'r', -1, 'utf-8') as f:
+        return json.load(f)
+
+def remove_json_files(output_directory_path, frame_files):
+    """
+    remove_json_files(output_directory_path, frame_files)
+    delete the JSON files in output_directory_path and its subdirectories of the frame files frame_files
+    """
+    json_directories = {os.path.dirname(frame_file) for frame_file in frame_files} | {""}
+    for json_directory in sorted(json_directories):
+        json_directory_path = os.path.join(output_directory_path, json_directory)
+        if not os.path.isdir(json_directory_path):
+            continue
+        for json_file in sorted(os.listdir(json_directory_path)):
+            if json_file.endswith(".json"):
+                log_message(MESSAGE_DEBUG, f"Deleting file {os.path.join(json_directory_path, json_file)}")
+                os.remove(os.path.join(json_directory_path, json_file))
@@ -0,0 +1,67 @@
+"""
+RotoPy: the settings of the current run (the input arguments), set by RotopyConfig.apply().
+"""
+
+# Input arguments
+VERBOSE_MODE = False
+INPUT_DIR = ""
+OUTPUT_DIR = ""
+RENAME_MODE = False
+SKIPJSON_MODE = False
+KEEPJSON_MODE = False
+ANNOTATE_MODE = False
+MOVIE_FILE = ""
+FRAMERATE_VAL = 0
+OVERWRITE_MOVIE_MODE = False
+SKIPMOVIE_MODE =False
+EXIFTOOL_MODE = False
+JOBS_VAL = 1
+KEEPJPEG_MODE = False
+INCREMENTAL_MODE = False
+METADATAINDEX_MODE = False
+EXPORTJSON_MODE = False
+INFLIGHT_VAL = None
+PROFILE_MODE = False
+STATSJSON_FILE = None
+PREVIEW_VAL = None
+PREVIEWSTEP_VAL = 1
+SEGMENTS_VAL = 1
+RECURSIVE_MODE = False
+FILESFROM_FILE = None
+UNDORENAME_MODE = False
+WATCH_VAL = None
+OUTPUTS_VAL = None
+DEDUP_VAL = None
+
+# The input argument set by each RotopyConfig setting (named as the command line options)
+CONFIG_SETTINGS = {
+    'verbose': 'VERBOSE_MODE',
+    'input_dir': 'INPUT_DIR',
+    'output_dir': 'OUTPUT_DIR',
+    'rename': 'RENAME_MODE',
+    'skipjson': 'SKIPJSON_MODE',
+    'keepjson': 'KEEPJSON_MODE',
+    'annotate': 'ANNOTATE_MODE',
+    'moviefile': 'MOVIE_FILE',
+    'framerate': 'FRAMERATE_VAL',
+    'overwritemovie': 'OVERWRITE_MOVIE_MODE',
+    'skipmovie': 'SKIPMOVIE_MODE',
+    'exiftool': 'EXIFTOOL_MODE',
+    'jobs': 'JOBS_VAL',
+    'keepjpeg': 'KEEPJPEG_MODE',
+    'incremental': 'INCREMENTAL_MODE',
+    'metadataindex': 'METADATAINDEX_MODE',
+    'exportjson': 'EXPORTJSON_MODE',
+    'inflight': 'INFLIGHT_VAL',
+    'profile': 'PROFILE_MODE',
+    'statsjson': 'STATSJSON_FILE',
+    'preview': 'PREVIEW_VAL',
+    'previewstep': 'PREVIEWSTEP_VAL',
+    'segments': 'SEGMENTS_VAL',
+    'recursive': 'RECURSIVE_MODE',
+    'filesfrom': 'FILESFROM_FILE',
+    'undorename': 'UNDORENAME_MODE',
+    'watch': 'WATCH_VAL',
+    'outputs': 'OUTPUTS_VAL',
+    'dedup': 'DEDUP_VAL'
+}
@@ -0,0 +1,970 @@
+"""
+RotoPy: the frame writers that stream frames into ffmpeg, and the paths of the movie file and --outputs targets.
+"""
+
+import subprocess
+import os
+import errno
+import sys
+import math
+import struct
+from fractions import Fraction
+import numpy as np
+import cv2
+import rotopy_settings as settings
+from rotopy_common import DEFAULT_MOVIE_FILENAME, DEFAULT_FRAMERATE, PREVIEW_MOVIE_SUFFIX, \
+ERR_INVALID_MOVIE_EXT, ERR_USUPPORTED_MOVIE_EXT, ERR_USER_EXIT, ERR_FRAME_SIZE_MISMATCH, ERR_FFMPEG_FAILED, \
+ERR_INVALID_OUTPUT, ERR_INVALID_FRAME, MESSAGE_ERROR, MESSAGE_INFO, MESSAGE_WARN, MESSAGE_DEBUG, log_message, RotopyError
+
+# ffmpeg command (see the pre-requisites in rotopy.py)
+FFMPEG_CMD = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
+
+# --segments file name suffixes of the segment movie files and of the concat demuxer list
+SEGMENT_FILE_SUFFIX = "_segment"
+SEGMENT_LIST_SUFFIX = "_segments.ffconcat"
+
+# --outputs targets: movie files, animations (without the even size padding of yuv420p) and contact sheet images
+MOVIE_EXTENSIONS = {'.mkv', '.mp4', '.flv', '.avi'}
+ANIMATION_EXTENSIONS = {'.gif', '.webp'}
+CONTACT_SHEET_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+OUTPUT_TARGET_SETTINGS = {'framerate': int, 'scale': float, 'columns': int}
+DEFAULT_CONTACT_SHEET_SCALE = 0.25
+# a contact sheet of more frames shows an even sample of them, which keeps its memory and size flat
+CONTACT_SHEET_MAX_THUMBNAILS = 144
+
+# --dedup streams the frames into ffmpeg as uncompressed BGR frames in Matroska, so that each frame has its own
+# timestamp and duration: the IDs of the Matroska elements written, the timestamp unit in nanoseconds (a microsecond)
+# and the size of the Segment, which is unknown until the stream ends
+MATROSKA_IDS = {'EBML': b'\x1a\x45\xdf\xa3', 'EBMLVersion': b'\x42\x86', 'EBMLReadVersion': b'\x42\xf7', \
+'EBMLMaxIDLength': b'\x42\xf2', 'EBMLMaxSizeLength': b'\x42\xf3', 'DocType': b'\x42\x82', \
+'DocTypeVersion': b'\x42\x87', 'DocTypeReadVersion': b'\x42\x85', 'Segment': b'\x18\x53\x80\x67', \
+'Info': b'\x15\x49\xa9\x66', 'TimestampScale': b'\x2a\xd7\xb1', 'MuxingApp': b'\x4d\x80', 'WritingApp': b'\x57\x41', \
+'Tracks': b'\x16\x54\xae\x6b', 'TrackEntry': b'\xae', 'TrackNumber': b'\xd7', 'TrackUID': b'\x73\xc5', \
+'TrackType': b'\x83', 'CodecID': b'\x86', 'Video': b'\xe0', 'PixelWidth': b'\xb0', 'PixelHeight': b'\xba', \
+'ColourSpace': b'\x2e\xb5\x24', 'Cluster': b'\x1f\x43\xb6\x75', 'Timestamp': b'\xe7', 'BlockGroup': b'\xa0', \
+'Block': b'\xa1', 'BlockDuration': b'\x9b'}
+MATROSKA_TIMESTAMP_SCALE = 1000
+MATROSKA_UNKNOWN_SIZE = b'\x01\xff\xff\xff\xff\xff\xff\xff'
+
+# JPEG input file extensions, the markers that start a frame header and the copy block size
+# for JPEG files passed through to ffmpeg without decoding
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+JPEG_COPY_BLOCK_SIZE = 1024 * 1024
+
+def check_frame(image, frame_number):
+    """
+    check_frame(image, frame_number)
+    raise a RotopyError if image (frame frame_number) is not a BGR image: a height x width x 3 array of uint8
+    """
+    if not isinstance(image, np.ndarray) or image.dtype != np.uint8 or image.ndim != 3 or image.shape[2] != 3:
+        image_description = f"a {image.dtype} array of shape {image.shape}" if isinstance(image, np.ndarray) \
+else f"a {type(image).__name__}"
+        raise RotopyError(f"frame {frame_number} is {image_description} - all images must be BGR images \
+(height x width x 3 arrays of uint8)", ERR_INVALID_FRAME)
+
+# the ffmpeg process and the frames sent to it
+# pylint: disable-next=too-many-instance-attributes
+class FfmpegFrameWriter:
+    """
+    FfmpegFrameWriter(movie_file_path, framerate, output_args, scale)
+    Stream BGR frames as rawvideo into the stdin of an ffmpeg process that encodes movie_file_path
+    framerate may be a fraction e.g. 25/4 and output_args are extra ffmpeg encoding options
+    scale resizes the frames (e.g. 0.5) in ffmpeg and a .gif or .webp movie_file_path is a looping animation
+    ffmpeg is started when the first frame arrives because the frame size is needed
+    Use as a context manager so that ffmpeg finishes the movie file afterwards
+    """
+
+    def __init__(self, movie_file_path, framerate=None, output_args=None, scale=None):
+        self.movie_file_path = movie_file_path
+        self.framerate = framerate
+        self.output_args = output_args if output_args is not None else []
+        self.scale = scale
+        self.input_file = "-"
+        self.process = None
+        self.last_image = None
+        self.frame_size = None
+        self.frame_count = 0
+        self.returncode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        # a failure part of the way through must not leave a truncated movie file behind
+        self.close(abort=exc_type is not None)
+
+    def input_args(self, width, height):
+        """
+        input_args(width, height)
+        return the ffmpeg options describing the width x height BGR frames on stdin
+        """
+        return ["-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}"]
+
+    def ffmpeg_command(self, width, height):
+        """
+        ffmpeg_command(width, height)
+        return the ffmpeg command reading width x height frames from stdin
+        """
+        # Appropriate level of logging based upon verbose_mode
+        if settings.VERBOSE_MODE is True:
+            log_level = 'debug'
+        else:
+            log_level = 'panic'
+
+        ffmpeg_cmd = [FFMPEG_CMD, "-loglevel", log_level, "-y"] + self.input_args(width, height)
+        if self.framerate is not None:
+            ffmpeg_cmd += ["-framerate", str(self.framerate)]
+        # no audio stream
+        ffmpeg_cmd += ["-i", self.input_file, "-an"] + self.video_args() + self.output_args + [self.movie_file_path]
+        return ffmpeg_cmd
+
+    def video_args(self):
+        """
+        video_args()
+        return the ffmpeg options for the video filters and pixel format of movie_file_path
+        """
+        video_filters = []
+        if self.scale is not None:
+            video_filters.append(f"scale=iw*{self.scale}:ih*{self.scale}")
+        movie_file_extension = os.path.splitext(self.movie_file_path)[1].lower()
+        if movie_file_extension == '.gif':
+            # a palette for each frame, so no frame has to be held back until the palette of the movie is known
+            video_filters.append("split[frames][palette_frames];[palette_frames]palettegen=stats_mode=single[palette];\
+[frames][palette]paletteuse=new=1")
+            return ["-vf", ",".join(video_filters), "-loop", "0"]
+        # yuv420p (which needs even dimensions) is the pixel format most players support
+        video_filters.append("pad=ceil(iw/2)*2:ceil(ih/2)*2")
+        video_args = ["-vf", ",".join(video_filters), "-pix_fmt", "yuv420p"]
+        if movie_file_extension in ANIMATION_EXTENSIONS:
+            video_args += ["-loop", "0"]
+        return video_args
+
+    def start(self, width, height):
+        """
+        start(width, height)
+        start ffmpeg for frames of width x height
+        """
+        ffmpeg_cmd = self.ffmpeg_command(width, height)
+        log_message(MESSAGE_INFO, f"About to run '{subprocess.list2cmdline(ffmpeg_cmd)}'")
+        try:
+            self.process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE)  # pylint: disable=consider-using-with
+        except OSError as ffmpeg_e:
+            raise RotopyError(f"unable to start {FFMPEG_CMD}: {ffmpeg_e}", ERR_FFMPEG_FAILED) from ffmpeg_e
+        self.frame_size = (width, height)
+
+    def check_frame(self, image):
+        """
+        check_frame(image)
+        raise a RotopyError (after stopping ffmpeg) if image is not a BGR image
+        """
+        try:
+            check_frame(image, self.frame_count + 1)
+        except RotopyError:
+            self.close(abort=True)
+            raise
+
+    def check_frame_size(self, width, height):
+        """
+        check_frame_size(width, height)
+        start ffmpeg for the first frame, or raise a RotopyError if the next frame of width x height
+        is not the size of the movie
+        """
+        if self.process is None:
+            self.start(width, height)
+        elif (width, height) != self.frame_size:
+            self.close(abort=True)
+            raise RotopyError(f"frame {self.frame_count + 1} is {width}x{height} but the movie is \
+{self.frame_size[0]}x{self.frame_size[1]} - all images must have the same size", ERR_FRAME_SIZE_MISMATCH)
+
+    def send(self, data):
+        """
+        send(data)
+        write data (bytes or a buffer) to the stdin of ffmpeg
+        """
+        try:
+            self.process.stdin.write(data)
+        except OSError as ffmpeg_e:
+            self.close(abort=True)
+            raise RotopyError(f"ffmpeg stopped accepting frames: {ffmpeg_e} - consider using --verbose", \
+ERR_FFMPEG_FAILED) from ffmpeg_e
+
+    def write(self, image):
+        """
+        write(image)
+        send the BGR image to ffmpeg - all images must have the same size
+        """
+        self.check_frame(image)
+        height, width = image.shape[:2]
+        self.check_frame_size(width, height)
+        self.send(np.ascontiguousarray(image).data)
+        self.frame_count = self.frame_count + 1
+        self.last_image = image
+
+    def repeat(self):
+        """
+        repeat()
+        show the previous frame for one more frame time (send it to ffmpeg again)
+        """
+        self.write(self.last_image)
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        signal the end of the frames and wait for ffmpeg to finish the movie file
+        abort True stops ffmpeg and deletes the unfinished movie file instead
+        return the ffmpeg exit status (None if no frame was written or abort is True)
+        """
+        if self.process is None:
+            return None
+        if abort is True:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            self.last_image = None
+            if os.path.isfile(self.movie_file_path):
+                os.remove(self.movie_file_path)
+            log_message(MESSAGE_WARN, f"Output file {self.movie_file_path} has not been created")
+            return None
+        try:
+            self.process.stdin.close()
+        except OSError:
+            log_message(MESSAGE_DEBUG, "ffmpeg has already exited")
+        returncode = self.process.wait()
+        self.process = None
+        self.last_image = None
+        self.returncode = returncode
+        if returncode == 0:
+            log_message(MESSAGE_INFO, f"Output file {self.movie_file_path} successfully created")
+        else:
+            log_message(MESSAGE_ERROR, f"Output file {self.movie_file_path} has not been created - \
+ffmpeg returned a non-zero exit status: {returncode}")
+        return returncode
+
+class FfmpegJpegWriter(FfmpegFrameWriter):
+    """
+    FfmpegJpegWriter(movie_file_path, framerate, output_args)
+    Stream JPEG files unchanged into the stdin of an ffmpeg process that decodes them itself,
+    so that no frame is decoded, converted or copied through Python
+    """
+
+    def input_args(self, width, height):
+        """
+        input_args(width, height)
+        return the ffmpeg options describing the concatenated JPEG files on stdin
+        """
+        return ["-f", "image2pipe", "-c:v", "mjpeg"]
+
+    def write_file(self, jpeg_file_path, frame_size):
+        """
+        write_file(jpeg_file_path, frame_size)
+        send JPEG file jpeg_file_path with frame_size (width, height) to ffmpeg
+        return the number of bytes sent
+        """
+        if self.process is None:
+            self.start(*frame_size)
+        elif frame_size != self.frame_size:
+            self.close(abort=True)
+            raise RotopyError(f"{jpeg_file_path} is {frame_size[0]}x{frame_size[1]} but the movie is \
+{self.frame_size[0]}x{self.frame_size[1]} - all images must have the same size", ERR_FRAME_SIZE_MISMATCH)
+        try:
+            bytes_sent = send_file(jpeg_file_path, self.process.stdin)
+        except BrokenPipeError as ffmpeg_e:
+            self.close(abort=True)
+            raise RotopyError(f"ffmpeg stopped accepting frames: {ffmpeg_e} - consider using --verbose", \
+ERR_FFMPEG_FAILED) from ffmpeg_e
+        self.frame_count = self.frame_count + 1
+        return bytes_sent
+
+def segment_file_path(movie_file_path, segment_number):
+    """
+    segment_file_path(movie_file_path, segment_number)
+    return the path of the movie file of segment segment_number of movie_file_path
+    """
+    movie_file_name, movie_file_extension = os.path.splitext(movie_file_path)
+    return f"{movie_file_name}{SEGMENT_FILE_SUFFIX}{segment_number:03d}{movie_file_extension}"
+
+def concat_movie_files(movie_file_path, segment_file_paths, segment_durations):
+    """
+    concat_movie_files(movie_file_path, segment_file_paths, segment_durations)
+    join the movie files segment_file_paths (in the same directory as movie_file_path) into movie_file_path
+    with the ffmpeg concat demuxer without re-encoding and return the ffmpeg exit status
+    The duration of every segment is set (in seconds) from segment_durations so that no frame time is lost
+    at the joins or at the end of the movie (https://trac.ffmpeg.org/ticket/3164)
+    """
+    segment_list_path = os.path.splitext(movie_file_path)[0] + SEGMENT_LIST_SUFFIX
+    with open(segment_list_path, 'w', encoding="utf-8") as segment_list_file:
+        segment_list_file.write("ffconcat version 1.0\n")
+        for segment_file, segment_duration in zip(segment_file_paths, segment_durations):
+            segment_file_name = os.path.basename(segment_file).replace("'", "'\\''")
+            segment_list_file.write(f"file '{segment_file_name}'\nduration {float(segment_duration):.6f}\n")
+
+    # Appropriate level of logging based upon verbose_mode
+    if settings.VERBOSE_MODE is True:
+        log_level = 'debug'
+    else:
+        log_level = 'panic'
+    ffmpeg_cmd = [FFMPEG_CMD, "-loglevel", log_level, "-y", "-f", "concat", "-safe", "0", \
+"-i", segment_list_path, "-c", "copy", movie_file_path]
+    log_message(MESSAGE_INFO, f"About to run '{subprocess.list2cmdline(ffmpeg_cmd)}'")
+    try:
+        returncode = subprocess.run(ffmpeg_cmd, stdin=subprocess.DEVNULL, check=False).returncode
+    except OSError as ffmpeg_e:
+        raise RotopyError(f"unable to start {FFMPEG_CMD}: {ffmpeg_e}", ERR_FFMPEG_FAILED) from ffmpeg_e
+    finally:
+        os.remove(segment_list_path)
+    return returncode
+
+def matroska_size(size):
+    """
+    matroska_size(size)
+    return the EBML variable length integer of the element data size size
+    """
+    size_length = 1
+    while size >= (1 << (7 * size_length)) - 1:
+        size_length = size_length + 1
+    return (size | (1 << (7 * size_length))).to_bytes(size_length, 'big')
+
+def matroska_element(element_name, data):
+    """
+    matroska_element(element_name, data)
+    return the Matroska element element_name (of MATROSKA_IDS) of data: bytes, an ASCII str or an unsigned int
+    """
+    if isinstance(data, int):
+        data = data.to_bytes(max(1, (data.bit_length() + 7) // 8), 'big')
+    elif isinstance(data, str):
+        data = data.encode('ascii')
+    return MATROSKA_IDS[element_name] + matroska_size(len(data)) + data
+
+def matroska_timestamp(frame_number, framerate):
+    """
+    matroska_timestamp(frame_number, framerate)
+    return the timestamp (in MATROSKA_TIMESTAMP_SCALE nanoseconds) of frame time frame_number at framerate
+    Each timestamp is rounded on its own, so that the frame durations never drift from the frame rate
+    """
+    return round(Fraction(frame_number * 1000000000, MATROSKA_TIMESTAMP_SCALE) / Fraction(str(framerate)))
+
+class DedupFrameWriter(FfmpegFrameWriter):
+    """
+    DedupFrameWriter(movie_file_path, framerate, output_args, scale)
+    --dedup: stream each frame written into ffmpeg as an uncompressed frame of a Matroska stream, shown for
+    one frame time more for each repeat(), so that a run of duplicate frames is encoded as one frame shown for
+    the time of the whole run (variable frame rate)
+    The duration of a frame follows it once the next frame arrives (or the frames end), so no frame is held back
+    """
+
+    def __init__(self, movie_file_path, framerate=None, output_args=None, scale=None):
+        super().__init__(movie_file_path, None, output_args, scale)
+        self.frame_rate = framerate if framerate is not None else DEFAULT_FRAMERATE
+        # the frame time of the frame being shown, whose duration is not known yet
+        self.shown_frame_number = None
+        self.unique_frame_count = 0
+
+    def input_args(self, width, height):
+        """
+        input_args(width, height)
+        return the ffmpeg options describing the Matroska stream on stdin
+        """
+        return ["-f", "matroska"]
+
+    def video_args(self):
+        """
+        video_args()
+        return the ffmpeg options for the video filters and pixel format, keeping the frame durations
+        """
+        return super().video_args() + ["-fps_mode", "vfr"]
+
+    def start(self, width, height):
+        """
+        start(width, height)
+        start ffmpeg and send the header of a Matroska stream of width x height BGR frames
+        """
+        super().start(width, height)
+        self.send(matroska_element('EBML', matroska_element('EBMLVersion', 1) + \
+matroska_element('EBMLReadVersion', 1) + matroska_element('EBMLMaxIDLength', 4) + \
+matroska_element('EBMLMaxSizeLength', 8) + matroska_element('DocType', "matroska") + \
+matroska_element('DocTypeVersion', 4) + matroska_element('DocTypeReadVersion', 2)) + \
+MATROSKA_IDS['Segment'] + MATROSKA_UNKNOWN_SIZE + \
+matroska_element('Info', matroska_element('TimestampScale', MATROSKA_TIMESTAMP_SCALE) + \
+matroska_element('MuxingApp', "rotopy") + matroska_element('WritingApp', "rotopy")) + \
+matroska_element('Tracks', matroska_element('TrackEntry', matroska_element('TrackNumber', 1) + \
+matroska_element('TrackUID', 1) + matroska_element('TrackType', 1) + matroska_element('CodecID', "V_UNCOMPRESSED") + \
+matroska_element('Video', matroska_element('PixelWidth', width) + matroska_element('PixelHeight', height) + \
+matroska_element('ColourSpace', b'BGR\x18')))))
+
+    def end_frame(self):
+        """
+        end_frame()
+        send the duration of the frame being shown, now that the frames after it are known
+        """
+        if self.shown_frame_number is None:
+            return
+        frame_duration = matroska_timestamp(self.frame_count, self.frame_rate) - \
+matroska_timestamp(self.shown_frame_number, self.frame_rate)
+        # a fixed size, so that the size of the block group is known before the duration
+        self.send(MATROSKA_IDS['BlockDuration'] + matroska_size(8) + frame_duration.to_bytes(8, 'big'))
+        self.shown_frame_number = None
+
+    def write(self, image):
+        """
+        write(image)
+        send the BGR image to ffmpeg as the next frame - all images must have the same size
+        """
+        self.check_frame(image)
+        height, width = image.shape[:2]
+        self.check_frame_size(width, height)
+        self.end_frame()
+        image_data = np.ascontiguousarray(image).data
+        # track 1, a timestamp relative to the cluster of 0 and no flags
+        block_header = b'\x81\x00\x00\x00'
+        block_size = len(block_header) + image_data.nbytes
+        block_group_size = len(MATROSKA_IDS['Block']) + len(matroska_size(block_size)) + block_size + \
+len(MATROSKA_IDS['BlockDuration']) + len(matroska_size(8)) + 8
+        timestamp_element = matroska_element('Timestamp', matroska_timestamp(self.frame_count, self.frame_rate))
+        cluster_size = len(timestamp_element) + len(MATROSKA_IDS['BlockGroup']) + \
+len(matroska_size(block_group_size)) + block_group_size
+        self.send(MATROSKA_IDS['Cluster'] + matroska_size(cluster_size) + timestamp_element + \
+MATROSKA_IDS['BlockGroup'] + matroska_size(block_group_size) + MATROSKA_IDS['Block'] + \
+matroska_size(block_size) + block_header)
+        self.send(image_data)
+        self.shown_frame_number = self.frame_count
+        self.frame_count = self.frame_count + 1
+        self.unique_frame_count = self.unique_frame_count + 1
+
+    def repeat(self):
+        """
+        repeat()
+        show the previous frame for one more frame time
+        """
+        self.frame_count = self.frame_count + 1
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        send the duration of the last frame and wait for ffmpeg to finish the movie file
+        abort True stops ffmpeg and deletes the unfinished movie file instead
+        return the ffmpeg exit status (None if no frame was written or abort is True)
+        """
+        if self.process is not None and abort is False:
+            self.end_frame()
+            log_message(MESSAGE_INFO, f"Encoded {self.unique_frame_count} of {self.frame_count} frames \
+(the others are duplicates)")
+        self.shown_frame_number = None
+        return super().close(abort=abort)
+
+# the segment writers and the frame schedule
+# pylint: disable-next=too-many-instance-attributes
+class SegmentedFrameWriter:
+    """
+    SegmentedFrameWriter(movie_file_path, framerate, output_args, segment_count, writer_class)
+    Split the frames into segment_count contiguous segments that are encoded at the same time by
+    separate ffmpeg processes (writer_class objects), then join the segment movie files into
+    movie_file_path with the ffmpeg concat demuxer without re-encoding
+    Every segment starts with a keyframe because it is the first frame its encoder sees
+    Use schedule() to get the order in which the frames must be written
+    """
+
+    def __init__(self, movie_file_path, framerate=None, output_args=None, segment_count=2, \
+writer_class=None):
+        self.movie_file_path = movie_file_path
+        self.framerate = Fraction(str(framerate if framerate is not None else DEFAULT_FRAMERATE))
+        self.output_args = output_args
+        self.segment_count = segment_count
+        self.writer_class = writer_class if writer_class is not None else FfmpegFrameWriter
+        self.writers = []
+        self.segment_frame_counts = []
+        self.segment_order = []
+        self.frame_size = None
+        self.frame_count = 0
+        self.returncode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close(abort=exc_type is not None)
+
+    def segment_file_path(self, segment_number):
+        """
+        segment_file_path(segment_number)
+        return the path of the movie file of segment segment_number
+        """
+        return segment_file_path(self.movie_file_path, segment_number)
+
+    def segment_durations(self):
+        """
+        segment_durations()
+        return the duration (in seconds, as a Fraction) of every segment scheduled
+        """
+        return [Fraction(segment_frame_count) / self.framerate for segment_frame_count in self.segment_frame_counts]
+
+    def schedule(self, filenames):
+        """
+        schedule(filenames)
+        split filenames into contiguous segments and return filenames in the order they must be written:
+        one frame of each segment in turn, so that all the ffmpeg processes are kept busy
+        """
+        segment_count = max(1, min(self.segment_count, len(filenames)))
+        segment_size, segment_remainder = divmod(len(filenames), segment_count)
+        segments = []
+        segment_start = 0
+        for segment_number in range(segment_count):
+            segment_end = segment_start + segment_size + (1 if segment_number < segment_remainder else 0)
+            segments.append(filenames[segment_start:segment_end])
+            segment_start = segment_end
+        self.writers = [self.writer_class(self.segment_file_path(segment_number), self.framerate, \
+self.output_args) for segment_number in range(segment_count)]
+        self.segment_frame_counts = [len(segment) for segment in segments]
+
+        frame_order = []
+        self.segment_order = []
+        for frame_number in range(len(segments[0])):
+            for segment_number, segment in enumerate(segments):
+                if frame_number < len(segment):
+                    frame_order.append(segment[frame_number])
+                    self.segment_order.append(segment_number)
+        self.frame_count = 0
+        return frame_order
+
+    def next_writer(self, frame_size):
+        """
+        next_writer(frame_size)
+        return the writer of the segment that the next frame of frame_size (width, height) belongs to
+        Every segment writer only sees its own frames, so the size of all the frames is checked here
+        """
+        if self.frame_size is None:
+            self.frame_size = frame_size
+        elif frame_size != self.frame_size:
+            self.close(abort=True)
+            raise RotopyError(f"a frame of segment {self.segment_order[self.frame_count]} is \
+{frame_size[0]}x{frame_size[1]} but the movie is {self.frame_size[0]}x{self.frame_size[1]} - \
+all images must have the same size", ERR_FRAME_SIZE_MISMATCH)
+        segment_writer = self.writers[self.segment_order[self.frame_count]]
+        self.frame_count = self.frame_count + 1
+        return segment_writer
+
+    def write(self, image):
+        """
+        write(image)
+        send the BGR image to the encoder of its segment
+        """
+        height, width = image.shape[:2]
+        self.next_writer((width, height)).write(image)
+
+    def write_file(self, jpeg_file_path, frame_size):
+        """
+        write_file(jpeg_file_path, frame_size)
+        send JPEG file jpeg_file_path to the encoder of its segment (writer_class FfmpegJpegWriter)
+        return the number of bytes sent
+        """
+        return self.next_writer(frame_size).write_file(jpeg_file_path, frame_size)
+
+    def concat_segments(self):
+        """
+        concat_segments()
+        join the segment movie files into the movie file with the concat demuxer and return the ffmpeg exit status
+        """
+        segment_file_paths = [self.segment_file_path(segment_number) \
+for segment_number in range(len(self.segment_frame_counts))]
+        returncode = concat_movie_files(self.movie_file_path, segment_file_paths, self.segment_durations())
+        if returncode == 0:
+            for segment_file in segment_file_paths:
+                os.remove(segment_file)
+        return returncode
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        wait for all the segments to be encoded and join them into the movie file
+        abort True stops the encoders and deletes the segment movie files instead
+        return the ffmpeg exit status (None if no frame was written or abort is True)
+        """
+        if not self.writers:
+            return None
+        if abort is True:
+            for segment_writer in self.writers:
+                segment_writer.close(abort=True)
+            self.writers = []
+            return None
+        segment_returncodes = [segment_writer.close() for segment_writer in self.writers]
+        self.writers = []
+        if None in segment_returncodes:
+            return None
+        if any(segment_returncode != 0 for segment_returncode in segment_returncodes):
+            log_message(MESSAGE_ERROR, "a segment was not encoded - the segment movie files have been kept")
+            self.returncode = max(segment_returncodes)
+            return self.returncode
+        self.returncode = self.concat_segments()
+        if self.returncode == 0:
+            log_message(MESSAGE_INFO, f"Output file {self.movie_file_path} successfully created \
+from {len(segment_returncodes)} segments")
+        else:
+            log_message(MESSAGE_ERROR, f"Output file {self.movie_file_path} has not been created - \
+ffmpeg returned a non-zero exit status: {self.returncode}")
+        return self.returncode
+
+# the thumbnails and the sampling of the frames
+# pylint: disable-next=too-many-instance-attributes
+class ContactSheetWriter:
+    """
+    ContactSheetWriter(sheet_file_path, scale, columns)
+    Keep a thumbnail (scaled by scale) of every frame and save them as a grid of columns thumbnails
+    (about as many rows as columns by default) in the image file sheet_file_path once the frames end
+    At most CONTACT_SHEET_MAX_THUMBNAILS thumbnails are kept: once there are that many, every other one is dropped
+    and only every other frame from then on gets one, so the sheet shows every Nth frame of the whole movie
+    """
+
+    def __init__(self, sheet_file_path, scale=None, columns=None):
+        self.sheet_file_path = sheet_file_path
+        self.scale = scale if scale is not None else DEFAULT_CONTACT_SHEET_SCALE
+        self.columns = columns
+        self.thumbnails = []
+        self.frame_size = None
+        self.frame_count = 0
+        self.frame_step = 1
+        self.returncode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close(abort=exc_type is not None)
+
+    def write(self, image):
+        """
+        write(image)
+        add a thumbnail of the BGR image to the contact sheet if it is one of the frames sampled
+        """
+        height, width = image.shape[:2]
+        if self.frame_size is None:
+            self.frame_size = (width, height)
+        elif (width, height) != self.frame_size:
+            self.close(abort=True)
+            raise RotopyError(f"frame {self.frame_count + 1} is {width}x{height} but the contact sheet is of \
+{self.frame_size[0]}x{self.frame_size[1]} frames - all images must have the same size", ERR_FRAME_SIZE_MISMATCH)
+        frame_number = self.frame_count
+        self.frame_count = self.frame_count + 1
+        if frame_number % self.frame_step != 0:
+            return
+        if len(self.thumbnails) == CONTACT_SHEET_MAX_THUMBNAILS:
+            # the thumbnails kept are of every frame_step-th frame, so they stay evenly spaced
+            self.thumbnails = self.thumbnails[::2]
+            self.frame_step = self.frame_step * 2
+            if frame_number % self.frame_step != 0:
+                return
+        self.thumbnails.append(cv2.resize(image, (max(1, round(width * self.scale)), \
+max(1, round(height * self.scale))), interpolation=cv2.INTER_AREA))
+
+    def repeat(self):
+        """
+        repeat()
+        a repeated frame has no thumbnail of its own
+        """
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        save the contact sheet - abort True drops the thumbnails without saving it
+        return 0 if it has been saved (None if no frame was written or abort is True)
+        """
+        if abort is True:
+            self.thumbnails = []
+        if not self.thumbnails:
+            return None
+        columns = self.columns if self.columns is not None else math.ceil(math.sqrt(len(self.thumbnails)))
+        rows = math.ceil(len(self.thumbnails) / columns)
+        thumbnail_height, thumbnail_width = self.thumbnails[0].shape[:2]
+        sheet = np.zeros((rows * thumbnail_height, columns * thumbnail_width, 3), np.uint8)
+        for thumbnail_number, thumbnail in enumerate(self.thumbnails):
+            row, column = divmod(thumbnail_number, columns)
+            sheet[row * thumbnail_height:(row + 1) * thumbnail_height, \
+column * thumbnail_width:(column + 1) * thumbnail_width] = thumbnail
+        self.thumbnails = []
+        if cv2.imwrite(self.sheet_file_path, sheet):
+            self.returncode = 0
+            if self.frame_step > 1:
+                log_message(MESSAGE_INFO, f"Contact sheet {self.sheet_file_path} shows one in every \
+{self.frame_step} of the {self.frame_count} frames")
+            log_message(MESSAGE_INFO, f"Contact sheet {self.sheet_file_path} successfully created")
+        else:
+            self.returncode = 1
+            log_message(MESSAGE_ERROR, f"unable to save contact sheet {self.sheet_file_path}")
+        return self.returncode
+
+class MultiFrameWriter:
+    """
+    MultiFrameWriter(frame_writers)
+    Send every frame to all of frame_writers (e.g. the movie file and the --outputs targets), so that
+    each frame is only read, decoded and annotated once whatever the number of outputs
+    Each ffmpeg process encodes its own output at the same time as the others
+    """
+
+    def __init__(self, frame_writers):
+        self.frame_writers = frame_writers
+        self.returncode = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close(abort=exc_type is not None)
+
+    def write(self, image):
+        """
+        write(image)
+        send the BGR image to every frame writer
+        """
+        for frame_writer in self.frame_writers:
+            frame_writer.write(image)
+
+    def repeat(self):
+        """
+        repeat()
+        show the previous frame for one more frame time in every output
+        """
+        for frame_writer in self.frame_writers:
+            frame_writer.repeat()
+
+    def close(self, abort=False):
+        """
+        close(abort)
+        finish every output - abort True deletes every unfinished output instead
+        return the first non-zero exit status or else the exit status of the first frame writer
+        """
+        returncodes = [frame_writer.close(abort) for frame_writer in self.frame_writers]
+        failed_returncodes = [returncode for returncode in returncodes if returncode not in (0, None)]
+        self.returncode = failed_returncodes[0] if failed_returncodes else returncodes[0]
+        return self.returncode
+
+def send_file(file_path, output_file):
+    """
+    send_file(file_path, output_file)
+    copy the contents of file_path to the binary file object output_file
+    The kernel copies the data with os.sendfile where it supports pipes (Linux),
+    otherwise it is copied in JPEG_COPY_BLOCK_SIZE blocks
+    return the number of bytes copied
+    """
+    # anything already buffered must go first
+    output_file.flush()
+    with open(file_path, 'rb') as input_file:
+        file_size = os.fstat(input_file.fileno()).st_size
+        offset = 0
+        if sys.platform.startswith("linux"):
+            try:
+                while offset < file_size:
+                    bytes_sent = os.sendfile(output_file.fileno(), input_file.fileno(), offset, file_size - offset)
+                    if bytes_sent == 0:
+                        break
+                    offset = offset + bytes_sent
+            except OSError as sendfile_e:
+                if sendfile_e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                log_message(MESSAGE_DEBUG, f"sendfile not supported: {sendfile_e}")
+        input_file.seek(offset)
+        while True:
+            block = input_file.read(JPEG_COPY_BLOCK_SIZE)
+            if not block:
+                break
+            output_file.write(block)
+            offset = offset + len(block)
+    return offset
+
+# every malformed marker returns None
+# pylint: disable-next=too-many-return-statements
+def read_jpeg_size(jpeg_file_path):
+    """
+    read_jpeg_size(jpeg_file_path)
+    return the (width, height) of JPEG file jpeg_file_path from its frame (SOF) header
+    without decoding the image, or None if it is not a readable JPEG file
+    Only the marker segments before the frame header are read
+    """
+    with open(jpeg_file_path, 'rb') as jpeg_file:
+        if jpeg_file.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker_start = jpeg_file.read(1)
+            if marker_start != b'\xff':
+                return None
+            marker = jpeg_file.read(1)
+            # markers may be preceded by any number of 0xFF fill bytes
+            while marker == b'\xff':
+                marker = jpeg_file.read(1)
+            if not marker:
+                return None
+            marker = marker[0]
+            if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # standalone markers have no length
+                continue
+            if marker in (0xD9, 0xDA):
+                # end of image or start of scan before any frame header
+                return None
+            segment_length = jpeg_file.read(2)
+            if len(segment_length) != 2:
+                return None
+            segment_length = struct.unpack(">H", segment_length)[0]
+            if marker in JPEG_SOF_MARKERS:
+                frame_header = jpeg_file.read(5)
+                if len(frame_header) != 5:
+                    return None
+                _precision, height, width = struct.unpack(">BHH", frame_header)
+                return (width, height)
+            jpeg_file.seek(segment_length - 2, os.SEEK_CUR)
+
+def get_movie_file_path(output_directory_path, movie_file, preview):
+    """
+    get_movie_file_path(output_directory_path, movie_file, preview)
+    return the path of the movie file movie_file (None for the default) in output_directory_path
+    for the preview reduction preview (None for a full size movie)
+    """
+    if movie_file is not None:
+        output_movie_file = movie_file
+        log_message(MESSAGE_INFO, f"Also using movie_file {output_movie_file}")
+    else:
+        output_movie_file = DEFAULT_MOVIE_FILENAME
+    return get_output_file_path(output_directory_path, output_movie_file, preview)
+
+def get_output_file_path(output_directory_path, output_file, preview):
+    """
+    get_output_file_path(output_directory_path, output_file, preview)
+    return the path of the output file output_file in output_directory_path
+    for the preview reduction preview (None for a full size output file)
+    """
+    if preview is not None:
+        # keep the full resolution output file
+        output_file_name, output_file_extension = os.path.splitext(output_file)
+        output_file = output_file_name + PREVIEW_MOVIE_SUFFIX + output_file_extension
+    return os.path.join(output_directory_path, output_file)
+
+def preview_encoder_args(movie_file_path):
+    """
+    preview_encoder_args(movie_file_path)
+    return the ffmpeg options for a fast low quality encode of movie_file_path
+    """
+    if os.path.splitext(movie_file_path)[1].lower() in {'.mkv', '.mp4'}:
+        # H.264
+        return ["-preset", "ultrafast", "-crf", "35"]
+    if os.path.splitext(movie_file_path)[1].lower() in ANIMATION_EXTENSIONS:
+        return []
+    return ["-q:v", "20"]
+
+def prepare_movie_file(movie_file_path, overwrite):
+    """
+    prepare_movie_file(movie_file_path, overwrite)
+    delete any existing movie file (prompting unless overwrite is True)
+    return movie_file_path
+    """
+    # Delete output file
+    if os.path.isfile(movie_file_path):
+        if overwrite is True:
+            log_message(MESSAGE_DEBUG, f"Deleting {movie_file_path}")
+            os.remove(movie_file_path)
+        else:
+            # Prompt the user and get input
+            response = input \
+(f"\nMovie file {movie_file_path} exists - use --overwritemovie to avoid in future. Delete [y/N]?")
+            disagree_list = {'no', 'n', ''}
+            if response.lower() in disagree_list:
+                log_message(MESSAGE_ERROR, "Exiting program")
+                sys.exit(ERR_USER_EXIT)  # Use a non-zero exit code to indicate an error
+            else:
+                log_message(MESSAGE_DEBUG, f"deleting {movie_file_path}")
+                os.remove(movie_file_path)
+
+    return movie_file_path
+
+def parse_output_target(output_target):
+    """
+    parse_output_target(output_target)
+    return the dict of file, framerate, scale and columns of the --outputs target
+    output_target FILE[,framerate=N][,scale=F][,columns=N], raising a RotopyError if it is invalid
+    """
+    target_fields = output_target.split(',')
+    target = {'file': target_fields[0], 'framerate': None, 'scale': None, 'columns': None}
+    target_extension = os.path.splitext(target['file'])[1].lower()
+    if target_extension not in MOVIE_EXTENSIONS | ANIMATION_EXTENSIONS | CONTACT_SHEET_EXTENSIONS:
+        raise RotopyError(f"unsupported extension for output target:'{output_target}'", ERR_INVALID_OUTPUT)
+    for target_field in target_fields[1:]:
+        setting_name, separator, setting_value = target_field.partition('=')
+        setting_name = setting_name.strip()
+        try:
+            if separator == "" or setting_name not in OUTPUT_TARGET_SETTINGS:
+                raise ValueError(f"unknown setting {target_field}")
+            target[setting_name] = OUTPUT_TARGET_SETTINGS[setting_name](setting_value)
+        except ValueError as target_e:
+            raise RotopyError(f"invalid output target '{output_target}': {target_e} \
+- use FILE[,framerate=N][,scale=F][,columns=N]", ERR_INVALID_OUTPUT) from target_e
+    if target['framerate'] is not None and (target['framerate'] < 1 or target['framerate'] > 30):
+        raise RotopyError(f"frame rate value {target['framerate']} of '{output_target}' is out of range 1..30", ERR_INVALID_OUTPUT)
+    if (target['scale'] is not None and target['scale'] <= 0) or (target['columns'] is not None and \
+target['columns'] < 1):
+        raise RotopyError(f"scale and columns of '{output_target}' must be more than 0", ERR_INVALID_OUTPUT)
+    return target
+
+def create_output_writer(output_target, output_directory_path, config):
+    """
+    create_output_writer(output_target, output_directory_path, config)
+    return the frame writer of the --outputs target output_target in output_directory_path with the settings
+    of the RotopyConfig config: a ContactSheetWriter for an image file, otherwise an FfmpegFrameWriter
+    with its own frame rate and scale
+    """
+    target = parse_output_target(output_target)
+    target_file_path = prepare_movie_file(get_output_file_path(output_directory_path, target['file'], \
+config.preview), config.overwritemovie)
+    if os.path.splitext(target_file_path)[1].lower() in CONTACT_SHEET_EXTENSIONS:
+        return ContactSheetWriter(target_file_path, target['scale'], target['columns'])
+    target_framerate = sampled_framerate(target['framerate'] if target['framerate'] is not None else config.framerate, \
+config.previewstep)
+    encoder_args = preview_encoder_args(target_file_path) if config.preview is not None else None
+    return FfmpegFrameWriter(target_file_path, target_framerate, encoder_args, target['scale'])
+
+def sampled_framerate(framerate, previewstep):
+    """
+    sampled_framerate(framerate, previewstep)
+    return the ffmpeg frame rate of a movie of every previewstep-th frame at frame rate framerate
+    (None for the ffmpeg default)
+    """
+    if previewstep > 1:
+        # each sampled frame is shown for the time of previewstep frames
+        return f"{framerate if framerate is not None else DEFAULT_FRAMERATE}/{previewstep}"
+    return framerate
+
+def create_frame_writer(movie_file_path, output_directory_path, config, frame_writer_class=FfmpegFrameWriter, \
+segment_count=1):
+    """
+    create_frame_writer(movie_file_path, output_directory_path, config, frame_writer_class, segment_count)
+    return the frame writer of the movie file movie_file_path with the settings of the RotopyConfig config:
+    a frame_writer_class (a DedupFrameWriter with dedup), a SegmentedFrameWriter of segment_count of them, or
+    a MultiFrameWriter of it and the frame writers of the outputs targets in output_directory_path
+    The command line and MovieWriter both write their frames through it
+    """
+    movie_framerate = sampled_framerate(config.framerate, config.previewstep)
+    encoder_args = preview_encoder_args(movie_file_path) if config.preview is not None else None
+    if config.dedup is not None:
+        frame_writer_class = DedupFrameWriter
+    prepare_movie_file(movie_file_path, config.overwritemovie)
+    if segment_count > 1:
+        # --segments encodes contiguous parts of the movie at the same time and joins them
+        return SegmentedFrameWriter(movie_file_path, movie_framerate, encoder_args, segment_count, frame_writer_class)
+    frame_writer = frame_writer_class(movie_file_path, movie_framerate, encoder_args)
+    if config.outputs:
+        # each frame is decoded and annotated once for the movie file and all the targets
+        frame_writer = MultiFrameWriter([frame_writer] + [create_output_writer(output_target, output_directory_path, \
+config) for output_target in config.outputs])
+    return frame_writer
+
+def check_movie_file_extension(movie_file):
+    """
+    check_movie_file_extension(movie_file)
+    raise a RotopyError unless movie_file has a supported movie file extension
+    """
+    _movie_file_name, movie_file_extension = os.path.splitext(movie_file)
+    log_message(MESSAGE_DEBUG, f"Movie file extension = {movie_file_extension}")
+    if movie_file_extension == "":
+        raise RotopyError(f"invalid file extension for movie file:'{movie_file_extension}' \
+    does not exist", ERR_INVALID_MOVIE_EXT)
+    else:
+        if str.lower(movie_file_extension) in MOVIE_EXTENSIONS:
+            log_message(MESSAGE_INFO, f"supported extension for movie file:'{movie_file_extension}'")
+        else:
+            raise RotopyError(f"unsupported extension for movie file:'{movie_file_extension}'", \
+ERR_USUPPORTED_MOVIE_EXT)
@@ -0,0 +1,8 @@
+"""
+RotoPy tests: import the rotopy modules from the directory above
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+"""
+RotoPy tests: --dedup duplicate frame decisions
+"""
+
+import numpy as np
+from rotopy_frames import frame_hash, FrameDeduplicator
+
+def frame(value, height=48, width=64):
+    """
+    frame(value, height, width)
+    return a flat BGR frame of value
+    """
+    return np.full((height, width, 3), value, np.uint8)
+
+def duplicates(threshold, images):
+    """
+    duplicates(threshold, images)
+    return the duplicate decisions of a FrameDeduplicator(threshold) for images in order
+    """
+    deduplicator = FrameDeduplicator(threshold)
+    return [deduplicator.is_duplicate(frame_hash(image), image) for image in images]
+
+def test_identical_frames_are_duplicates():
+    """identical frames are merged at threshold 0"""
+    image = np.random.default_rng(1).integers(0, 256, (48, 64, 3), np.uint8)
+    assert duplicates(0, [image, image.copy(), image.copy()]) == [False, True, True]
+
+def test_fade_is_not_merged():
+    """flat frames of different brightness all hash to 0 but are not duplicates"""
+    images = [frame(value) for value in range(0, 200, 10)]
+    assert frame_hash(images[0]) == frame_hash(images[-1])
+    assert not any(duplicates(0, images))
+    assert not any(duplicates(2, images))
+
+def test_small_change_is_not_merged():
+    """a frame with one different pixel has the same hash but is not a duplicate at threshold 0"""
+    image = np.random.default_rng(2).integers(0, 256, (48, 64, 3), np.uint8)
+    changed_image = image.copy()
+    changed_image[10, 10] = 255 - changed_image[10, 10]
+    assert frame_hash(image) == frame_hash(changed_image)
+    assert duplicates(0, [image, changed_image]) == [False, False]
+
+def test_threshold_merges_noise_only():
+    """with a threshold, noise of a level is merged but a brightness change of 11 levels is not"""
+    rng = np.random.default_rng(3)
+    image = rng.integers(20, 230, (48, 64, 3), np.uint8)
+    noisy_image = (image.astype(np.int16) + rng.integers(-1, 2, image.shape)).astype(np.uint8)
+    brighter_image = image + 11
+    assert duplicates(2, [image, noisy_image]) == [False, True]
+    assert duplicates(2, [image, brighter_image]) == [False, False]
+
+def test_run_frame_is_kept_before_annotation():
+    """the first frame of a run is compared as it was before it was annotated in place"""
+    image = frame(100)
+    deduplicator = FrameDeduplicator(0)
+    assert deduplicator.is_duplicate(frame_hash(image), image) is False
+    original_image = image.copy()
+    image[:10] = 0
+    assert deduplicator.is_duplicate(frame_hash(original_image), original_image) is True
+    assert deduplicator.duplicate_count == 1
@@ -0,0 +1,194 @@
+"""
+RotoPy tests: the frame index, renaming frames and the build manifest
+"""
+
+import os
+from datetime import datetime
+import pytest
+import rotopy_settings as settings
+from rotopy_common import DEFAULT_BACKUP_DIR, DEFAULT_MANIFEST_FILENAME, DEFAULT_RENAME_JOURNAL_FILENAME, \
+ERR_RENAME_DUPLICATE
+from rotopy_index import BuildManifest, FrameIndex, RenameJournal, RenamePlan, undo_renames
+
+MODIFY_DATE = datetime(2023, 5, 1, 10, 20, 30)
+OTHER_MODIFY_DATE = datetime(2023, 5, 1, 10, 20, 31)
+
+def write_frames(directory_path, filenames):
+    """
+    write_frames(directory_path, filenames)
+    create a frame file holding its own name for each of filenames and return the scanned FrameIndex
+    """
+    for filename in filenames:
+        (directory_path / filename).write_text(filename, 'utf-8')
+    frame_index = FrameIndex(str(directory_path))
+    frame_index.scan()
+    return frame_index
+
+def test_rename_to_modify_dates(tmp_path):
+    """the frames are renamed to their modify dates, backed up and renamed back by undo_renames()"""
+    frame_index = write_frames(tmp_path, ["a.png", "b.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("a.png", MODIFY_DATE)
+    rename_plan.add("b.png", OTHER_MODIFY_DATE)
+    assert rename_plan.new_name("a.png") == "230501102030.png"
+    assert rename_plan.check() == [("a.png", "230501102030.png"), ("b.png", "230501102031.png")]
+
+    journal = RenameJournal(str(tmp_path / DEFAULT_RENAME_JOURNAL_FILENAME))
+    rename_plan.apply(journal)
+    assert frame_index.files([".png"]) == ["230501102030.png", "230501102031.png"]
+    assert (tmp_path / "230501102030.png").read_text('utf-8') == "a.png"
+    assert (tmp_path / DEFAULT_BACKUP_DIR / "a.png").read_text('utf-8') == "a.png"
+
+    undo_renames(str(tmp_path))
+    assert (tmp_path / "a.png").read_text('utf-8') == "a.png"
+    assert (tmp_path / "b.png").read_text('utf-8') == "b.png"
+    assert not (tmp_path / "230501102030.png").exists()
+    journal.load()
+    assert not journal.batches
+
+def test_files_without_a_date_keep_their_names(tmp_path):
+    """a frame without a modify date and a frame already named after it are not renamed"""
+    frame_index = write_frames(tmp_path, ["a.png", "230501102030.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("a.png", None)
+    rename_plan.add("230501102030.png", MODIFY_DATE)
+    assert rename_plan.new_name("a.png") == "a.png"
+    assert not rename_plan.check()
+
+def test_shared_modify_date_is_a_collision(tmp_path):
+    """two frames with the same modify date stop the rename before any file is renamed"""
+    frame_index = write_frames(tmp_path, ["a.png", "b.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("a.png", MODIFY_DATE)
+    rename_plan.add("b.png", MODIFY_DATE)
+    with pytest.raises(SystemExit) as exit_info:
+        rename_plan.check()
+    assert exit_info.value.code == ERR_RENAME_DUPLICATE
+    assert sorted(os.listdir(tmp_path)) == ["a.png", "b.png"]
+
+def test_existing_new_name_is_a_collision(tmp_path):
+    """a frame is not renamed over another frame that keeps its name"""
+    frame_index = write_frames(tmp_path, ["a.png", "230501102030.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("a.png", MODIFY_DATE)
+    with pytest.raises(SystemExit) as exit_info:
+        rename_plan.check()
+    assert exit_info.value.code == ERR_RENAME_DUPLICATE
+
+def test_chained_renames_are_ordered(tmp_path):
+    """a frame is renamed only once the frame with its new name has been renamed"""
+    frame_index = write_frames(tmp_path, ["230501102030.png", "z.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("z.png", MODIFY_DATE)
+    rename_plan.add("230501102030.png", OTHER_MODIFY_DATE)
+    assert rename_plan.check() == [("230501102030.png", "230501102031.png"), ("z.png", "230501102030.png")]
+    rename_plan.apply(RenameJournal(str(tmp_path / DEFAULT_RENAME_JOURNAL_FILENAME)))
+    assert (tmp_path / "230501102030.png").read_text('utf-8') == "z.png"
+    assert (tmp_path / "230501102031.png").read_text('utf-8') == "230501102030.png"
+
+def test_cyclic_renames_are_a_collision(tmp_path):
+    """frames that would be renamed to each other stop the rename"""
+    frame_index = write_frames(tmp_path, ["230501102030.png", "230501102031.png"])
+    rename_plan = RenamePlan(str(tmp_path), frame_index)
+    rename_plan.add("230501102030.png", OTHER_MODIFY_DATE)
+    rename_plan.add("230501102031.png", MODIFY_DATE)
+    with pytest.raises(SystemExit) as exit_info:
+        rename_plan.check()
+    assert exit_info.value.code == ERR_RENAME_DUPLICATE
+
+def test_undo_skips_files_that_were_not_renamed(tmp_path):
+    """undo_renames() only renames back the files of an interrupted batch that were renamed"""
+    frame_index = write_frames(tmp_path, ["a.png", "230501102031.png"])
+    journal = RenameJournal(str(tmp_path / DEFAULT_RENAME_JOURNAL_FILENAME))
+    journal.batches.append({'created': "2023-05-01T10:20:30+00:00", \
+'renames': [["a.png", "230501102030.png"], ["b.png", "230501102031.png"]]})
+    journal.save()
+    undo_renames(frame_index.input_directory_path)
+    assert sorted(os.listdir(tmp_path)) == ["a.png", "b.png", DEFAULT_RENAME_JOURNAL_FILENAME]
+
+@pytest.fixture(name="manifest")
+def fixture_manifest(tmp_path):
+    """
+    fixture_manifest(tmp_path)
+    return an empty BuildManifest with the source frames a.png and b.png in tmp_path/in
+    and their JSON and JPEG files in tmp_path/out
+    """
+    (tmp_path / "in").mkdir()
+    (tmp_path / "out").mkdir()
+    for filename in ("a", "b"):
+        (tmp_path / "in" / f"{filename}.png").write_text(filename, 'utf-8')
+        (tmp_path / "out" / f"{filename}.json").write_text("{}", 'utf-8')
+        (tmp_path / "out" / f"{filename}.jpg").write_text(filename, 'utf-8')
+    return BuildManifest(str(tmp_path / "out" / DEFAULT_MANIFEST_FILENAME))
+
+def test_refresh_keeps_unchanged_entries(manifest, tmp_path):
+    """an entry is kept while the source file is unchanged and replaced once its contents change"""
+    source_path = str(tmp_path / "in" / "a.png")
+    entry = manifest.refresh("a.png", source_path)
+    entry['metadata'] = {'width': 512}
+    assert manifest.refresh("a.png", source_path) is entry
+
+    # same contents with a new mtime - the metadata record (with the file modify date) is out of date
+    os.utime(source_path, ns=(0, 0))
+    assert manifest.refresh("a.png", source_path) is entry
+    assert 'metadata' not in entry
+
+    (tmp_path / "in" / "a.png").write_text("changed", 'utf-8')
+    changed_entry = manifest.refresh("a.png", source_path)
+    assert changed_entry is not entry
+    assert changed_entry['sha1'] != entry['sha1']
+
+def test_prune_deletes_stale_outputs(manifest, tmp_path):
+    """the JSON and JPEG files of a source file that is no longer there are deleted"""
+    for filename in ("a.png", "b.png"):
+        manifest.record_jpeg(filename, str(tmp_path / "in" / filename))
+    manifest.prune(["a.png"], str(tmp_path / "out"))
+    assert list(manifest.entries) == ["a.png"]
+    assert sorted(os.listdir(tmp_path / "out")) == ["a.jpg", "a.json"]
+    assert manifest.rebuilt['pruned'] == 1
+
+def test_jpeg_current(manifest, tmp_path, monkeypatch):
+    """a JPEG file is current once recorded, unless it has been deleted or the annotate setting has changed"""
+    source_path = str(tmp_path / "in" / "a.png")
+    output_directory_path = str(tmp_path / "out")
+    assert manifest.jpeg_current("a.png", source_path, output_directory_path) is False
+    manifest.record_jpeg("a.png", source_path)
+    assert manifest.jpeg_current("a.png", source_path, output_directory_path) is True
+
+    monkeypatch.setattr(settings, "ANNOTATE_MODE", not settings.ANNOTATE_MODE)
+    assert manifest.jpeg_current("a.png", source_path, output_directory_path) is False
+    monkeypatch.undo()
+    os.remove(tmp_path / "out" / "a.jpg")
+    assert manifest.jpeg_current("a.png", source_path, output_directory_path) is False
+
+def test_movie_current(manifest, tmp_path, monkeypatch):
+    """a movie file is current while its frames, its settings and the file itself are unchanged"""
+    filenames = ["a.png", "b.png"]
+    for filename in filenames:
+        manifest.refresh(filename, str(tmp_path / "in" / filename))
+    movie_file_path = str(tmp_path / "out" / "movie.mp4")
+    (tmp_path / "out" / "movie.mp4").write_text("movie", 'utf-8')
+    assert manifest.movie_current(movie_file_path, filenames) is False
+    manifest.record_movie(movie_file_path, filenames)
+    assert manifest.movie_current(movie_file_path, filenames) is True
+    assert manifest.movie_current(movie_file_path, ["b.png", "a.png"]) is False
+
+    monkeypatch.setattr(settings, "FRAMERATE_VAL", settings.FRAMERATE_VAL + 1)
+    assert manifest.movie_current(movie_file_path, filenames) is False
+    monkeypatch.undo()
+
+    (tmp_path / "in" / "b.png").write_text("changed", 'utf-8')
+    manifest.refresh("b.png", str(tmp_path / "in" / "b.png"))
+    assert manifest.movie_current(movie_file_path, filenames) is False
+
+def test_manifest_round_trip(manifest, tmp_path):
+    """a saved manifest is loaded back, and a missing manifest file loads as empty"""
+    manifest.record_jpeg("a.png", str(tmp_path / "in" / "a.png"))
+    manifest.save()
+    loaded_manifest = BuildManifest(manifest.manifest_path)
+    loaded_manifest.load()
+    assert loaded_manifest.entries == manifest.entries
+
+    missing_manifest = BuildManifest(str(tmp_path / "missing.manifest"))
+    missing_manifest.load()
+    assert not missing_manifest.entries and missing_manifest.movie is None
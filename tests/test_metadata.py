@@ -0,0 +1,107 @@
+"""
+RotoPy tests: reading the EXIF tags and writing the JSON files
+"""
+
+import json
+import struct
+import zlib
+import pytest
+import rotopy_metadata
+from rotopy_metadata import StaticExifBackend, create_exif_backend, create_json_file, png_keyword_tag_name, \
+read_png_text_chunks, get_png_tags
+
+SD_PARAMETERS = "a horse, <lora:gallop:0.8>\nNegative prompt: blurry\n\
+Steps: 20, Sampler: Euler a, CFG scale: 7, Seed: 1234, Size: 512x768, Model: sd15"
+
+@pytest.fixture(name="static_backend")
+def fixture_static_backend(monkeypatch):
+    """
+    fixture_static_backend(monkeypatch)
+    return the StaticExifBackend returned by create_exif_backend() for the test
+    """
+    static_backend = StaticExifBackend({'00001-1234.png': {'Parameters': SD_PARAMETERS, \
+'FileModifyDate': "2023:05:01 10:20:30+00:00", 'ImageWidth': 512, 'ImageHeight': 768}})
+    monkeypatch.setattr(rotopy_metadata, "EXIF_BACKEND", static_backend)
+    return static_backend
+
+def test_create_exif_backend_returns_the_test_double(static_backend):
+    """create_exif_backend() returns EXIF_BACKEND when it is set"""
+    assert create_exif_backend() is static_backend
+
+def test_json_file_from_static_tags(static_backend, tmp_path):
+    """the tags read through the backend are written to the JSON file of the frame"""
+    png_file_path = str(tmp_path / "00001-1234.png")
+    with create_exif_backend() as exif_backend:
+        png_tags = exif_backend.read_tags([png_file_path], ["-Parameters", "-FileModifyDate"])[png_file_path]
+    assert static_backend.read_calls == [([png_file_path], ["-Parameters", "-FileModifyDate"])]
+    assert png_tags['SourceFile'] == png_file_path
+
+    metadata_record = create_json_file("00001-1234.png", png_tags, str(tmp_path))
+    assert metadata_record['modify_date'] == "2023-05-01T10:20:30+00:00"
+    assert (metadata_record['width'], metadata_record['height']) == (512, 768)
+    with open(tmp_path / "00001-1234.json", 'r', -1, 'utf-8') as json_file:
+        json_data = json.load(json_file)
+    assert json_data['Prompt'] == "a horse, <lora:gallop:0.8>"
+    assert json_data['Negative prompt'] == "blurry"
+    assert json_data['Seed'] == 1234
+
+def test_missing_file_has_no_tags(static_backend):
+    """a file without canned tags only has its SourceFile"""
+    assert static_backend.read_tags(["/frames/other.png"], ["-Parameters"]) == \
+{"/frames/other.png": {'SourceFile': "/frames/other.png"}}
+
+def png_chunk(chunk_type, chunk_data):
+    """
+    png_chunk(chunk_type, chunk_data)
+    return the PNG chunk of chunk_type holding chunk_data
+    """
+    return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + \
+struct.pack('>I', zlib.crc32(chunk_type + chunk_data))
+
+def write_png(png_file_path, chunks, width=640, height=480):
+    """
+    write_png(png_file_path, chunks, width, height)
+    write a PNG file of width x height with the chunks between its IHDR and IDAT chunks
+    """
+    with open(png_file_path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+b"".join(chunks) + png_chunk(b'IDAT', zlib.compress(b"\0")) + png_chunk(b'tEXt', b"after\0the pixels") + \
+png_chunk(b'IEND', b""))
+
+def test_png_text_chunks(tmp_path):
+    """tEXt, zTXt and iTXt (compressed or not) chunks are read up to the first IDAT chunk"""
+    png_file_path = str(tmp_path / "frame.png")
+    write_png(png_file_path, [png_chunk(b'tEXt', b"parameters\0a horse, caf\xe9"), \
+png_chunk(b'zTXt', b"comment\0\0" + zlib.compress(b"zipped text")), \
+png_chunk(b'iTXt', b"title\0\0\0en\0Titel\0" + "\u00e9t\u00e9".encode('utf-8')), \
+png_chunk(b'iTXt', b"date:modify\0\1\0\0\0" + zlib.compress(b"2023-05-01T10:20:30+00:00"))])
+    png_size, png_text = read_png_text_chunks(png_file_path)
+    assert png_size == (640, 480)
+    assert png_text == {'parameters': "a horse, caf\u00e9", 'comment': "zipped text", 'title': "\u00e9t\u00e9", \
+'date:modify': "2023-05-01T10:20:30+00:00"}
+
+def test_png_tags(tmp_path):
+    """get_png_tags() returns the requested tags under their exiftool names"""
+    png_file_path = str(tmp_path / "frame.png")
+    write_png(png_file_path, [png_chunk(b'tEXt', b"parameters\0Steps: 20"), \
+png_chunk(b'tEXt', b"date:modify\x002023-05-01T10:20:30+00:00")], 512, 768)
+    png_tags = get_png_tags(png_file_path, ["-SourceFile", "-Datemodify", "-Parameters", "-ImageWidth", "-ImageHeight"])
+    assert png_tags == {'SourceFile': png_file_path, 'Datemodify': "2023-05-01T10:20:30+00:00", \
+'Parameters': "Steps: 20", 'ImageWidth': 512, 'ImageHeight': 768}
+    assert png_keyword_tag_name("date:modify") == "Datemodify"
+
+def test_invalid_png_files(tmp_path):
+    """files that are not PNG files, invalid chunks and truncated files give what could be read"""
+    not_png_file_path = tmp_path / "frame.png"
+    not_png_file_path.write_bytes(b"GIF89a")
+    assert read_png_text_chunks(str(not_png_file_path)) == (None, {})
+
+    png_file_path = str(tmp_path / "invalid.png")
+    write_png(png_file_path, [png_chunk(b'zTXt', b"broken\0\0not zlib"), png_chunk(b'tEXt', b"parameters\0kept")])
+    assert read_png_text_chunks(png_file_path) == ((640, 480), {'parameters': "kept"})
+
+    with open(png_file_path, 'rb') as png_file:
+        png_data = png_file.read()
+    truncated_file_path = tmp_path / "truncated.png"
+    truncated_file_path.write_bytes(png_data[:png_data.index(b'tEXt') + 20])
+    assert read_png_text_chunks(str(truncated_file_path))[0] == (640, 480)
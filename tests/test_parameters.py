@@ -0,0 +1,50 @@
+"""
+RotoPy tests: parsing the A1111 parameters text
+"""
+
+from rotopy_metadata import sd_extract_parameters, sd_settings_fields
+
+def test_prompt_negative_prompt_and_settings():
+    """the prompt, negative prompt and typed settings of a multi-line parameters text"""
+    sd_parameters = sd_extract_parameters("a horse, galloping: fast\nin a field\nNegative prompt: blurry, \
+(worst quality:1.4)\nSteps: 20, Sampler: DPM++ 2M Karras, CFG scale: 7.5, Seed: 1234, Size: 512x768, \
+Model hash: abc123, Model: sd15")
+    assert sd_parameters == {'Prompt': "a horse, galloping: fast\nin a field", \
+'Negative prompt': "blurry, (worst quality:1.4)", 'Steps': 20, 'Sampler': "DPM++ 2M Karras", 'CFG scale': 7.5, \
+'Seed': 1234, 'Size': [512, 768], 'Model hash': "abc123", 'Model': "sd15"}
+
+def test_quoted_values():
+    """quoted values may hold commas, colons and escaped quotes"""
+    sd_parameters = sd_extract_parameters('a horse\nSteps: 20, Sampler: Euler a, Seed: 5, \
+Lora hashes: "gallop: 1a2b, field: 3c4d", TI hashes: "easynegative: 99aa", Version: v1.6.0')
+    assert sd_parameters['Lora hashes'] == {'gallop': "1a2b", 'field': "3c4d"}
+    assert sd_parameters['TI hashes'] == "easynegative: 99aa"
+    assert sd_parameters['Version'] == "v1.6.0"
+    assert sd_settings_fields('Steps: 20, Template: "say \\"hi\\", then: go", Seed: 1') == \
+{'Steps': "20", 'Template': 'say "hi", then: go', 'Seed': "1"}
+
+def test_lora_tags():
+    """the LoRAs of the prompt get their weights (1.0 by default) and hashes"""
+    sd_parameters = sd_extract_parameters('<lora:gallop:0.8> a horse <lora:field>\nSteps: 20, Seed: 5, \
+Lora hashes: "gallop: 1a2b"')
+    assert sd_parameters['Lora'] == [{'name': "gallop", 'weight': 0.8, 'hash': "1a2b"}, \
+{'name': "field", 'weight': 1.0, 'hash': None}]
+
+def test_hires_fields():
+    """the Hires fields are typed"""
+    sd_parameters = sd_extract_parameters("a horse\nSteps: 20, Seed: 5, Denoising strength: 0.45, \
+Hires upscale: 2, Hires steps: 10, Hires upscaler: Latent, Hires resize: 1024x1536")
+    assert (sd_parameters['Denoising strength'], sd_parameters['Hires upscale'], sd_parameters['Hires steps'], \
+sd_parameters['Hires upscaler'], sd_parameters['Hires resize']) == (0.45, 2.0, 10, "Latent", [1024, 1536])
+
+def test_text_without_settings_line():
+    """a last line with prompt weights is not taken for the settings line"""
+    assert sd_extract_parameters("a horse, (best quality:1.2), (detailed:1.1)") == \
+{'Prompt': "a horse, (best quality:1.2), (detailed:1.1)"}
+    assert sd_extract_parameters("a horse\nNegative prompt: blurry") == \
+{'Prompt': "a horse", 'Negative prompt': "blurry"}
+
+def test_unexpected_values_are_kept_as_text():
+    """a typed field with an unexpected value is kept as text"""
+    sd_parameters = sd_extract_parameters("a horse\nSteps: 20, Seed: random, Size: big")
+    assert (sd_parameters['Steps'], sd_parameters['Seed'], sd_parameters['Size']) == (20, "random", "big")
@@ -0,0 +1,103 @@
+"""
+RotoPy tests: frame writer helpers that need no ffmpeg
+"""
+
+import struct
+from fractions import Fraction
+import numpy as np
+import cv2
+import pytest
+from rotopy_common import ERR_FRAME_SIZE_MISMATCH, ERR_INVALID_FRAME, RotopyError
+from rotopy_writers import SegmentedFrameWriter, check_frame, matroska_size, matroska_element, matroska_timestamp, read_jpeg_size
+
+def test_matroska_size():
+    """sizes are EBML variable length integers, avoiding the all ones (unknown size) values"""
+    assert matroska_size(0) == b'\x80'
+    assert matroska_size(126) == b'\xfe'
+    assert matroska_size(127) == b'\x40\x7f'
+    assert matroska_size(300) == b'\x41\x2c'
+
+def test_matroska_element():
+    """elements are their ID, size and data"""
+    assert matroska_element('TrackNumber', 1) == b'\xd7\x81\x01'
+    assert matroska_element('DocType', "matroska") == b'\x42\x82\x88matroska'
+    assert matroska_element('PixelWidth', 0) == b'\xb0\x81\x00'
+
+def test_matroska_timestamps_do_not_drift():
+    """--dedup frame durations add up to the frame times of the whole movie"""
+    frame_durations = [3, 1, 2, 1, 4, 1]
+    frame_numbers = [sum(frame_durations[:frame_index]) for frame_index in range(len(frame_durations) + 1)]
+    for framerate in (12, 25, Fraction(25, 3), "30000/1001"):
+        timestamps = [matroska_timestamp(frame_number, framerate) for frame_number in frame_numbers]
+        durations = [end - start for start, end in zip(timestamps, timestamps[1:])]
+        assert sum(durations) == round(Fraction(12 * 1000000) / Fraction(str(framerate)))
+        assert all(abs(duration - frame_duration * 1000000 / Fraction(str(framerate))) <= 1 \
+for duration, frame_duration in zip(durations, frame_durations))
+    assert matroska_timestamp(12, 12) == 1000000
+
+def test_jpeg_size_of_encoded_files(tmp_path):
+    """the size of baseline and progressive JPEG files is read from their frame header"""
+    image = np.zeros((123, 321, 3), np.uint8)
+    for jpeg_name, encode_params in (("baseline.jpg", []), ("progressive.jpg", [cv2.IMWRITE_JPEG_PROGRESSIVE, 1])):
+        jpeg_file_path = str(tmp_path / jpeg_name)
+        cv2.imwrite(jpeg_file_path, image, encode_params)
+        assert read_jpeg_size(jpeg_file_path) == (321, 123)
+
+def test_jpeg_size_after_segments_and_fill_bytes(tmp_path):
+    """APPn segments, standalone markers and fill bytes before the frame header are skipped"""
+    jpeg_file_path = tmp_path / "frame.jpg"
+    jpeg_file_path.write_bytes(b'\xff\xd8' + b'\xff\xe1' + struct.pack('>H', 8) + b'Exif\0\0' + b'\xff\x01' + \
+b'\xff\xff\xff\xc2' + struct.pack('>HBHHB', 11, 8, 600, 800, 3))
+    assert read_jpeg_size(str(jpeg_file_path)) == (800, 600)
+
+def test_jpeg_size_of_invalid_files(tmp_path):
+    """files that are not JPEG files or have no frame header give None"""
+    for jpeg_data in (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff\xda' + struct.pack('>H', 8), b'\xff\xd8\xff\xd9', \
+b'\xff\xd8\xff\xc0\x00\x11\x08', b'\xff\xd8\xff\xe0\x00', b'\xff\xd8\x00'):
+        jpeg_file_path = tmp_path / "frame.jpg"
+        jpeg_file_path.write_bytes(jpeg_data)
+        assert read_jpeg_size(str(jpeg_file_path)) is None
+
+def test_segment_schedule_interleaves_segments():
+    """the frames are split into contiguous segments, the first ones a frame longer, and written in turn"""
+    segmented_writer = SegmentedFrameWriter("/movies/movie.mp4", 25, segment_count=3)
+    filenames = [f"{frame_number}.png" for frame_number in range(8)]
+    assert segmented_writer.schedule(filenames) == \
+["0.png", "3.png", "6.png", "1.png", "4.png", "7.png", "2.png", "5.png"]
+    assert segmented_writer.segment_frame_counts == [3, 3, 2]
+    assert segmented_writer.segment_order == [0, 1, 2, 0, 1, 2, 0, 1]
+    assert [segment_writer.movie_file_path for segment_writer in segmented_writer.writers] == \
+[segmented_writer.segment_file_path(segment_number) for segment_number in range(3)]
+
+def test_segment_schedule_of_few_frames():
+    """there are never more segments than frames"""
+    segmented_writer = SegmentedFrameWriter("/movies/movie.mp4", 25, segment_count=4)
+    assert segmented_writer.schedule(["0.png", "1.png"]) == ["0.png", "1.png"]
+    assert segmented_writer.segment_frame_counts == [1, 1]
+    assert len(segmented_writer.writers) == 2
+
+def test_segment_durations_add_up_to_the_movie():
+    """the segment durations are exact fractions that add up to the duration of all the frames"""
+    segmented_writer = SegmentedFrameWriter("/movies/movie.mp4", "30000/1001", segment_count=3)
+    segmented_writer.schedule([f"{frame_number}.png" for frame_number in range(10)])
+    assert segmented_writer.segment_durations() == [Fraction(4 * 1001, 30000), Fraction(3 * 1001, 30000), \
+Fraction(3 * 1001, 30000)]
+    assert sum(segmented_writer.segment_durations()) == Fraction(10 * 1001, 30000)
+
+def test_segment_frame_size_mismatch():
+    """a frame of another size in any segment is an error"""
+    segmented_writer = SegmentedFrameWriter("/movies/movie.mp4", 25, segment_count=2)
+    segmented_writer.schedule(["0.png", "1.png"])
+    assert segmented_writer.next_writer((64, 48)) is segmented_writer.writers[0]
+    with pytest.raises(RotopyError) as error_info:
+        segmented_writer.next_writer((48, 64))
+    assert error_info.value.exit_code == ERR_FRAME_SIZE_MISMATCH
+
+def test_frames_must_be_bgr_images():
+    """only height x width x 3 arrays of uint8 are frames"""
+    check_frame(np.zeros((48, 64, 3), np.uint8), 1)
+    for image in (np.zeros((48, 64, 3), np.float32), np.zeros((48, 64), np.uint8), np.zeros((48, 64, 4), np.uint8), \
+[[0, 0, 0]]):
+        with pytest.raises(RotopyError) as error_info:
+            check_frame(image, 1)
+        assert error_info.value.exit_code == ERR_INVALID_FRAME